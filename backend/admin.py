@@ -1,7 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 
 from backend.models import (
+    STATUS_CHOICES,
     Category,
     Contact,
     Order,
@@ -13,6 +14,7 @@ from backend.models import (
     Shop,
     User,
 )
+from backend.stock import change_order_statuses
 
 
 @admin.register(User)
@@ -76,14 +78,57 @@ class ProductParameterAdmin(admin.ModelAdmin):
     pass
 
 
+def order_status_action(status, label):
+    """
+    действие админки для смены статуса выбранных заказов
+
+    Через него меняются и заказы с позициями нескольких магазинов,
+    которые сами магазины изменить не могут.
+    """
+
+    @admin.action(description=f"Перевести в статус «{label}»")
+    def action(modeladmin, request, queryset):
+        results = change_order_statuses(
+            [(order_id, status) for order_id in queryset.values_list("id", flat=True)]
+        )
+        changed = [result for result in results if result["result"] == "success"]
+        if changed:
+            modeladmin.message_user(request, f"Изменено заказов: {len(changed)}")
+        for result in results:
+            if result["result"] == "failure":
+                modeladmin.message_user(
+                    request,
+                    f"Заказ {result['order_id']}: {result['message']}",
+                    messages.WARNING,
+                )
+
+    action.__name__ = f"set_status_{status}"
+    return action
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    pass
+    actions = [
+        order_status_action(status, label)
+        for status, label in STATUS_CHOICES
+        if status not in ("basket", "new")
+    ]
 
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    pass
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Order.objects.filter(id=obj.order_id).refresh_totals()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Order.objects.filter(id=obj.order_id).refresh_totals()
+
+    def delete_queryset(self, request, queryset):
+        orders = list(queryset.values_list("order_id", flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        Order.objects.filter(id__in=orders).refresh_totals()
 
 
 @admin.register(Contact)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BackendConfig(AppConfig):
@@ -6,5 +7,9 @@ class BackendConfig(AppConfig):
 
     def ready(self):
         """
-        импортируем сигналы
+        импортируем сигналы и создаем поисковые индексы после миграций
         """
+        from backend import signals  # noqa: F401
+        from backend.search import create_search_indexes
+
+        post_migrate.connect(create_search_indexes, sender=self)
@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from redis.exceptions import RedisError
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from backend.models import User
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_PREFIX = "auth:token"
+# пароль в снимок не попадает: у восстановленного пользователя поле
+# отложено и загрузится из базы при обращении
+SNAPSHOT_EXCLUDE = {"password"}
+
+
+def token_cache_key(key):
+    # сами токены в имена ключей Redis не пишем
+    return f"{AUTH_CACHE_PREFIX}:{sha256(key.encode()).hexdigest()}"
+
+
+class LocalTokenCache:
+    """
+    Класс для кэша снимков токенов в памяти процесса с коротким TTL
+
+    Сигналы сбрасывают записи только в своем процессе, поэтому
+    в остальных снимок живет не дольше AUTH_CACHE_LOCAL_TTL секунд.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, snapshot):
+        with self.lock:
+            if len(self.entries) >= settings.AUTH_CACHE_LOCAL_SIZE:
+                self.entries.clear()
+            self.entries[key] = (
+                time.monotonic() + settings.AUTH_CACHE_LOCAL_TTL,
+                snapshot,
+            )
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalTokenCache()
+
+
+def make_snapshot(token):
+    user = token.user
+    return {
+        "created": token.created,
+        "user": {
+            field.attname: getattr(user, field.attname)
+            for field in User._meta.concrete_fields
+            if field.attname not in SNAPSHOT_EXCLUDE
+        },
+    }
+
+
+def restore_token(key, snapshot):
+    """
+    токен и пользователь из снимка без запросов к базе
+    """
+    values = snapshot["user"]
+    user = User.from_db(
+        "default",
+        list(values),
+        [
+            values[field.attname]
+            for field in User._meta.concrete_fields
+            if field.attname in values
+        ],
+    )
+    token = Token(key=key, user=user, created=snapshot["created"])
+    token._state.adding = False
+    return token
+
+
+def get_snapshot(key):
+    snapshot = local_cache.get(key)
+    if snapshot is not None:
+        return snapshot
+    try:
+        snapshot = cache.get(token_cache_key(key))
+    except (RedisError, OSError) as error:
+        logger.warning("Token cache is unavailable: %s", error)
+        return None
+    if snapshot is not None:
+        local_cache.set(key, snapshot)
+    return snapshot
+
+
+def set_snapshot(key, snapshot):
+    local_cache.set(key, snapshot)
+    try:
+        cache.set(token_cache_key(key), snapshot, timeout=settings.AUTH_CACHE_TTL)
+    except (RedisError, OSError) as error:
+        logger.warning("Token cache is unavailable: %s", error)
+
+
+def invalidate_tokens(keys):
+    """
+    сбрасываем закэшированные снимки токенов в процессе и в Redis
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    local_cache.delete(keys)
+    try:
+        cache.delete_many([token_cache_key(key) for key in keys])
+    except (RedisError, OSError) as error:
+        logger.warning("Token cache invalidation failed: %s", error)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Класс для аутентификации по токену DRF со снимком токена и пользователя
+    в кэше
+
+    Снимок ищется в памяти процесса, затем в Redis (AUTH_CACHE_TTL);
+    при промахе токен читается из базы, как в TokenAuthentication.
+    Снимки сбрасываются сигналами при удалении токена и сохранении
+    пользователя. Изменения в обход save() (queryset.update) видны
+    после истечения TTL.
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = get_snapshot(key)
+        if snapshot is None:
+            try:
+                token = Token.objects.select_related("user").get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+            snapshot = make_snapshot(token)
+            set_snapshot(key, snapshot)
+        else:
+            token = restore_token(key, snapshot)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return (token.user, token)
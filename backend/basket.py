@@ -0,0 +1,147 @@
+from django.conf import settings
+
+from backend.cache import get_redis_client
+from backend.models import Order, OrderItem, ProductInfo
+from backend.serializers import OrderSerializer
+
+BASKET_KEY = "basket:{user_id}"
+DIRTY_BASKETS_KEY = "basket:dirty"
+# поле-метка пустой корзины: id позиций начинаются с 1
+EMPTY_FIELD = "0"
+
+
+def get_redis():
+    return get_redis_client(settings.BASKET_REDIS_URL)
+
+
+def get_basket(user):
+    """
+    корзина пользователя в хранилище из настройки BASKET_BACKEND
+    """
+    backends = {"database": DatabaseBasket, "redis": RedisBasket}
+    return backends[settings.BASKET_BACKEND](user)
+
+
+class DatabaseBasket:
+    """
+    Класс для корзины, хранящейся заказом со статусом basket
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def get_order(self):
+        return Order.objects.filter(user=self.user, status="basket").first()
+
+    def items(self):
+        return dict(
+            OrderItem.objects.filter(
+                order__user=self.user, order__status="basket"
+            ).values_list("product_info_id", "quantity")
+        )
+
+    def replace(self, items):
+        Order.objects.basket(self.user).replace_items(items)
+
+    def clear(self):
+        deleted, _ = Order.objects.filter(user=self.user, status="basket").delete()
+        return bool(deleted)
+
+    def materialize(self):
+        return self.get_order()
+
+    def forget(self):
+        pass
+
+    def data(self):
+        basket = Order.objects.filter(user=self.user, status="basket")
+        return OrderSerializer(basket.prefetch_related("ordered_items"), many=True).data
+
+
+class RedisBasket(DatabaseBasket):
+    """
+    Класс для корзины в хэше Redis {product_info_id: quantity}
+
+    Правки корзины не трогают базу: заказ со статусом basket
+    записывается при подтверждении или задачей flush_baskets_task
+    для корзин из множества DIRTY_BASKETS_KEY.
+    """
+
+    def __init__(self, user):
+        super().__init__(user)
+        self.key = BASKET_KEY.format(user_id=user.id)
+
+    def items(self):
+        client = get_redis()
+        values = client.hgetall(self.key)
+        if not values:
+            # корзины нет в Redis (истекла или еще не заводилась)
+            items = super().items()
+            self.store(items, dirty=False)
+            return items
+        return {
+            int(product_info): int(quantity)
+            for product_info, quantity in values.items()
+            if product_info.decode() != EMPTY_FIELD
+        }
+
+    def store(self, items, dirty=True):
+        pipeline = get_redis().pipeline(transaction=True)
+        pipeline.delete(self.key)
+        pipeline.hset(self.key, mapping=items or {EMPTY_FIELD: 0})
+        pipeline.expire(self.key, settings.BASKET_TTL)
+        if dirty:
+            pipeline.sadd(DIRTY_BASKETS_KEY, self.user.id)
+        pipeline.execute()
+
+    def replace(self, items):
+        self.store(items)
+
+    def clear(self):
+        had_items = bool(self.items())
+        self.store({})
+        return had_items
+
+    def materialize(self):
+        """
+        записываем корзину из Redis в заказ со статусом basket
+        """
+        items = self.items()
+        # позиции могли пропасть из каталога после загрузки прайса
+        existing = set(
+            ProductInfo.objects.filter(id__in=list(items)).values_list("id", flat=True)
+        )
+        items = {key: value for key, value in items.items() if key in existing}
+        if not items:
+            Order.objects.filter(user=self.user, status="basket").delete()
+            return None
+        order = Order.objects.basket(self.user)
+        order.replace_items(items)
+        return order
+
+    def forget(self):
+        get_redis().delete(self.key)
+
+    def data(self):
+        items = self.items()
+        offers = ProductInfo.objects.only("price").in_bulk(list(items))
+        items = {key: value for key, value in items.items() if key in offers}
+        if not items:
+            return []
+        return [
+            {
+                "id": None,
+                "ordered_items": [
+                    {"id": None, "product_info": product_info, "quantity": quantity}
+                    for product_info, quantity in items.items()
+                ],
+                "status": "basket",
+                "date_time": None,
+                "total_sum": sum(
+                    offers[product_info].price * quantity
+                    for product_info, quantity in items.items()
+                ),
+                "item_count": sum(items.values()),
+                "contact": None,
+            }
+        ]
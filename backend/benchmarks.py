@@ -0,0 +1,419 @@
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import yaml
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Q
+from rest_framework.test import APIClient
+
+from backend.importer import PriceListImporter, iter_price_list
+from backend.metrics import QueryCounter, request_measured
+from backend.models import (
+    Category,
+    Contact,
+    Order,
+    OutboxEvent,
+    Parameter,
+    Product,
+    ProductInfo,
+    Shop,
+    User,
+)
+
+# категории синтетического прайса: (id, название, бренды, параметры);
+# у параметра список значений - его кардинальность как в реальных прайсах
+CATALOG = (
+    (
+        224,
+        "Смартфоны",
+        ("Apple", "Samsung", "Xiaomi", "Honor", "Realme", "Nokia"),
+        {
+            "Диагональ (дюйм)": (5.8, 6.1, 6.4, 6.5, 6.7),
+            "Разрешение (пикс)": ("2688x1242", "1792x828", "2400x1080", "1600x720"),
+            "Встроенная память (Гб)": (32, 64, 128, 256, 512),
+            "Цвет": ("черный", "белый", "золотистый", "красный", "синий", "зеленый"),
+        },
+    ),
+    (
+        100,
+        "Ноутбуки",
+        ("Lenovo", "Asus", "Acer", "HP", "Dell", "Apple"),
+        {
+            "Диагональ экрана (дюйм)": (13.3, 14, 15.6, 16, 17.3),
+            "Разрешение экрана (пикс)": ("1920x1080", "2560x1600", "1366x768"),
+            "Процессор": (
+                "Intel Core i3",
+                "Intel Core i5",
+                "Intel Core i7",
+                "AMD Ryzen 5",
+                "AMD Ryzen 7",
+                "Apple M2",
+            ),
+            "Оперативная память (Гб)": (4, 8, 16, 32, 64),
+        },
+    ),
+    (
+        200,
+        "Телевизоры",
+        ("Samsung", "LG", "Sony", "Philips", "Xiaomi"),
+        {
+            "Диагональ экрана (дюйм)": (32, 43, 50, 55, 65, 75),
+            "Разрешение экрана (пикс)": ("3840x2160", "1920x1080", "1366x768"),
+            "Частота обновления (Гц)": (50, 60, 100, 120),
+        },
+    ),
+    (
+        15,
+        "Аксессуары",
+        ("Baseus", "Anker", "Ugreen", "Hoco"),
+        {
+            "Тип": ("чехол", "кабель", "зарядное устройство", "наушники", "стекло"),
+            "Цвет": ("черный", "белый", "синий", "прозрачный"),
+        },
+    ),
+    (
+        1,
+        "Flash-накопители",
+        ("Kingston", "SanDisk", "Transcend", "Netac"),
+        {
+            "Объем (Гб)": (16, 32, 64, 128, 256),
+            "Интерфейс": ("USB 2.0", "USB 3.0", "USB 3.2", "USB Type-C"),
+        },
+    ),
+)
+
+
+def generate_goods(count, seed=0):
+    """
+    синтетические позиции прайса в формате data/shop1.yaml
+    """
+    rng = random.Random(seed)
+    for number in range(count):
+        category, category_name, brands, parameters = rng.choice(CATALOG)
+        brand = rng.choice(brands)
+        values = {name: rng.choice(choices) for name, choices in parameters.items()}
+        series = rng.randrange(1, 100)
+        price = rng.randrange(5, 2000) * 100
+        yield {
+            "id": number + 1,
+            "category": category,
+            "model": f"{brand.lower()}/{series}",
+            # название товара уникально в прайсе, как у настоящих магазинов
+            "name": f"{category_name[:-1]} {brand} {series} "
+            + " ".join(str(value) for value in values.values())
+            + f" (арт. {number + 1})",
+            "price": price,
+            "price_rrc": price + rng.randrange(0, 50) * 100,
+            "quantity": rng.randrange(0, 100),
+            "parameters": values,
+        }
+
+
+def write_price_list(stream, count, seed=0, shop="Benchmark", batch_size=1000):
+    """
+    пишем прайс на count позиций в текстовый поток пачками, не собирая
+    весь документ в памяти
+    """
+    stream.write(
+        yaml.safe_dump(
+            {
+                "shop": shop,
+                "categories": [
+                    {"id": category, "name": name} for category, name, *_ in CATALOG
+                ],
+            },
+            allow_unicode=True,
+            sort_keys=False,
+        )
+    )
+    stream.write("goods:\n")
+    batch = []
+    for item in generate_goods(count, seed):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            stream.write(yaml.safe_dump(batch, allow_unicode=True, sort_keys=False))
+            batch = []
+    if batch:
+        stream.write(yaml.safe_dump(batch, allow_unicode=True, sort_keys=False))
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latency_stats(timings):
+    """
+    сводка задержек запросов в миллисекундах
+    """
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 2),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95)] * 1000, 2),
+        "max_ms": round(timings[-1] * 1000, 2),
+    }
+
+
+# сценарий -> метод BenchmarkRunner
+SCENARIOS = {
+    "import": "import_price_list",
+    "search": "search",
+    "basket": "basket",
+    "confirm": "confirm",
+}
+
+
+def check_benchmark_database():
+    """
+    сценарии пишут в базу и удаляют свои данные, поэтому запускаются только
+    на отдельной базе, имя которой указано в BENCHMARK_DATABASE
+    """
+    name = str(connection.settings_dict["NAME"])
+    if not settings.BENCHMARK_DATABASE or name != settings.BENCHMARK_DATABASE:
+        raise ImproperlyConfigured(
+            f"База {name} не отмечена для замеров: укажите ее имя "
+            "в переменной окружения BENCHMARK_DATABASE"
+        )
+
+
+class BenchmarkRunner:
+    """
+    Класс для сценариев нагрузки на текущей базе (SQLite или PostgreSQL)
+
+    Работает только на базе из BENCHMARK_DATABASE. Данные сценариев
+    заводятся под отдельными пользователями benchmark-*@example.com
+    и после прогона удаляются: пользователи и магазин прогона, их события
+    OutboxEvent, а также товары, параметры и категории прайса, которые
+    появились за прогон и больше никем не используются.
+    """
+
+    def __init__(self, price_list, users=10, requests=100, seed=0):
+        check_benchmark_database()
+        self.price_list = price_list
+        self.users = users
+        self.requests = requests
+        self.rng = random.Random(seed)
+        self.shop = None
+        self.buyers = []
+        self.imported = None
+        # справочники небольшие: запоминаем их, чтобы удалить только
+        # созданное за прогон
+        self.category_ids = set(Category.objects.values_list("id", flat=True))
+        self.parameter_ids = set(Parameter.objects.values_list("id", flat=True))
+
+    def run(self, scenarios):
+        started = time.perf_counter()
+        results = {
+            "commit": current_commit(),
+            "database": connection.vendor,
+            "started": datetime.now(timezone.utc).isoformat(),
+            "scenarios": {},
+        }
+        try:
+            for scenario in scenarios:
+                results["scenarios"][scenario] = getattr(self, SCENARIOS[scenario])()
+        finally:
+            self.cleanup()
+        results["seconds"] = round(time.perf_counter() - started, 3)
+        return results
+
+    def measure_requests(self, calls):
+        """
+        выполняем запросы и собираем задержки и число запросов к базе
+        """
+        timings = []
+        queries = []
+        statuses = {}
+
+        def measured(sender, metrics, **kwargs):
+            queries.append(metrics["queries"])
+
+        request_measured.connect(measured)
+        try:
+            for call in calls:
+                started = time.perf_counter()
+                response = call()
+                timings.append(time.perf_counter() - started)
+                statuses[response.status_code] = (
+                    statuses.get(response.status_code, 0) + 1
+                )
+        finally:
+            request_measured.disconnect(measured)
+        return {
+            **latency_stats(timings),
+            "queries_mean": round(statistics.fmean(queries), 2),
+            "queries_max": max(queries),
+            "statuses": {str(code): count for code, count in statuses.items()},
+        }
+
+    def client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def get_shop(self):
+        if self.shop is None:
+            user = User.objects.create_user(
+                email="benchmark-shop@example.com", password="benchmark", type="shop"
+            )
+            self.shop = Shop.objects.create(name="", user=user)
+        return self.shop
+
+    def get_buyers(self):
+        if not self.buyers:
+            for number in range(self.users):
+                user = User.objects.create_user(
+                    email=f"benchmark-{number}@example.com",
+                    password="benchmark",
+                    type="buyer",
+                )
+                Contact.objects.create(
+                    user=user, city="Москва", street="Тверская", house="1", phone="1"
+                )
+                self.buyers.append(user)
+        return self.buyers
+
+    def offer_ids(self):
+        # сценариям с корзиной нужен загруженный прайс
+        self.import_price_list()
+        return list(
+            ProductInfo.objects.filter(shop=self.get_shop(), quantity__gt=0)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def import_price_list(self):
+        if self.imported is not None:
+            return self.imported
+        counter = QueryCounter()
+        with open(self.price_list, "rb") as stream, connection.execute_wrapper(counter):
+            importer = PriceListImporter(self.get_shop()).run(iter_price_list(stream))
+        stats = importer.stats()
+        self.imported = {
+            "rows": stats["rows"],
+            "seconds": round(importer.elapsed, 3),
+            "rows_per_second": round(stats["rows"] / importer.elapsed, 1),
+            "queries": counter.queries,
+            "db_seconds": round(counter.seconds, 3),
+        }
+        return self.imported
+
+    def search(self):
+        words = [brand for _, _, brands, _ in CATALOG for brand in brands]
+        client = self.client(self.get_buyers()[0])
+        return self.measure_requests(
+            (
+                lambda word=self.rng.choice(words): client.get(
+                    "/api/v1/products/search", {"q": word}
+                )
+            )
+            for _ in range(self.requests)
+        )
+
+    def basket(self):
+        offers = self.offer_ids()
+        clients = [self.client(user) for user in self.get_buyers()]
+
+        def edit(client, items):
+            return client.put(
+                "/api/v1/basket",
+                {"items": [{"product_info": offer, "quantity": 1} for offer in items]},
+                format="json",
+            )
+
+        return self.measure_requests(
+            (
+                lambda client=clients[number % len(clients)], items=self.rng.sample(
+                    offers, min(len(offers), 5)
+                ): edit(client, items)
+            )
+            for number in range(self.requests)
+        )
+
+    def confirm(self):
+        offers = self.offer_ids()
+        calls = []
+        for user in self.get_buyers():
+            client = self.client(user)
+            # корзины заполняются вне замера
+            client.put(
+                "/api/v1/basket",
+                {
+                    "items": [
+                        {"product_info": offer, "quantity": 1}
+                        for offer in self.rng.sample(offers, min(len(offers), 3))
+                    ]
+                },
+                format="json",
+            )
+            contact_id = user.contacts.values_list("id", flat=True).first()
+            calls.append(
+                lambda client=client, contact_id=contact_id: client.post(
+                    "/api/v1/order/confirm", {"contact_id": contact_id}, format="json"
+                )
+            )
+        return self.measure_requests(calls)
+
+    def cleanup(self):
+        user_ids = [buyer.id for buyer in self.buyers]
+        if self.shop is not None:
+            user_ids.append(self.shop.user_id)
+        if not user_ids:
+            return
+        users = User.objects.filter(id__in=user_ids)
+        offers = ProductInfo.objects.filter(shop__user_id__in=user_ids)
+        with transaction.atomic():
+            category_ids = (
+                set(
+                    Category.shops.through.objects.filter(
+                        shop__user_id__in=user_ids
+                    ).values_list("category_id", flat=True)
+                )
+                - self.category_ids
+            )
+            parameter_ids = (
+                set(
+                    Parameter.objects.filter(
+                        product_parameters__product_info__in=offers
+                    ).values_list("id", flat=True)
+                )
+                - self.parameter_ids
+            )
+            OutboxEvent.objects.filter(
+                Q(
+                    payload__order_id__in=list(
+                        Order.objects.filter(user_id__in=user_ids).values_list(
+                            "id", flat=True
+                        )
+                    )
+                )
+                | Q(payload__email__in=list(users.values_list("email", flat=True)))
+            ).delete()
+            # товары, которые продает только магазин прогона; вместе с ними
+            # удаляются его позиции
+            Product.objects.filter(id__in=offers.values("product_id")).exclude(
+                id__in=ProductInfo.objects.exclude(shop__user_id__in=user_ids).values(
+                    "product_id"
+                )
+            ).delete()
+            users.delete()
+            Parameter.objects.filter(
+                id__in=parameter_ids, product_parameters__isnull=True
+            ).delete()
+            Category.objects.filter(
+                id__in=category_ids, shops__isnull=True, products__isnull=True
+            ).delete()
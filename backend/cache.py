@@ -0,0 +1,98 @@
+import logging
+from functools import lru_cache
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from redis import Redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_PREFIX = "catalog"
+
+
+@lru_cache(maxsize=None)
+def get_redis_client(url):
+    """
+    общий на процесс клиент Redis (с пулом соединений) для адреса
+    """
+    return Redis.from_url(url)
+
+
+def version_key(scope):
+    return f"{CATALOG_CACHE_PREFIX}:version:{scope}"
+
+
+def shop_scope(shop_id):
+    return f"shop:{shop_id}"
+
+
+def category_scope(category_id):
+    return f"category:{category_id}"
+
+
+def get_versions(scopes):
+    """
+    получаем версии областей каталога, заводя недостающие
+
+    Новая версия всегда случайная, поэтому записи, сохраненные под
+    вытесненной из кэша версией, больше не будут прочитаны.
+    """
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def bump_catalog_versions(scopes):
+    """
+    сбрасываем закэшированные ответы, зависящие от указанных областей каталога
+    """
+    scopes = set(scopes)
+    if not scopes:
+        return
+    try:
+        cache.set_many(
+            {version_key(scope): uuid4().hex for scope in scopes}, timeout=None
+        )
+    except (RedisError, OSError) as error:
+        logger.warning("Catalog cache invalidation failed: %s", error)
+
+
+def catalog_cache_key(name, request, scopes):
+    params = sorted(
+        (key, value) for key, values in request.query_params.lists() for value in values
+    )
+    # ссылки на соседние страницы в ответе зависят от адреса запроса
+    url = request.build_absolute_uri(request.path)
+    digest = md5(repr((url, params)).encode("utf-8")).hexdigest()
+    versions = md5(":".join(get_versions(scopes)).encode("utf-8")).hexdigest()
+    return f"{CATALOG_CACHE_PREFIX}:{name}:{digest}:{versions}"
+
+
+def get_cached_response(name, request, scopes):
+    """
+    возвращаем (ключ, данные) закэшированного ответа, данные None при промахе
+    """
+    try:
+        key = catalog_cache_key(name, request, scopes)
+        return key, cache.get(key)
+    except (RedisError, OSError) as error:
+        logger.warning("Catalog cache is unavailable: %s", error)
+        return None, None
+
+
+def set_cached_response(key, data):
+    if key is None:
+        return
+    try:
+        cache.set(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    except (RedisError, OSError) as error:
+        logger.warning("Catalog cache is unavailable: %s", error)
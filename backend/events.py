@@ -0,0 +1,101 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+
+from backend.cache import get_redis_client
+from backend.models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENTS_KEY = "events:user:{user_id}"
+# курсор пустого потока
+START_ID = "0-0"
+
+
+def get_redis():
+    return get_redis_client(settings.ORDER_EVENTS_REDIS_URL)
+
+
+def events_key(user_id):
+    return ORDER_EVENTS_KEY.format(user_id=user_id)
+
+
+def notify_orders_changed(order_ids):
+    """
+    публикуем изменения заказов после фиксации текущей транзакции
+    """
+    order_ids = list(order_ids)
+    if order_ids:
+        transaction.on_commit(lambda: publish_order_events(order_ids))
+
+
+def publish_order_events(order_ids):
+    """
+    добавляем событие об изменении заказа в поток покупателя и магазинов
+
+    Поток Redis (а не pub/sub) хранит последние события, поэтому клиент,
+    переподключившийся со своим курсором, не теряет события между опросами.
+    """
+    recipients = {}
+    for order_id, user_id, order_status, updated_at in Order.objects.filter(
+        id__in=order_ids
+    ).values_list("id", "user_id", "status", "updated_at"):
+        event = {
+            "order_id": order_id,
+            "status": order_status,
+            "updated_at": updated_at.isoformat(),
+        }
+        recipients[order_id] = (event, {user_id})
+    for order_id, user_id in (
+        OrderItem.objects.filter(order_id__in=list(recipients))
+        .values_list("order_id", "product_info__shop__user_id")
+        .distinct()
+    ):
+        if user_id is not None:
+            recipients[order_id][1].add(user_id)
+
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for event, user_ids in recipients.values():
+            for user_id in user_ids:
+                key = events_key(user_id)
+                pipeline.xadd(
+                    key,
+                    event,
+                    maxlen=settings.ORDER_EVENTS_MAXLEN,
+                    approximate=True,
+                )
+                pipeline.expire(key, settings.ORDER_EVENTS_TTL)
+        pipeline.execute()
+    except (RedisError, OSError) as error:
+        logger.warning("Order events were not published: %s", error)
+
+
+def read_order_events(user_id, since=None, timeout=0):
+    """
+    ждем до timeout секунд событий пользователя после курсора since
+
+    Возвращает (события, курсор для следующего запроса). Без since
+    курсор ставится на последнее уже опубликованное событие.
+    """
+    client = get_redis()
+    key = events_key(user_id)
+    if not since:
+        last = client.xrevrange(key, "+", "-", count=1)
+        since = last[0][0].decode() if last else START_ID
+    # BLOCK 0 в Redis - ждать бесконечно, поэтому без ожидания BLOCK не передаем
+    streams = client.xread(
+        {key: since},
+        count=settings.ORDER_EVENTS_BATCH,
+        block=int(timeout * 1000) or None,
+    )
+    events = []
+    for _, messages in streams or ():
+        for message_id, fields in messages:
+            since = message_id.decode()
+            event = {key.decode(): value.decode() for key, value in fields.items()}
+            event["order_id"] = int(event["order_id"])
+            events.append({"id": since, **event})
+    return events, since
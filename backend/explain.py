@@ -0,0 +1,173 @@
+import ujson
+from django.apps import apps
+from django.db import connection, transaction
+
+from backend.benchmarks import BenchmarkRunner
+
+# ожидаемые полные просмотры: (запрос API, таблица) -> причина
+EXPECTED_SCANS = {
+    # keyset-пагинация по первичному ключу: просмотр идет в порядке id
+    # и останавливается на LIMIT
+    ("GET products", "backend_productinfo"): "обход по первичному ключу до LIMIT",
+    # справочники из десятков строк
+    ("GET shops", "backend_shop"): "справочник",
+    ("GET categories", "backend_category"): "справочник",
+}
+# без PostgreSQL поиск идет по подстроке: LIKE '%...%' не использует B-tree
+# индексы. В PostgreSQL поиск обязан читать GIN-индексы, полный просмотр
+# там - ошибка
+FALLBACK_EXPECTED_SCANS = {
+    ("GET products/search", "backend_productinfo"): "поиск по подстроке",
+}
+
+
+def expected_scans():
+    if connection.vendor == "postgresql":
+        return EXPECTED_SCANS
+    return {**EXPECTED_SCANS, **FALLBACK_EXPECTED_SCANS}
+
+
+def model_tables():
+    return {model._meta.db_table for model in apps.get_models()}
+
+
+class SelectCollector:
+    """
+    Класс для сбора SELECT-запросов с параметрами (execute_wrapper)
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def sequential_scans(sql, params, tables):
+    """
+    таблицы, которые запрос читает целиком, и план запроса
+
+    В PostgreSQL план строится с enable_seqscan = off: если в нем все равно
+    остался Seq Scan, подходящего индекса нет. В SQLite ищем шаги
+    SCAN <таблица> без индекса.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = ujson.loads(plan)
+            return sorted(set(postgres_scans(plan[0]["Plan"]))), plan
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = [row[-1] for row in cursor.fetchall()]
+    scans = set()
+    for detail in plan:
+        words = detail.split()
+        if words[:1] == ["SCAN"] and "USING" not in words and words[1] in tables:
+            scans.add(words[1])
+    return sorted(scans), plan
+
+
+def postgres_scans(node):
+    if node["Node Type"] == "Seq Scan":
+        yield node["Relation Name"]
+    for child in node.get("Plans", ()):
+        yield from postgres_scans(child)
+
+
+def explain_requests(runner, requests):
+    """
+    выполняем запросы к API и разбираем планы их SELECT-запросов
+
+    requests - список (описание, функция запроса). Возвращает по каждому
+    запросу API список {"sql", "scans", "expected", "plan"}: в expected
+    попадают полные просмотры, ожидаемые на текущей базе (expected_scans).
+    """
+    tables = model_tables()
+    expected = expected_scans()
+    report = {}
+    for name, request in requests:
+        collector = SelectCollector()
+        with connection.execute_wrapper(collector):
+            request()
+        report[name] = []
+        for sql, params in collector.queries:
+            scans, plan = sequential_scans(sql, params, tables)
+            report[name].append(
+                {
+                    "sql": sql,
+                    "scans": [
+                        table for table in scans if (name, table) not in expected
+                    ],
+                    "expected": [table for table in scans if (name, table) in expected],
+                    "plan": plan,
+                }
+            )
+    return report
+
+
+def view_requests(runner):
+    """
+    запросы к основным эндпоинтам на данных runner
+    """
+    buyer, *_ = runner.get_buyers()
+    offers = runner.offer_ids()
+    shop = runner.get_shop()
+    category_id = (
+        shop.categories.values_list("id", flat=True).order_by("id").first() or 0
+    )
+    client = runner.client(buyer)
+    partner = runner.client(shop.user)
+    contact_id = buyer.contacts.values_list("id", flat=True).first()
+    items = [{"product_info": offer, "quantity": 1} for offer in offers[:3]]
+    return [
+        ("GET products", lambda: client.get("/api/v1/products")),
+        (
+            "GET products?category_id",
+            lambda: client.get("/api/v1/products", {"category_id": category_id}),
+        ),
+        (
+            "GET products?shop_id&ordering=price",
+            lambda: client.get(
+                "/api/v1/products", {"shop_id": shop.id, "ordering": "price"}
+            ),
+        ),
+        (
+            "GET products?param",
+            lambda: client.get("/api/v1/products", {"param": "Цвет:eq:черный"}),
+        ),
+        (
+            "GET products/search",
+            lambda: client.get("/api/v1/products/search", {"q": "Samsung"}),
+        ),
+        ("GET shops", lambda: client.get("/api/v1/shops")),
+        ("GET categories", lambda: client.get("/api/v1/categories")),
+        (
+            "PUT basket",
+            lambda: client.put("/api/v1/basket", {"items": items}, format="json"),
+        ),
+        ("GET basket", lambda: client.get("/api/v1/basket")),
+        (
+            "POST order/confirm",
+            lambda: client.post(
+                "/api/v1/order/confirm", {"contact_id": contact_id}, format="json"
+            ),
+        ),
+        ("GET order", lambda: client.get("/api/v1/order")),
+        ("GET partner/orders", lambda: partner.get("/api/v1/partner/orders")),
+    ]
+
+
+def explain_views(price_list, users=2):
+    """
+    заполняем базу синтетическим прайсом и разбираем планы запросов
+    основных эндпоинтов; данные удаляются после разбора
+    """
+    runner = BenchmarkRunner(price_list, users=users)
+    try:
+        return explain_requests(runner, view_requests(runner))
+    finally:
+        runner.cleanup()
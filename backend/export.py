@@ -0,0 +1,136 @@
+import csv
+import zlib
+from itertools import groupby
+from operator import itemgetter
+
+import ujson
+from django.conf import settings
+from django.db import transaction
+
+from backend.models import ProductInfo, ProductParameter
+
+EXPORT_FIELDS = (
+    "id",
+    "external_id",
+    "model",
+    "name",
+    "category_id",
+    "category",
+    "price",
+    "price_rrc",
+    "quantity",
+)
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def iter_offers(shop_id, chunk_size=None):
+    """
+    позиции магазина с параметрами по одной, без загрузки всего прайса в память
+
+    Позиции и параметры читаются двумя серверными курсорами в порядке
+    id позиции и склеиваются слиянием, поэтому выгрузка - два запроса
+    при любом размере прайса. Курсоры открываются в транзакции: вне ее
+    PostgreSQL создает курсоры WITH HOLD, которые материализуют весь
+    результат при фиксации.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    with transaction.atomic():
+        yield from merge_offers(shop_id, chunk_size)
+
+
+def merge_offers(shop_id, chunk_size):
+    offers = (
+        ProductInfo.objects.filter(shop_id=shop_id)
+        .order_by("id")
+        .values_list(
+            "id",
+            "external_id",
+            "model",
+            "product__name",
+            "product__category_id",
+            "product__category__name",
+            "price",
+            "price_rrc",
+            "quantity",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+    parameters = groupby(
+        ProductParameter.objects.filter(product_info__shop_id=shop_id)
+        .order_by("product_info_id", "id")
+        .values_list("product_info_id", "parameter__name_parameter", "value")
+        .iterator(chunk_size=chunk_size),
+        key=itemgetter(0),
+    )
+    group_id, group = next(parameters, (None, ()))
+    for offer in offers:
+        row = dict(zip(EXPORT_FIELDS, offer))
+        # у позиции может не быть параметров, а параметры удаленных
+        # за время выгрузки позиций пропускаются
+        while group_id is not None and group_id < row["id"]:
+            group_id, group = next(parameters, (None, ()))
+        if group_id == row["id"]:
+            row["parameters"] = {name: value for _, name, value in group}
+        else:
+            row["parameters"] = {}
+        yield row
+
+
+class Echo:
+    """
+    Класс для буфера csv.writer, который возвращает строку вместо записи
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield ujson.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow((*EXPORT_FIELDS, "parameters"))
+    for row in rows:
+        parameters = row.pop("parameters")
+        yield writer.writerow(
+            (*row.values(), ujson.dumps(parameters, ensure_ascii=False))
+        )
+
+
+EXPORT_WRITERS = {"ndjson": iter_ndjson, "csv": iter_csv}
+
+
+def iter_export(shop_id, output, compress=False, chunk_size=None):
+    """
+    выгрузка позиций магазина в формате output кусками байт
+
+    Строки копятся по chunk_size и отдаются одним куском; с compress
+    кусок сжимается gzip на лету и сбрасывается (Z_SYNC_FLUSH),
+    чтобы клиент получал данные сразу, а не после всей выгрузки.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    lines = EXPORT_WRITERS[output](iter_offers(shop_id, chunk_size))
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            yield encode_chunk(buffer, compressor)
+            buffer = []
+    if buffer:
+        yield encode_chunk(buffer, compressor)
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def encode_chunk(lines, compressor):
+    data = "".join(lines).encode()
+    if compressor is None:
+        return data
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
@@ -0,0 +1,119 @@
+# Быстрая сериализация списков каталога и заказов: данные читаются через
+# values() и собираются в словари напрямую, без экземпляров моделей
+# и вложенных сериализаторов DRF. Вывод совпадает с ProductInfoSerializer
+# и OrderSerializer ключ в ключ.
+from django.utils import timezone
+
+from backend.models import OrderItem, ProductParameter
+
+PRODUCT_INFO_VALUES = (
+    "id",
+    "model",
+    "product__name",
+    "product__category__name",
+    "shop_id",
+    "quantity",
+    "price",
+    "price_rrc",
+)
+ORDER_VALUES = (
+    "id",
+    "status",
+    "date_time",
+    "total_sum",
+    "item_count",
+    "contact_id",
+    "contact__city",
+    "contact__street",
+    "contact__house",
+    "contact__structure",
+    "contact__building",
+    "contact__apartment",
+    "contact__phone",
+)
+
+
+def format_datetime(value):
+    """
+    дата в формате DateTimeField DRF
+    """
+    value = timezone.localtime(value).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def serialize_product_infos(rows):
+    """
+    позиции каталога из словарей PRODUCT_INFO_VALUES, как ProductInfoSerializer
+
+    Параметры всех позиций читаются одним запросом.
+    """
+    parameters = {}
+    for product_info_id, name, value in (
+        ProductParameter.objects.filter(product_info_id__in=[row["id"] for row in rows])
+        .order_by("product_info_id", "id")
+        .values_list("product_info_id", "parameter__name_parameter", "value")
+    ):
+        parameters.setdefault(product_info_id, []).append(
+            {"parameter": name, "value": value}
+        )
+    return [
+        {
+            "id": row["id"],
+            "model": row["model"],
+            "product": {
+                "name": row["product__name"],
+                "category": row["product__category__name"],
+            },
+            "shop": row["shop_id"],
+            "quantity": row["quantity"],
+            "price": row["price"],
+            "price_rrc": row["price_rrc"],
+            "product_parameters": parameters.get(row["id"], []),
+        }
+        for row in rows
+    ]
+
+
+def serialize_orders(queryset):
+    """
+    заказы с позициями и контактом, как OrderSerializer
+
+    Два запроса: заказы вместе с контактом и позиции всех заказов.
+    """
+    orders = list(queryset.values(*ORDER_VALUES))
+    items = {}
+    for order_id, item_id, product_info_id, quantity in (
+        OrderItem.objects.filter(order_id__in=[order["id"] for order in orders])
+        .order_by("id")
+        .values_list("order_id", "id", "product_info_id", "quantity")
+    ):
+        items.setdefault(order_id, []).append(
+            {"id": item_id, "product_info": product_info_id, "quantity": quantity}
+        )
+    return [
+        {
+            "id": order["id"],
+            "ordered_items": items.get(order["id"], []),
+            "status": order["status"],
+            "date_time": format_datetime(order["date_time"]),
+            "total_sum": order["total_sum"],
+            "item_count": order["item_count"],
+            "contact": (
+                {
+                    "id": order["contact_id"],
+                    "city": order["contact__city"],
+                    "street": order["contact__street"],
+                    "house": order["contact__house"],
+                    "structure": order["contact__structure"],
+                    "building": order["contact__building"],
+                    "apartment": order["contact__apartment"],
+                    "phone": order["contact__phone"],
+                }
+                if order["contact_id"]
+                else None
+            ),
+        }
+        for order in orders
+    ]
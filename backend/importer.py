@@ -0,0 +1,712 @@
+import os
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import chain, islice
+from math import isfinite
+
+import yaml
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests import get
+
+from backend.cache import bump_catalog_versions, category_scope, shop_scope
+from backend.models import (
+    Category,
+    Order,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+)
+from backend.search import update_search_vectors
+
+GOODS_FIELDS = (
+    "id",
+    "category",
+    "model",
+    "name",
+    "price",
+    "price_rrc",
+    "quantity",
+    "parameters",
+)
+
+MAX_IMPORT_ERRORS = 100
+
+# поля позиции, от которых зависит ее поисковый вектор
+SEARCH_FIELDS = {"product_id", "model"}
+
+
+def batched(iterable, size):
+    """
+    разбиваем последовательность на пачки фиксированного размера
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+PRODUCT_INFO_FIELDS = ("product_id", "model", "price", "price_rrc", "quantity")
+
+
+# C-загрузчик libyaml, если pyyaml собран с ним, иначе чистый Python
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def compose_node(loader, anchors):
+    """
+    собираем узел документа из потока событий парсера
+    """
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        return anchors[event.anchor]
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None)
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None)
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = compose_node(loader, anchors)
+            node.value.append((key, compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise yaml.YAMLError(f"Unexpected event {event}")
+    if getattr(event, "anchor", None):
+        anchors[event.anchor] = node
+    return node
+
+
+def iter_price_list(stream):
+    """
+    потоково разбираем прайс (YAML или JSON) из файлового объекта
+
+    Возвращает пары (раздел, значение): ("shop", название),
+    ("categories", список) и ("goods", позиция) для каждой позиции по очереди,
+    не строя документ целиком.
+    """
+    loader = SafeLoader(stream)
+    anchors = {}
+    try:
+        loader.get_event()
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise yaml.YAMLError("Price list must be a mapping")
+        loader.get_event()
+        while not loader.check_event(yaml.MappingEndEvent):
+            section = loader.construct_document(compose_node(loader, anchors))
+            if section == "goods" and loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    item = compose_node(loader, anchors)
+                    yield section, loader.construct_document(item)
+                loader.get_event()
+            else:
+                yield section, loader.construct_document(compose_node(loader, anchors))
+    finally:
+        loader.dispose()
+
+
+class CountingStream:
+    """
+    Обертка над файловым объектом, считающая прочитанные байты
+    """
+
+    def __init__(self, stream, total=None):
+        self.stream = stream
+        self.total = total
+        self.position = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.position += len(chunk)
+        return chunk
+
+
+@contextmanager
+def open_price_list(source):
+    """
+    открываем прайс по ссылке или из файла для потокового чтения
+    """
+    if source.startswith(("http://", "https://")):
+        with get(source, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            total = response.headers.get("Content-Length")
+            yield CountingStream(response.raw, int(total) if total else None)
+    else:
+        with open(source, "rb") as updatefile:
+            yield CountingStream(updatefile, os.path.getsize(source))
+
+
+def acquire_import_lock(shop_id, job_id):
+    """
+    занимаем магазин под загрузку прайса, чтобы загрузки не шли параллельно
+    """
+    expired = timezone.now() - timedelta(seconds=settings.PRICE_IMPORT_LOCK_TIMEOUT)
+    return bool(
+        Shop.objects.filter(
+            Q(import_job_id="")
+            | Q(import_job_id=job_id)
+            | Q(import_started_at__lt=expired),
+            id=shop_id,
+        ).update(import_job_id=job_id, import_started_at=timezone.now())
+    )
+
+
+def release_import_lock(shop_id, job_id):
+    Shop.objects.filter(id=shop_id, import_job_id=job_id).update(
+        import_job_id="", import_started_at=None
+    )
+
+
+def parse_numeric(value):
+    """
+    число из значения параметра ("256", "6,5"), None если это не число
+    """
+    try:
+        number = float(value.strip().replace(",", "."))
+    except ValueError:
+        return None
+    return number if isfinite(number) else None
+
+
+def merge_import_stats(done, stats):
+    """
+    складываем итоги нескольких загрузок одного магазина
+    """
+    merged = dict(stats)
+    for key in ("rows", "created", "updated", "deleted", "skipped", "elapsed"):
+        merged[key] = done.get(key, 0) + stats.get(key, 0)
+    merged["errors"] = (done.get("errors", []) + stats.get("errors", []))[
+        :MAX_IMPORT_ERRORS
+    ]
+    if merged["elapsed"]:
+        merged["rows_per_second"] = round(merged["rows"] / merged["elapsed"], 1)
+    return merged
+
+
+def iter_sections(data):
+    """
+    приводим уже загруженный прайс к тому же виду, что и потоковый разбор
+    """
+    if not isinstance(data, dict):
+        yield from data
+        return
+    for section, value in data.items():
+        if section == "goods":
+            for item in value:
+                yield section, item
+        else:
+            yield section, value
+
+
+class PriceListImporter:
+    """
+    Класс для пакетной загрузки прайса поставщика в каталог магазина
+
+    В режиме "sync" позиции сопоставляются с каталогом по паре (магазин, external_id)
+    и записываются только изменения, в режиме "replace" каталог магазина
+    удаляется и загружается заново.
+    """
+
+    def __init__(self, shop, batch_size=1000, mode="sync", progress=None):
+        if mode not in ("sync", "replace"):
+            raise ValueError(f"Unknown import mode: {mode}")
+        self.shop = shop
+        self.batch_size = batch_size
+        self.mode = mode
+        self.progress = progress
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.skipped = 0
+        self.errors = []
+        self.elapsed = 0.0
+        self.started = None
+        self.seen = set()
+        # id позиций, уже записанных этой загрузкой
+        self.written = set()
+        # товары {(название, категория): id} и параметры {название: id},
+        # найденные заранее для всего прайса (commit_price_list_import)
+        self.known_products = {}
+        self.known_parameters = {}
+        # что изменилось в каталоге, для сброса кэша после загрузки
+        self.touched_products = set()
+        self.shop_changed = False
+        self.categories_changed = False
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed:
+            return float(self.rows)
+        return self.rows / self.elapsed
+
+    def stats(self):
+        return {
+            "shop_id": self.shop.id,
+            "rows": self.rows,
+            "created": self.created,
+            "updated": self.updated,
+            "deleted": self.deleted,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+    def run(self, data):
+        """
+        data - словарь прайса или поток пар из iter_price_list
+        """
+        self.started = time.monotonic()
+        with transaction.atomic():
+            if self.mode == "replace":
+                self.delete_all()
+            goods = []
+            for section, value in iter_sections(data):
+                if section == "goods":
+                    goods.append(value)
+                    if len(goods) >= self.batch_size:
+                        self.import_batch(goods)
+                        goods = []
+                elif section == "shop":
+                    self.update_shop(value)
+                elif section == "categories":
+                    self.import_categories(value)
+            if goods:
+                self.import_batch(goods)
+            if self.mode == "sync":
+                self.delete_missing()
+            transaction.on_commit(self.invalidate_cache)
+        self.elapsed = time.monotonic() - self.started
+        return self
+
+    def import_batch(self, goods):
+        goods = self.clean_goods(goods)
+        if goods:
+            self.import_goods(goods)
+        self.elapsed = time.monotonic() - self.started
+        if self.progress is not None:
+            self.progress(self)
+
+    def clean_goods(self, goods):
+        """
+        отбрасываем позиции с неполными данными, запоминая ошибку
+        """
+        valid = []
+        for item in goods:
+            if not isinstance(item, dict):
+                self.add_error(None, "позиция должна быть словарем")
+                continue
+            missing = [field for field in GOODS_FIELDS if field not in item]
+            if missing:
+                self.add_error(item.get("id"), f"нет полей {', '.join(missing)}")
+            elif not isinstance(item["parameters"], dict):
+                self.add_error(item["id"], "parameters должен быть словарем")
+            else:
+                valid.append(item)
+                continue
+            if "id" in item:
+                # не удаляем из каталога позицию, пришедшую с ошибкой
+                self.seen.add(item["id"])
+        return valid
+
+    def add_error(self, external_id, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({"id": external_id, "message": message})
+
+    def invalidate_cache(self):
+        """
+        сбрасываем кэш только тех областей каталога, которые затронула загрузка
+        """
+        scopes = set()
+        if self.shop_changed:
+            scopes.add("shops")
+        if self.categories_changed:
+            scopes.add("categories")
+        if self.touched_products:
+            scopes.update(("products", shop_scope(self.shop.id)))
+            for ids in batched(self.touched_products, self.batch_size):
+                scopes.update(
+                    category_scope(category_id)
+                    for category_id in Product.objects.filter(id__in=ids)
+                    .values_list("category_id", flat=True)
+                    .distinct()
+                )
+        bump_catalog_versions(scopes)
+
+    def update_shop(self, name):
+        if self.shop.name != name:
+            self.shop.name = name
+            self.shop.save(update_fields=["name"])
+            self.shop_changed = True
+
+    def import_categories(self, categories):
+        names = {category["id"]: category["name"] for category in categories}
+        existing = Category.objects.in_bulk(list(names))
+        missing = [
+            Category(id=category_id, name=name)
+            for category_id, name in names.items()
+            if category_id not in existing
+        ]
+        if missing:
+            Category.objects.bulk_create(missing, ignore_conflicts=True)
+            self.categories_changed = True
+        Category.shops.through.objects.bulk_create(
+            [
+                Category.shops.through(category_id=category_id, shop_id=self.shop.id)
+                for category_id in names
+            ],
+            ignore_conflicts=True,
+        )
+
+    def import_goods(self, goods):
+        products = self.resolve_products(
+            {(item["name"], item["category"]) for item in goods}
+        )
+        goods, existing = self.release_products(goods, products)
+        if not goods:
+            return
+        parameters = self.resolve_parameters(
+            {name for item in goods for name in item["parameters"]}
+        )
+
+        created = []
+        changed = []
+        changed_fields = set()
+        reindexed = []
+        repriced = []
+        product_infos = []
+        for item in goods:
+            values = {
+                "product_id": products[(item["name"], item["category"])],
+                "model": item["model"],
+                "price": item["price"],
+                "price_rrc": item["price_rrc"],
+                "quantity": item["quantity"],
+            }
+            product_info = existing.get(item["id"])
+            if product_info is None:
+                product_info = ProductInfo(
+                    external_id=item["id"], shop_id=self.shop.id, **values
+                )
+                created.append(product_info)
+            else:
+                fields = [
+                    field
+                    for field, value in values.items()
+                    if getattr(product_info, field) != value
+                ]
+                if fields:
+                    self.touched_products.add(product_info.product_id)
+                    for field in fields:
+                        setattr(product_info, field, values[field])
+                    changed.append(product_info)
+                    changed_fields.update(fields)
+                    if SEARCH_FIELDS.intersection(fields):
+                        reindexed.append(product_info.pk)
+                    if "price" in fields:
+                        repriced.append(product_info.pk)
+            product_infos.append(product_info)
+            self.seen.add(item["id"])
+            self.written.add(item["id"])
+
+        ProductInfo.objects.bulk_create(created)
+        self.touched_products.update(info.product_id for info in created)
+        self.touched_products.update(info.product_id for info in changed)
+        if created and created[0].pk is None:
+            # бэкенд не вернул первичные ключи, дочитываем их по уникальной паре
+            ids = dict(
+                ProductInfo.objects.filter(
+                    shop_id=self.shop.id,
+                    external_id__in=[info.external_id for info in created],
+                ).values_list("external_id", "id")
+            )
+            for product_info in created:
+                product_info.pk = ids[product_info.external_id]
+        if changed:
+            ProductInfo.objects.bulk_update(changed, sorted(changed_fields))
+        if repriced:
+            # суммы подтвержденных заказов зафиксированы, пересчитываем корзины
+            Order.objects.filter(
+                status="basket", ordered_items__product_info_id__in=repriced
+            ).refresh_totals()
+
+        changed_parameters = self.sync_parameters(
+            {
+                product_info.pk: {
+                    parameters[name]: str(value)
+                    for name, value in item["parameters"].items()
+                }
+                for item, product_info in zip(goods, product_infos)
+            },
+            [product_info.pk for product_info in existing.values()],
+        )
+        self.touched_products.update(
+            product_info.product_id
+            for product_info in product_infos
+            if product_info.pk in changed_parameters
+        )
+        update_search_vectors(
+            {product_info.pk for product_info in created}
+            | set(reindexed)
+            | changed_parameters
+        )
+        self.rows += len(goods)
+        self.created += len(created)
+        self.updated += len(changed)
+
+    def release_products(self, goods, products):
+        """
+        освобождаем товары, которые в прайсе перешли к позициям с другим id
+
+        Товар магазина уникален (unique_product_info), поэтому строку,
+        которая держит товар нужной позиции, до записи пачки перенумеровываем
+        (позиция сменила id в прайсе) или удаляем (товары поменялись местами
+        или позиция ушла из прайса). Повтор товара в прайсе под другим id
+        и повтор самого id пропускаются с ошибкой. Возвращает позиции
+        для записи и их текущие строки {external_id: ProductInfo}.
+        """
+        wanted = {}
+        valid = []
+        taken = set()
+        for item in goods:
+            if item["id"] in self.written or item["id"] in taken:
+                # строка магазина уникальна по (магазин, external_id)
+                self.add_error(item["id"], "id уже есть в прайсе у другой позиции")
+                continue
+            taken.add(item["id"])
+            product_id = products[(item["name"], item["category"])]
+            if product_id in wanted:
+                self.duplicate_product(item)
+                continue
+            wanted[product_id] = item["id"]
+            valid.append(item)
+
+        batch_ids = set(wanted.values())
+        rows = ProductInfo.objects.filter(
+            Q(external_id__in=[item["id"] for item in goods])
+            | Q(product_id__in=list(wanted)),
+            shop_id=self.shop.id,
+        ).only("external_id", *PRODUCT_INFO_FIELDS)
+        existing = {product_info.external_id: product_info for product_info in rows}
+        rekeyed = []
+        released = []
+        duplicates = set()
+        for product_info in list(existing.values()):
+            external_id = wanted.get(product_info.product_id, product_info.external_id)
+            if external_id == product_info.external_id:
+                continue
+            self.touched_products.add(product_info.product_id)
+            if (
+                product_info.external_id in self.seen
+                and product_info.external_id not in batch_ids
+            ):
+                # товар уже записан этой загрузкой под другим id
+                duplicates.add(external_id)
+            elif (
+                product_info.external_id not in batch_ids
+                and external_id not in existing
+            ):
+                del existing[product_info.external_id]
+                product_info.external_id = external_id
+                existing[external_id] = product_info
+                rekeyed.append(product_info)
+            else:
+                del existing[product_info.external_id]
+                released.append(product_info.pk)
+
+        if rekeyed:
+            ProductInfo.objects.bulk_update(rekeyed, ["external_id"])
+        if released:
+            baskets = self.basket_ids(released)
+            ProductInfo.objects.filter(id__in=released).delete()
+            Order.objects.filter(id__in=baskets).refresh_totals()
+            self.deleted += len(released)
+        for item in valid:
+            if item["id"] in duplicates:
+                self.duplicate_product(item)
+        valid = [item for item in valid if item["id"] not in duplicates]
+        ids = {item["id"] for item in valid}
+        return valid, {
+            external_id: product_info
+            for external_id, product_info in existing.items()
+            if external_id in ids
+        }
+
+    def duplicate_product(self, item):
+        self.add_error(item["id"], "товар уже есть в прайсе под другим id")
+        self.seen.add(item["id"])
+
+    def sync_parameters(self, wanted, existing_ids):
+        """
+        приводим параметры позиций к прайсу, трогая только отличающиеся строки
+
+        Возвращает идентификаторы позиций, параметры которых изменились.
+        """
+        created = []
+        changed = []
+        current = {}
+        if existing_ids:
+            for product_parameter in ProductParameter.objects.filter(
+                product_info_id__in=existing_ids
+            ).only("product_info_id", "parameter_id", "value", "numeric_value"):
+                current[
+                    (product_parameter.product_info_id, product_parameter.parameter_id)
+                ] = product_parameter
+
+        for product_info_id, values in wanted.items():
+            for parameter_id, value in values.items():
+                numeric_value = parse_numeric(value)
+                product_parameter = current.pop((product_info_id, parameter_id), None)
+                if product_parameter is None:
+                    created.append(
+                        ProductParameter(
+                            product_info_id=product_info_id,
+                            parameter_id=parameter_id,
+                            value=value,
+                            numeric_value=numeric_value,
+                        )
+                    )
+                elif (
+                    product_parameter.value != value
+                    or product_parameter.numeric_value != numeric_value
+                ):
+                    product_parameter.value = value
+                    product_parameter.numeric_value = numeric_value
+                    changed.append(product_parameter)
+        deleted = [product_parameter.pk for product_parameter in current.values()]
+
+        if deleted:
+            ProductParameter.objects.filter(id__in=deleted).delete()
+        if changed:
+            ProductParameter.objects.bulk_update(changed, ["value", "numeric_value"])
+        ProductParameter.objects.bulk_create(created)
+        return {
+            product_parameter.product_info_id
+            for product_parameter in chain(created, changed, current.values())
+        }
+
+    def delete_missing(self):
+        """
+        удаляем позиции магазина, которых больше нет в прайсе
+        """
+        missing = []
+        for product_info_id, external_id, product_id in ProductInfo.objects.filter(
+            shop_id=self.shop.id
+        ).values_list("id", "external_id", "product_id"):
+            if external_id not in self.seen:
+                missing.append(product_info_id)
+                self.touched_products.add(product_id)
+        for ids in batched(missing, self.batch_size):
+            baskets = self.basket_ids(ids)
+            ProductInfo.objects.filter(id__in=ids).delete()
+            Order.objects.filter(id__in=baskets).refresh_totals()
+        self.deleted += len(missing)
+
+    def delete_all(self):
+        product_infos = ProductInfo.objects.filter(shop_id=self.shop.id)
+        self.touched_products.update(product_infos.values_list("product_id", flat=True))
+        baskets = self.basket_ids(product_infos.values("id"))
+        product_infos.delete()
+        Order.objects.filter(id__in=baskets).refresh_totals()
+
+    @staticmethod
+    def basket_ids(product_info_ids):
+        """
+        корзины, в которых лежат указанные позиции
+        """
+        return list(
+            Order.objects.filter(
+                status="basket", ordered_items__product_info_id__in=product_info_ids
+            )
+            .values_list("id", flat=True)
+            .distinct()
+        )
+
+    def resolve_products(self, keys):
+        """
+        находим или создаем товары по паре (название, категория) за пару запросов
+        """
+        products = {
+            key: self.known_products[key] for key in keys if key in self.known_products
+        }
+        unknown = keys - products.keys()
+        if unknown:
+            products.update(self.fetch_products(unknown))
+        missing = keys - products.keys()
+        if missing:
+            Product.objects.bulk_create(
+                [
+                    Product(name=name, category_id=category_id)
+                    for name, category_id in missing
+                ]
+            )
+            products.update(self.fetch_products(missing))
+        return products
+
+    @staticmethod
+    def fetch_products(keys):
+        products = {}
+        rows = Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys},
+        ).values_list("name", "category_id", "id")
+        for name, category_id, product_id in rows:
+            if (name, category_id) in keys:
+                products.setdefault((name, category_id), product_id)
+        return products
+
+    def resolve_parameters(self, names):
+        """
+        находим или создаем параметры по названию за пару запросов
+        """
+        parameters = {
+            name: self.known_parameters[name]
+            for name in names
+            if name in self.known_parameters
+        }
+        unknown = names - parameters.keys()
+        if unknown:
+            parameters.update(
+                Parameter.objects.filter(name_parameter__in=unknown).values_list(
+                    "name_parameter", "id"
+                )
+            )
+        missing = names - parameters.keys()
+        if missing:
+            Parameter.objects.bulk_create(
+                [Parameter(name_parameter=name) for name in missing]
+            )
+            parameters.update(
+                Parameter.objects.filter(name_parameter__in=missing).values_list(
+                    "name_parameter", "id"
+                )
+            )
+        return parameters
@@ -0,0 +1,273 @@
+import logging
+import time
+from smtplib import SMTPDataError, SMTPRecipientsRefused
+from uuid import uuid4
+
+import ujson
+from celery import current_app
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from kombu.exceptions import OperationalError
+from redis.exceptions import RedisError
+
+from backend.cache import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+MAIL_QUEUE_KEY = "mail:queue"
+# пачка, которую отправляет flush_mail_queue: письма лежат здесь,
+# пока их отправка не подтверждена
+MAIL_PROCESSING_KEY = "mail:processing"
+MAIL_FLUSH_LOCK_KEY = "mail:flush_lock"
+ADMIN_DIGEST_KEY = "mail:admin_digest"
+MAIL_STATS_KEY = "mail:stats"
+SEND_QUEUED_MAIL_TASK = "backend.tasks.send_queued_mail_task"
+
+
+def get_redis():
+    return get_redis_client(settings.MAIL_REDIS_URL)
+
+
+def render_mail(template, context=None):
+    """
+    собираем письмо из шаблона backend/mail/<template>.txt
+
+    Первая строка шаблона - тема письма, остальное - текст.
+    """
+    subject, _, body = render_to_string(
+        f"backend/mail/{template}.txt", context or {}
+    ).partition("\n")
+    return {"subject": subject.strip(), "body": body.strip()}
+
+
+def queue_mail(template, recipients, context=None):
+    """
+    ставим письмо в очередь Redis на отправку пачкой
+
+    Задача отправки планируется только первым письмом в пустой очереди,
+    следующие письма за MAIL_FLUSH_DELAY секунд уйдут с ним одним
+    SMTP-соединением. Если Redis недоступен, письмо отправляется сразу.
+    """
+    message = {**render_mail(template, context), "to": list(recipients), "attempts": 0}
+    try:
+        queued = get_redis().rpush(MAIL_QUEUE_KEY, ujson.dumps(message))
+    except (RedisError, OSError) as error:
+        logger.warning("Mail was not queued, sending it directly: %s", error)
+        send_messages(get_connection(), [message])
+        return
+    if queued == 1:
+        schedule_mail_flush(settings.MAIL_FLUSH_DELAY)
+
+
+def schedule_mail_flush(countdown=0):
+    try:
+        current_app.send_task(SEND_QUEUED_MAIL_TASK, countdown=countdown)
+    except (OperationalError, RedisError, OSError) as error:
+        # очередь все равно разберет периодический запуск задачи
+        logger.warning("Mail flush was not scheduled: %s", error)
+
+
+def queue_admin_notification(order_id):
+    """
+    копим номера новых заказов для сводного письма админу
+    """
+    try:
+        get_redis().rpush(ADMIN_DIGEST_KEY, order_id)
+    except (RedisError, OSError) as error:
+        logger.warning("Order was not added to the admin digest: %s", error)
+        queue_mail(
+            "admin_digest", [settings.EMAIL_HOST_USER], {"order_ids": [order_id]}
+        )
+
+
+def queue_admin_digest():
+    """
+    ставим в очередь одно письмо админу обо всех накопленных заказах
+    """
+    pipeline = get_redis().pipeline(transaction=True)
+    pipeline.lrange(ADMIN_DIGEST_KEY, 0, -1)
+    pipeline.delete(ADMIN_DIGEST_KEY)
+    order_ids, _ = pipeline.execute()
+    if order_ids:
+        queue_mail(
+            "admin_digest",
+            [settings.EMAIL_HOST_USER],
+            {"order_ids": [int(order_id) for order_id in order_ids]},
+        )
+    return len(order_ids)
+
+
+def claim_mail_batch(client, size):
+    """
+    переносим до size писем из начала очереди в список отправляемых
+
+    Письма остаются в Redis до подтверждения отправки: если воркер упадет,
+    следующий запуск вернет их в очередь через recover_mail_batch.
+    Возвращает пары (письмо как в Redis, разобранное письмо).
+    """
+    pipeline = client.pipeline(transaction=True)
+    for _ in range(size):
+        pipeline.lmove(MAIL_QUEUE_KEY, MAIL_PROCESSING_KEY, "LEFT", "RIGHT")
+    return [(raw, ujson.loads(raw)) for raw in pipeline.execute() if raw is not None]
+
+
+def recover_mail_batch(client):
+    """
+    возвращаем в начало очереди пачку, оставшуюся от упавшей отправки
+    """
+    recovered = 0
+    while client.lmove(MAIL_PROCESSING_KEY, MAIL_QUEUE_KEY, "RIGHT", "LEFT"):
+        recovered += 1
+    if recovered:
+        logger.warning("Requeued %d mails left by an interrupted flush", recovered)
+
+
+def ack_mail(client, raw):
+    client.lrem(MAIL_PROCESSING_KEY, 1, raw)
+
+
+def requeue_mail_batch(client, failed, unsent=()):
+    """
+    возвращаем неотправленные письма пачки в начало очереди и очищаем
+    список отправляемых
+
+    Попытка засчитывается только письмам из failed, на которых была
+    ошибка; письма из unsent не отправлялись. Письма, которые не ушли
+    за MAIL_MAX_ATTEMPTS попыток, выбрасываются, чтобы один неверный
+    адрес не останавливал всю очередь.
+    """
+    retry = []
+    for message in failed:
+        message["attempts"] += 1
+        if message["attempts"] < settings.MAIL_MAX_ATTEMPTS:
+            retry.append(message)
+        else:
+            logger.error(
+                "Mail to %s was dropped after %d attempts",
+                message["to"],
+                message["attempts"],
+            )
+    retry.extend(unsent)
+    pipeline = client.pipeline(transaction=True)
+    if retry:
+        pipeline.lpush(
+            MAIL_QUEUE_KEY, *reversed([ujson.dumps(message) for message in retry])
+        )
+    pipeline.delete(MAIL_PROCESSING_KEY)
+    pipeline.execute()
+
+
+def acquire_flush_lock(client):
+    """
+    занимаем отправку очереди: список отправляемых писем у нее один
+    """
+    token = str(uuid4())
+    if client.set(
+        MAIL_FLUSH_LOCK_KEY, token, nx=True, ex=settings.MAIL_FLUSH_LOCK_TIMEOUT
+    ):
+        return token
+    return None
+
+
+def release_flush_lock(client, token):
+    with client.pipeline() as pipeline:
+        pipeline.watch(MAIL_FLUSH_LOCK_KEY)
+        if pipeline.get(MAIL_FLUSH_LOCK_KEY) == token.encode():
+            pipeline.multi()
+            pipeline.delete(MAIL_FLUSH_LOCK_KEY)
+            pipeline.execute()
+
+
+def send_messages(connection, messages):
+    return connection.send_messages(
+        [
+            EmailMessage(
+                message["subject"],
+                message["body"],
+                settings.EMAIL_HOST_USER,
+                message["to"],
+                connection=connection,
+            )
+            for message in messages
+        ]
+    )
+
+
+def send_mail_batch(client, connection, batch, refused):
+    """
+    отправляем пачку писем по одному, возвращаем число отправленных
+
+    Отклоненные сервером письма копятся в refused и остаются в списке
+    отправляемых до конца разбора очереди.
+    """
+    sent = 0
+    for index, (raw, message) in enumerate(batch):
+        try:
+            sent += send_messages(connection, [message]) or 0
+        except (SMTPRecipientsRefused, SMTPDataError) as error:
+            logger.warning("Mail to %s was refused: %s", message["to"], error)
+            refused.append(message)
+            continue
+        except Exception:
+            requeue_mail_batch(
+                client,
+                refused + [message],
+                [message for _, message in batch[index + 1 :]],
+            )
+            raise
+        ack_mail(client, raw)
+    return sent
+
+
+def flush_mail_queue(batch_size=None):
+    """
+    отправляем всю очередь писем пачками через одно SMTP-соединение
+
+    Письма отправляются по одному, каждое подтверждается сразу после
+    отправки, поэтому при ошибке повторяются только неотправленные.
+    Письмо, отклоненное сервером (неверный адрес), после разбора очереди
+    возвращается в нее с новой попыткой, а отправка продолжается. При ошибке
+    соединения неотправленные письма возвращаются в очередь, а ошибка
+    пробрасывается для повтора задачи. Очередь разбирает один процесс:
+    если она уже занята, ничего не отправляется.
+
+    Возвращает число отправленных писем, время и скорость отправки;
+    те же показатели копятся в хэше MAIL_STATS_KEY.
+    """
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+    client = get_redis()
+    sent = 0
+    started = time.monotonic()
+    token = acquire_flush_lock(client)
+    if token is None:
+        return {"sent": 0, "elapsed": 0.0, "per_second": 0}
+    try:
+        recover_mail_batch(client)
+        refused = []
+        with get_connection(fail_silently=False) as connection:
+            while True:
+                batch = claim_mail_batch(client, batch_size)
+                if not batch:
+                    break
+                sent += send_mail_batch(client, connection, batch, refused)
+        # отклоненные письма повторяются при следующем разборе очереди
+        requeue_mail_batch(client, refused)
+    finally:
+        release_flush_lock(client, token)
+    elapsed = time.monotonic() - started
+    stats = {
+        "sent": sent,
+        "elapsed": round(elapsed, 3),
+        "per_second": round(sent / elapsed, 1) if elapsed else 0,
+    }
+    if sent:
+        pipeline = client.pipeline(transaction=False)
+        pipeline.hincrby(MAIL_STATS_KEY, "sent", sent)
+        pipeline.hincrbyfloat(MAIL_STATS_KEY, "elapsed", elapsed)
+        pipeline.hset(MAIL_STATS_KEY, "last_per_second", stats["per_second"])
+        pipeline.execute()
+        logger.info(
+            "Sent %d mails in %.2fs (%.1f/s)", sent, elapsed, stats["per_second"]
+        )
+    return stats
@@ -0,0 +1,150 @@
+import time
+
+import ujson
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from backend.fast_serializers import (
+    PRODUCT_INFO_VALUES,
+    serialize_orders,
+    serialize_product_infos,
+)
+from backend.models import (
+    Category,
+    Order,
+    OrderItem,
+    Parameter,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    User,
+)
+from backend.renderers import UJSONRenderer
+from backend.serializers import OrderSerializer, ProductInfoSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает сериализаторы DRF и быструю сериализацию списков "
+        "на синтетических данных (данные откатываются после замера)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--parameters", type=int, default=5)
+        parser.add_argument("--items", type=int, default=5, help="позиций в заказе")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options["rows"], options["parameters"], options["items"])
+            offers = ProductInfo.objects.filter(shop__user=user).order_by("id")
+            results = {
+                "rows": options["rows"],
+                "products": self.compare(
+                    lambda: JSONRenderer().render(
+                        ProductInfoSerializer(
+                            offers.select_related("product__category").prefetch_related(
+                                Prefetch(
+                                    "product_parameters",
+                                    queryset=ProductParameter.objects.select_related(
+                                        "parameter"
+                                    ).order_by("id"),
+                                )
+                            ),
+                            many=True,
+                        ).data
+                    ),
+                    lambda: UJSONRenderer().render(
+                        serialize_product_infos(
+                            list(offers.values(*PRODUCT_INFO_VALUES))
+                        )
+                    ),
+                    options["rows"],
+                    options["repeat"],
+                ),
+                "orders": self.compare(
+                    lambda: JSONRenderer().render(
+                        OrderSerializer(
+                            Order.objects.filter(user=user)
+                            .select_related("contact")
+                            .prefetch_related(
+                                Prefetch(
+                                    "ordered_items",
+                                    queryset=OrderItem.objects.order_by("id"),
+                                )
+                            ),
+                            many=True,
+                        ).data
+                    ),
+                    lambda: UJSONRenderer().render(
+                        serialize_orders(Order.objects.filter(user=user))
+                    ),
+                    options["rows"],
+                    options["repeat"],
+                ),
+            }
+            transaction.set_rollback(True)
+        self.stdout.write(ujson.dumps(results, indent=2))
+
+    def compare(self, serializer, fast, rows, repeat):
+        """
+        лучшее из repeat замеров обоих способов, секунд на 10 тысяч строк
+        """
+        result = {}
+        for name, render in (("serializer", serializer), ("fast", fast)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                content = render()
+                timings.append(time.perf_counter() - started)
+            result[name] = round(min(timings) * 10000 / rows, 4)
+            result[f"{name}_bytes"] = len(content)
+        result["speedup"] = round(result["serializer"] / result["fast"], 1)
+        return result
+
+    @staticmethod
+    def seed(rows, parameters, items):
+        user = User.objects.create_user(
+            email="benchmark@example.com", password="benchmark", type="buyer"
+        )
+        shop = Shop.objects.create(name="benchmark", user=user)
+        category = Category.objects.create(name="benchmark")
+        names = Parameter.objects.bulk_create(
+            Parameter(name_parameter=f"benchmark {number}")
+            for number in range(parameters)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"Товар {number}", category=category) for number in range(rows)
+        )
+        offers = ProductInfo.objects.bulk_create(
+            ProductInfo(
+                product=product,
+                shop=shop,
+                external_id=number,
+                model=f"model/{number}",
+                quantity=number % 10,
+                price=100 + number,
+                price_rrc=120 + number,
+            )
+            for number, product in enumerate(products)
+        )
+        ProductParameter.objects.bulk_create(
+            ProductParameter(product_info=offer, parameter=name, value=str(number))
+            for offer in offers
+            for number, name in enumerate(names)
+        )
+        orders = Order.objects.bulk_create(
+            Order(user=user, status="new") for _ in range(rows)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order, product_info=offers[(number + index) % rows], quantity=1
+            )
+            for number, order in enumerate(orders)
+            for index in range(items)
+        )
+        return user
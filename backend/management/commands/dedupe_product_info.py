@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from backend.importer import PriceListImporter, batched
+from backend.models import Order, ProductInfo
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет повторы позиций магазина с одним внешним id, оставляя "
+        "последнюю загруженную; нужно выполнить перед добавлением "
+        "ограничения unique_product_info_external_id в существующую базу"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="только посчитать повторы"
+        )
+
+    def handle(self, *args, **options):
+        groups = (
+            ProductInfo.objects.values("shop_id", "external_id")
+            .annotate(rows=Count("id"), keep=Max("id"))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+        duplicates = []
+        for group in groups.iterator():
+            duplicates.extend(
+                ProductInfo.objects.filter(
+                    shop_id=group["shop_id"], external_id=group["external_id"]
+                )
+                .exclude(id=group["keep"])
+                .values_list("id", flat=True)
+            )
+        if options["dry_run"]:
+            self.stdout.write(f"Повторов позиций: {len(duplicates)}")
+            return
+        with transaction.atomic():
+            for ids in batched(duplicates, options["batch_size"]):
+                baskets = PriceListImporter.basket_ids(ids)
+                ProductInfo.objects.filter(id__in=ids).delete()
+                Order.objects.filter(id__in=baskets).refresh_totals()
+        self.stdout.write(f"Удалено повторов позиций: {len(duplicates)}")
@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+import ujson
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from backend.benchmarks import check_benchmark_database, write_price_list
+from backend.explain import explain_views
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет базу синтетическим прайсом, выполняет запросы основных "
+        "эндпоинтов и выводит EXPLAIN их SELECT-запросов с полными "
+        "просмотрами таблиц"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--goods", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--plans", action="store_true", help="выводить планы всех запросов"
+        )
+        parser.add_argument(
+            "--strict",
+            action="store_true",
+            help="завершаться ошибкой, если есть полные просмотры таблиц",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            check_benchmark_database()
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        # тестовый клиент, письма в памяти вместо SMTP
+        setup_test_environment()
+
+        descriptor, price_list = tempfile.mkstemp(suffix=".yaml")
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as stream:
+                write_price_list(stream, options["goods"], seed=options["seed"])
+            report = explain_views(price_list)
+        finally:
+            os.remove(price_list)
+
+        flagged = 0
+        for endpoint, queries in report.items():
+            scans = [query for query in queries if query["scans"]]
+            flagged += len(scans)
+            self.stdout.write(
+                f"{endpoint}: {len(queries)} запросов, "
+                f"полных просмотров: {len(scans)}, "
+                f"ожидаемых: {sum(bool(query['expected']) for query in queries)}"
+            )
+            for query in queries if options["plans"] else scans:
+                label = ", ".join(query["scans"]) or "ok"
+                if query["expected"]:
+                    label += f" (ожидаемо: {', '.join(query['expected'])})"
+                self.stdout.write(f"  [{label}] {query['sql']}")
+                plan = query["plan"]
+                if isinstance(plan, list) and all(isinstance(row, str) for row in plan):
+                    plan = "\n    ".join(plan)
+                else:
+                    plan = ujson.dumps(plan, indent=2, ensure_ascii=False)
+                self.stdout.write(f"    {plan}")
+        if flagged and options["strict"]:
+            raise CommandError(f"Полные просмотры таблиц в {flagged} запросах")
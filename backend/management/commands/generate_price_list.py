@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from backend.benchmarks import write_price_list
+
+
+class Command(BaseCommand):
+    help = "Пишет синтетический прайс магазина в формате data/shop1.yaml"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="путь к файлу прайса")
+        parser.add_argument("--goods", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--shop", default="Benchmark")
+
+    def handle(self, *args, **options):
+        with open(options["output"], "w", encoding="utf-8") as stream:
+            write_price_list(
+                stream, options["goods"], seed=options["seed"], shop=options["shop"]
+            )
+        self.stdout.write(f"Записано позиций: {options['goods']}")
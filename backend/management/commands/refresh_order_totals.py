@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from backend.importer import batched
+from backend.models import Order
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сохраненные суммы и количество товаров заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="пересчитать и подтвержденные заказы по текущим ценам",
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.order_by("id")
+        if not options["all"]:
+            orders = orders.filter(status="basket")
+        ids = orders.values_list("id", flat=True).iterator()
+        total = 0
+        for batch in batched(ids, options["batch_size"]):
+            total += Order.objects.filter(id__in=batch).refresh_totals()
+        self.stdout.write(f"Обновлено заказов: {total}")
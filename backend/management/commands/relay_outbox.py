@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = "Разбирает очередь событий после фиксации транзакций (отдельным процессом)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="пауза в секундах, когда очередь пуста",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="разобрать очередь один раз и выйти"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            relayed = relay_outbox(options["batch_size"])
+            if options["once"]:
+                self.stdout.write(f"Разобрано событий: {relayed}")
+                return
+            if not relayed:
+                time.sleep(options["interval"])
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+import ujson
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from backend.benchmarks import (
+    SCENARIOS,
+    BenchmarkRunner,
+    check_benchmark_database,
+    write_price_list,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет сценарии нагрузки (загрузка прайса, поиск, корзина, "
+        "подтверждение заказа) на текущей базе и выводит результаты в JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenarios",
+            default=",".join(SCENARIOS),
+            help=f"через запятую из: {', '.join(SCENARIOS)}",
+        )
+        parser.add_argument("--goods", type=int, default=1000)
+        parser.add_argument(
+            "--price-list", help="готовый прайс вместо синтетического на --goods"
+        )
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="файл для результатов")
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"].split(",")
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        try:
+            check_benchmark_database()
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+        # тестовый клиент, письма в памяти вместо SMTP
+        setup_test_environment()
+
+        price_list = options["price_list"]
+        if price_list is None:
+            descriptor, price_list = tempfile.mkstemp(suffix=".yaml")
+            with os.fdopen(descriptor, "w", encoding="utf-8") as stream:
+                write_price_list(stream, options["goods"], seed=options["seed"])
+        try:
+            results = BenchmarkRunner(
+                price_list,
+                users=options["users"],
+                requests=options["requests"],
+                seed=options["seed"],
+            ).run(scenarios)
+        finally:
+            if options["price_list"] is None:
+                os.remove(price_list)
+
+        results["goods"] = results["scenarios"].get("import", {}).get("rows")
+        output = ujson.dumps(results, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as stream:
+                stream.write(output)
+        self.stdout.write(output)
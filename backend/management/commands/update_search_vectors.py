@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from backend.importer import batched
+from backend.models import ProductInfo
+from backend.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает поисковые векторы позиций каталога"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="пересчитать все позиции, а не только без вектора",
+        )
+
+    def handle(self, *args, **options):
+        product_infos = ProductInfo.objects.order_by("id")
+        if not options["all"]:
+            product_infos = product_infos.filter(search_vector__isnull=True)
+        ids = product_infos.values_list("id", flat=True).iterator()
+        total = 0
+        for batch in batched(ids, options["batch_size"]):
+            update_search_vectors(batch)
+            total += len(batch)
+        self.stdout.write(f"Обновлено позиций: {total}")
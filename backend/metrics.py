@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import ujson
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# отправляется после каждого запроса со словарем его показателей
+request_measured = Signal()
+
+METRICS = (
+    ("requests", "api_requests_total", "Число запросов"),
+    ("queries", "api_db_queries_total", "Число запросов к базе"),
+    ("db_seconds", "api_db_seconds_total", "Время запросов к базе, с"),
+    ("serialize_seconds", "api_serialize_seconds_total", "Время сериализации, с"),
+    ("render_seconds", "api_render_seconds_total", "Время рендера ответа, с"),
+    ("seconds", "api_request_seconds_total", "Время обработки запроса, с"),
+    ("bytes", "api_response_bytes_total", "Размер ответов, байт"),
+)
+
+
+class MetricsRegistry:
+    """
+    Класс для накопления показателей запросов по (эндпоинт, метод)
+
+    Показатели хранятся в памяти процесса, как и в prometheus_client:
+    при нескольких процессах каждый отдает свои.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.totals = {}
+        self.statuses = {}
+        self.max_queries = {}
+
+    def add(self, metrics):
+        key = (metrics["endpoint"], metrics["method"])
+        with self.lock:
+            totals = self.totals.setdefault(
+                key, dict.fromkeys((name for name, *_ in METRICS), 0)
+            )
+            totals["requests"] += 1
+            for name in (
+                "queries",
+                "db_seconds",
+                "serialize_seconds",
+                "render_seconds",
+                "seconds",
+            ):
+                totals[name] += metrics[name]
+            totals["bytes"] += metrics["bytes"] or 0
+            status_key = (*key, metrics["status"])
+            self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+            self.max_queries[key] = max(
+                self.max_queries.get(key, 0), metrics["queries"]
+            )
+
+    def export(self):
+        """
+        показатели в текстовом формате Prometheus
+        """
+        with self.lock:
+            totals = dict(self.totals)
+            statuses = dict(self.statuses)
+            max_queries = dict(self.max_queries)
+        lines = []
+        for name, metric, description in METRICS:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            if name == "requests":
+                for (endpoint, method, status), value in sorted(statuses.items()):
+                    lines.append(
+                        f'{metric}{{endpoint="{endpoint}",method="{method}",'
+                        f'status="{status}"}} {value}'
+                    )
+                continue
+            for (endpoint, method), values in sorted(totals.items()):
+                lines.append(
+                    f'{metric}{{endpoint="{endpoint}",method="{method}"}} '
+                    f"{round(values[name], 6)}"
+                )
+        lines.append("# HELP api_db_queries_max Наибольшее число запросов к базе")
+        lines.append("# TYPE api_db_queries_max gauge")
+        for (endpoint, method), value in sorted(max_queries.items()):
+            lines.append(
+                f'api_db_queries_max{{endpoint="{endpoint}",method="{method}"}} {value}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class QueryCounter:
+    """
+    Класс для подсчета запросов к базе и их времени (execute_wrapper)
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    """
+    Класс для замера запросов к API: число и время запросов к базе,
+    время сериализации (measure_serialization) и рендера и размер ответа
+    по имени URL
+
+    Показатели копятся в registry (эндпоинт metrics), пишутся
+    в лог backend.metrics одной строкой JSON и рассылаются сигналом
+    request_measured.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        request.serialize_seconds = 0.0
+        request.render_seconds = 0.0
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        match = request.resolver_match
+        metrics = {
+            "endpoint": match.view_name if match else "unknown",
+            "method": request.method,
+            "status": response.status_code,
+            "queries": counter.queries,
+            "db_seconds": counter.seconds,
+            "serialize_seconds": request.serialize_seconds,
+            "render_seconds": request.render_seconds,
+            "seconds": time.perf_counter() - started,
+            "bytes": None if response.streaming else len(response.content),
+        }
+        registry.add(metrics)
+        budget = settings.QUERY_BUDGETS.get(metrics["endpoint"])
+        if budget is not None and metrics["queries"] > budget:
+            logger.warning(
+                "%s %s made %d queries, budget is %d",
+                request.method,
+                request.path,
+                metrics["queries"],
+                budget,
+            )
+        if settings.METRICS_LOG:
+            logger.info(ujson.dumps(metrics))
+        request_measured.send(sender=self.__class__, request=request, metrics=metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # ответы DRF рендерятся после этого хука
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_seconds += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+@contextmanager
+def measure_serialization(request):
+    """
+    добавляем время блока к показателю serialize_seconds запроса
+
+    Оборачивает сборку данных ответа (serializer.data, быстрые
+    сериализаторы); запросы к базе внутри блока входят и в db_seconds.
+    """
+    # атрибуты, записанные в Request DRF, не видны в HttpRequest middleware
+    request = getattr(request, "_request", request)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.serialize_seconds = (
+            getattr(request, "serialize_seconds", 0.0) + time.perf_counter() - started
+        )
+
+
+class SerializationMetricsMixin:
+    """
+    Класс-примесь для ListAPIView: list с замером сериализации страницы
+    """
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        with measure_serialization(request):
+            data = self.get_serializer(page, many=True).data
+        return self.get_paginated_response(data)
+
+
+def metrics_view(request):
+    """
+    показатели API для Prometheus; с METRICS_TOKEN нужен заголовок
+    Authorization: Bearer <токен>, без него показатели открыты только при DEBUG
+    """
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.export(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+class QueryBudgetMixin:
+    """
+    Класс-примесь для тестов с бюджетом запросов к базе по эндпоинтам
+
+    Бюджеты берутся из настройки QUERY_BUDGETS и атрибута query_budgets
+    ({"backend:basket": 4}): тест падает, если любой его запрос
+    к эндпоинту сделал больше запросов к базе.
+    """
+
+    query_budgets = {}
+
+    def _pre_setup(self):
+        # до setUp, чтобы не зависеть от вызова super().setUp() в тестах
+        super()._pre_setup()
+        self.budget_violations = []
+        request_measured.connect(self.check_query_budget)
+        self.addCleanup(request_measured.disconnect, self.check_query_budget)
+        self.addCleanup(self.assert_query_budgets)
+
+    def check_query_budget(self, sender, request, metrics, **kwargs):
+        budget = self.query_budgets.get(
+            metrics["endpoint"], settings.QUERY_BUDGETS.get(metrics["endpoint"])
+        )
+        if budget is not None and metrics["queries"] > budget:
+            self.budget_violations.append(
+                f"{metrics['method']} {request.path} ({metrics['endpoint']}): "
+                f"{metrics['queries']} запросов к базе при бюджете {budget}"
+            )
+
+    def assert_query_budgets(self):
+        if self.budget_violations:
+            self.fail("Превышен бюджет запросов:\n" + "\n".join(self.budget_violations))
@@ -1,7 +1,10 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 USER_TYPE_CHOICES = (
@@ -19,6 +22,16 @@ STATUS_CHOICES = (
     ("canceled", "Отменен"),
 )
 
+# допустимые переходы статусов заказа после подтверждения
+ORDER_TRANSITIONS = {
+    "new": ("confirmed", "canceled"),
+    "confirmed": ("assembled", "canceled"),
+    "assembled": ("sent", "canceled"),
+    "sent": ("delivered",),
+    "delivered": (),
+    "canceled": (),
+}
+
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -105,6 +118,12 @@ class Shop(models.Model):
         on_delete=models.CASCADE,
     )
     status = models.BooleanField(verbose_name="Статус получения заказов", default=True)
+    import_job_id = models.CharField(
+        max_length=50, verbose_name="Текущая загрузка прайса", blank=True, default=""
+    )
+    import_started_at = models.DateTimeField(
+        verbose_name="Начало загрузки прайса", null=True, blank=True
+    )
 
     class Meta:
         verbose_name = "Магазин"
@@ -115,6 +134,32 @@ class Shop(models.Model):
         return f"{self.name} {self.user} {self.status}"
 
 
+class PriceImportJob(models.Model):
+    """
+    Класс для загрузки прайса, поставленной в очередь
+
+    По нему ход загрузки отдается только магазину, который ее запустил.
+    """
+
+    job_id = models.CharField(
+        max_length=50, unique=True, verbose_name="Идентификатор задачи"
+    )
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="import_jobs",
+        on_delete=models.CASCADE,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Загрузка прайса"
+        verbose_name_plural = "Загрузки прайсов"
+
+    def __str__(self):
+        return f"{self.job_id} {self.shop_id}"
+
+
 class Category(models.Model):
     name = models.CharField(max_length=50, verbose_name="Название категории")
     shops = models.ManyToManyField(
@@ -144,6 +189,10 @@ class Product(models.Model):
         verbose_name = "Товар"
         verbose_name_plural = "Список товаров"
         ordering = ("name",)
+        indexes = [
+            # загрузка прайса ищет товары по паре (название, категория)
+            models.Index(fields=["name", "category"], name="product_name_category_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.category})"
@@ -169,6 +218,10 @@ class ProductInfo(models.Model):
     price_rrc = models.PositiveIntegerField(
         verbose_name="Рекомендуемая розничная цена", default=0
     )
+    # заполняется при загрузке прайса, GIN-индекс создается после миграций
+    search_vector = SearchVectorField(
+        verbose_name="Поисковый вектор", null=True, editable=False
+    )
 
     class Meta:
         verbose_name = "Информация о продукте"
@@ -177,6 +230,14 @@ class ProductInfo(models.Model):
             models.UniqueConstraint(
                 fields=["product", "shop"], name="unique_product_info"
             ),
+            # в существующей базе повторы убирает manage.py dedupe_product_info,
+            # иначе ограничение не создастся
+            models.UniqueConstraint(
+                fields=["shop", "external_id"], name="unique_product_info_external_id"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["price", "id"], name="product_info_price_idx"),
         ]
 
     def __str__(self):
@@ -190,6 +251,10 @@ class Parameter(models.Model):
         verbose_name = "Параметр"
         verbose_name_plural = "Существующие характеристики товара"
         ordering = ("name_parameter",)
+        indexes = [
+            # фильтр каталога и загрузка прайса ищут параметры по названию
+            models.Index(fields=["name_parameter"], name="parameter_name_idx"),
+        ]
 
     def __str__(self):
         return self.name_parameter
@@ -211,6 +276,10 @@ class ProductParameter(models.Model):
         on_delete=models.CASCADE,
     )
     value = models.CharField(max_length=300, verbose_name="Значение")
+    # числовое значение для фильтров по диапазону, заполняется при загрузке
+    numeric_value = models.FloatField(
+        verbose_name="Числовое значение", null=True, blank=True, editable=False
+    )
 
     class Meta:
         verbose_name = "Параметры"
@@ -220,6 +289,17 @@ class ProductParameter(models.Model):
                 fields=["product_info", "parameter"], name="unique_product_parameter"
             ),
         ]
+        # product_info в конце индексов: фильтры читают только индекс
+        indexes = [
+            models.Index(
+                fields=["parameter", "numeric_value", "product_info"],
+                name="product_parameter_number_idx",
+            ),
+            models.Index(
+                fields=["parameter", "value", "product_info"],
+                name="product_parameter_value_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product_info} ({self.parameter} {self.value}"
@@ -249,12 +329,85 @@ class Contact(models.Model):
         return f"{self.city} {self.street} {self.house}"
 
 
+class OrderQuerySet(models.QuerySet):
+    def basket(self, user):
+        """
+        корзина пользователя, созданная при необходимости, за один запрос
+
+        INSERT ... ON CONFLICT по частичному уникальному индексу
+        order_one_basket_per_user: параллельные запросы одного пользователя
+        получают одну и ту же корзину. Пустой DO UPDATE нужен, чтобы
+        RETURNING вернул и уже существующую строку.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        columns = ", ".join(
+            quote(field.column) for field in self.model._meta.concrete_fields
+        )
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        sql = (
+            f"INSERT INTO {quote(self.model._meta.db_table)} "
+            f"({quote('user_id')}, {quote('status')}, {quote('date_time')}, "
+            f"{quote('updated_at')}, {quote('total_sum')}, {quote('item_count')}) "
+            "VALUES (%s, 'basket', %s, %s, 0, 0) "
+            f"ON CONFLICT ({quote('user_id')}) WHERE {quote('status')} = 'basket' "
+            f"DO UPDATE SET {quote('status')} = EXCLUDED.{quote('status')} "
+            f"RETURNING {columns}"
+        )
+        # raw() применяет конвертеры полей к возвращенной строке
+        return list(self.raw(sql, [user.pk, now, now]))[0]
+
+    @staticmethod
+    def item_totals(items):
+        """
+        подзапросы суммы и количества товаров заказа по позициям items
+        """
+        items = (
+            items.filter(order_id=models.OuterRef("id")).order_by().values("order_id")
+        )
+        return {
+            "total_sum": Coalesce(
+                models.Subquery(
+                    items.annotate(
+                        total=models.Sum(
+                            models.F("quantity") * models.F("product_info__price")
+                        )
+                    ).values("total")
+                ),
+                0,
+            ),
+            "item_count": Coalesce(
+                models.Subquery(
+                    items.annotate(count=models.Sum("quantity")).values("count")
+                ),
+                0,
+            ),
+        }
+
+    def refresh_totals(self):
+        """
+        пересчитываем сумму и количество товаров заказов одним UPDATE
+        """
+        return self.update(**self.item_totals(OrderItem.objects.all()))
+
+    def with_shop_totals(self, shop_items):
+        """
+        добавляем сумму и количество только по позициям магазина
+        """
+        totals = self.item_totals(shop_items)
+        return self.annotate(
+            shop_total_sum=totals["total_sum"], shop_item_count=totals["item_count"]
+        )
+
+
 class Order(models.Model):
+    # отдельный индекс по user не нужен: его покрывает order_user_status_idx
     user = models.ForeignKey(
         User,
         verbose_name="Пользователь",
         related_name="orders",
         on_delete=models.CASCADE,
+        db_index=False,
     )
 
     date_time = models.DateTimeField(auto_now_add=True)
@@ -268,15 +421,66 @@ class Order(models.Model):
         null=True,
         on_delete=models.CASCADE,
     )
+    # по нему магазины забирают новые и измененные заказы;
+    # UPDATE в обход save() должен выставлять его явно
+    updated_at = models.DateTimeField(auto_now=True)
+    # пересчитываются при изменении корзины и фиксируются при подтверждении
+    total_sum = models.PositiveIntegerField(verbose_name="Сумма заказа", default=0)
+    item_count = models.PositiveIntegerField(
+        verbose_name="Количество товаров", default=0
+    )
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Список заказов"
         ordering = ("-date_time",)
+        indexes = [
+            models.Index(fields=["updated_at", "id"], name="order_updated_idx"),
+            models.Index(fields=["user", "status"], name="order_user_status_idx"),
+            # корзины не попадают в выборки по статусу, а корзина
+            # пользователя ищется по частичному индексу ограничения ниже
+            models.Index(
+                fields=["status"],
+                condition=~models.Q(status="basket"),
+                name="order_status_idx",
+            ),
+        ]
+        constraints = [
+            # у пользователя одна корзина, на нем держится upsert из basket()
+            models.UniqueConstraint(
+                fields=["user"],
+                condition=models.Q(status="basket"),
+                name="order_one_basket_per_user",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.id} {self.date_time} {self.status}"
 
+    def replace_items(self, items):
+        """
+        приводим позиции заказа к словарю {product_info_id: quantity}
+
+        Лишние строки удаляются одним DELETE, остальные записываются одним
+        upsert по (order, product_info), после чего пересчитываются итоги.
+        """
+        with transaction.atomic():
+            self.ordered_items.exclude(product_info_id__in=list(items)).delete()
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order=self, product_info_id=product_info, quantity=quantity
+                    )
+                    for product_info, quantity in items.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["order", "product_info"],
+                update_fields=["quantity"],
+            )
+            Order.objects.filter(id=self.id).refresh_totals()
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(
@@ -304,3 +508,40 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.order} ({self.product_info} {self.quantity}"
+
+
+OUTBOX_EVENT_CHOICES = (
+    ("user_registered_mail", "Письмо о регистрации"),
+    ("order_user_mail", "Письмо покупателю о заказе"),
+    ("order_admin_notification", "Уведомление админа о заказе"),
+)
+
+
+class OutboxEvent(models.Model):
+    """
+    Класс для события, которое отправляется после фиксации транзакции
+
+    Записывается в одной транзакции с изменением пользователя или заказа,
+    разбирается задачей relay_outbox_task.
+    """
+
+    kind = models.CharField(
+        max_length=50, verbose_name="Тип события", choices=OUTBOX_EVENT_CHOICES
+    )
+    payload = models.JSONField(verbose_name="Данные события", default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(verbose_name="Неудачных попыток", default=0)
+    last_error = models.TextField(verbose_name="Последняя ошибка", blank=True)
+    # событие, не разобранное за OUTBOX_MAX_ATTEMPTS попыток, откладывается
+    # и больше не разбирается
+    failed_at = models.DateTimeField(
+        verbose_name="Отложено после ошибок", null=True, blank=True
+    )
+
+    class Meta:
+        verbose_name = "Событие к отправке"
+        verbose_name_plural = "Очередь событий к отправке"
+        ordering = ("id",)
+
+    def __str__(self):
+        return f"{self.id} {self.kind}"
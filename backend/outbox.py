@@ -0,0 +1,94 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from backend.mail import queue_admin_notification, queue_mail
+from backend.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def add_outbox_event(kind, **payload):
+    """
+    записываем событие в текущую транзакцию
+
+    Если транзакция откатится, событие пропадет вместе с ней.
+    """
+    OutboxEvent.objects.create(kind=kind, payload=payload)
+
+
+def send_user_registered_mail(email):
+    queue_mail("registration", [email])
+
+
+def send_order_user_mail(email, order_id):
+    queue_mail("new_order", [email], {"order_id": order_id})
+
+
+def send_order_admin_notification(order_id):
+    queue_admin_notification(order_id)
+
+
+OUTBOX_HANDLERS = {
+    "user_registered_mail": send_user_registered_mail,
+    "order_user_mail": send_order_user_mail,
+    "order_admin_notification": send_order_admin_notification,
+}
+
+
+def relay_outbox(batch_size=None):
+    """
+    разбираем очередь событий пачками по batch_size
+
+    Пачка блокируется через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    параллельные разборщики не берут одно событие дважды. Каждое событие
+    обрабатывается и удаляется в своей точке сохранения: ошибка обработчика
+    откатывает только его событие, которому записывается попытка, и разбор
+    идет дальше. За один вызов каждое событие разбирается не больше раза.
+    Возвращает число разобранных событий.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    pending = (
+        OutboxEvent.objects.select_for_update(skip_locked=True)
+        .filter(failed_at__isnull=True)
+        .order_by("id")
+    )
+    relayed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            events = list(pending.filter(id__gt=last_id)[:batch_size])
+            if not events:
+                break
+            last_id = events[-1].id
+            for event in events:
+                relayed += relay_event(event)
+    if relayed:
+        logger.info("Relayed %d outbox events", relayed)
+    return relayed
+
+
+def relay_event(event):
+    """
+    обрабатываем и удаляем одно событие, при ошибке записываем попытку
+    """
+    try:
+        with transaction.atomic():
+            OUTBOX_HANDLERS[event.kind](**event.payload)
+            event.delete()
+    except Exception as error:
+        failed = event.attempts + 1 >= settings.OUTBOX_MAX_ATTEMPTS
+        OutboxEvent.objects.filter(id=event.id).update(
+            attempts=F("attempts") + 1,
+            last_error=repr(error),
+            failed_at=timezone.now() if failed else None,
+        )
+        if failed:
+            logger.exception("Outbox event %s is put aside", event)
+        else:
+            logger.warning("Outbox event %s failed: %r", event, error)
+        return 0
+    return 1
@@ -0,0 +1,191 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from ujson import dumps as dump_json
+from ujson import loads as load_json
+
+# значения курсора сравниваются с bigint-колонками (id, цена)
+MAX_CURSOR_INT = 2**63 - 1
+
+
+class KeysetPagination(BasePagination):
+    """
+    Класс для постраничного вывода по ключу сортировки
+
+    Вместо номера страницы клиент передает курсор - значения ключа
+    последней записи, и следующая страница выбирается условием
+    "ключ больше курсора" по индексу, поэтому глубина страницы
+    не влияет на стоимость запроса.
+    """
+
+    page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    orderings = {
+        "id": ("id",),
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+    }
+    default_ordering = "id"
+    # целочисленные поля сортировки
+    integer_fields = ("id", "price")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.orderings.get(
+            request.query_params.get(self.ordering_query_param),
+            self.orderings[self.default_ordering],
+        )
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        page = list(queryset[: page_size + 1])
+
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = self.get_position(page[-1])
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_position(self, item):
+        # страница может быть списком словарей из values()
+        if isinstance(item, dict):
+            return [item[field.lstrip("-")] for field in self.ordering]
+        return [getattr(item, field.lstrip("-")) for field in self.ordering]
+
+    def after(self, position):
+        """
+        условие "запись после курсора" для составного ключа сортировки
+        """
+        query = Q()
+        for index in reversed(range(len(self.ordering))):
+            field = self.ordering[index]
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = Q(**{f"{name}__{lookup}": position[index]})
+            for previous in range(index):
+                condition &= Q(
+                    **{self.ordering[previous].lstrip("-"): position[previous]}
+                )
+            query |= condition
+        if len(self.ordering) > 1:
+            # дублируем условие по первому полю, чтобы индекс читался диапазоном
+            field = self.ordering[0]
+            lookup = "lte" if field.startswith("-") else "gte"
+            query &= Q(**{f"{field.lstrip('-')}__{lookup}": position[0]})
+        return query
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = load_json(urlsafe_b64decode(cursor.encode("ascii")))
+        except (BinasciiError, UnicodeError, ValueError):
+            raise NotFound("Неверный курсор")
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound("Неверный курсор")
+        return [
+            self.parse_cursor_value(field.lstrip("-"), value)
+            for field, value in zip(self.ordering, position)
+        ]
+
+    def parse_cursor_value(self, name, value):
+        """
+        проверяем значение курсора для поля сортировки name
+
+        Курсор приходит от клиента, поэтому значения неподходящего типа
+        отклоняются до запроса к базе.
+        """
+        if name not in self.integer_fields:
+            return value
+        # bool - подкласс int, но в курсор не попадает
+        if type(value) is not int or not -MAX_CURSOR_INT <= value <= MAX_CURSOR_INT:
+            raise NotFound("Неверный курсор")
+        return value
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(dump_json(position).encode("ascii")).decode("ascii")
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+
+class OrderFeedPagination(KeysetPagination):
+    """
+    Класс для ленты заказов магазина по времени изменения
+
+    В ответе всегда есть курсор since последнего отданного заказа:
+    клиент опрашивает ленту с ним и получает только заказы, измененные
+    после этого.
+    """
+
+    cursor_query_param = "since"
+    orderings = {"updated_at": ("updated_at", "id")}
+    default_ordering = "updated_at"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # заказы моложе лага могут оказаться в еще не завершенных транзакциях,
+        # отдаем их следующим опросом, чтобы курсор их не перескочил
+        queryset = queryset.filter(
+            updated_at__lte=timezone.now()
+            - timedelta(seconds=settings.PARTNER_ORDERS_FEED_LAG)
+        )
+        page = super().paginate_queryset(queryset, request, view)
+        self.last_position = (
+            self.get_position(page[-1]) if page else self.decode_cursor(request)
+        )
+        return page
+
+    def get_position(self, item):
+        return [item.updated_at, item.id]
+
+    def parse_cursor_value(self, name, value):
+        if name != "updated_at":
+            return super().parse_cursor_value(name, value)
+        # время без часового пояса или вне диапазона datetime - неверный курсор
+        try:
+            moment = parse_datetime(value) if isinstance(value, str) else None
+        except ValueError:
+            moment = None
+        if moment is None or timezone.is_naive(moment):
+            raise NotFound("Неверный курсор")
+        return moment
+
+    def encode_cursor(self, position):
+        updated_at, order_id = position
+        return super().encode_cursor([updated_at.isoformat(), order_id])
+
+    def get_paginated_response(self, data):
+        since = self.last_position and self.encode_cursor(self.last_position)
+        return Response({"next": self.get_next_link(), "since": since, "results": data})
@@ -0,0 +1,34 @@
+import ujson
+from rest_framework.renderers import JSONRenderer
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    Класс для рендера JSON через ujson
+
+    Вывод совпадает с JSONRenderer байт в байт; данные, которые ujson
+    не кодирует (даты, ленивые строки и т.п.) или кодирует иначе (числа
+    с порядком от -1 до -9), и запросы с отступами рендерятся стандартным
+    JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = ujson.dumps(
+                data,
+                ensure_ascii=self.ensure_ascii,
+                escape_forward_slashes=False,
+                allow_nan=not self.strict,
+            )
+        except (TypeError, ValueError, OverflowError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if "e-" in ret:
+            # ujson пишет 1e-7 там, где json - 1e-07; проверка грубая,
+            # но совпадение в строках только отправляет ответ в JSONRenderer
+            return super().render(data, accepted_media_type, renderer_context)
+        # те же замены, что и в JSONRenderer: эти символы ломают JavaScript
+        return ret.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode()
@@ -0,0 +1,195 @@
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+)
+from django.db import connection, connections
+from django.db.models import Count, F, OuterRef, Q, Subquery
+
+from backend.models import Product, ProductInfo, ProductParameter
+
+SEARCH_CONFIG = "russian"
+MAX_FACET_VALUES = 20
+
+SEARCH_INDEXES = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS product_info_search_idx "
+    "ON backend_productinfo USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS product_name_trgm_idx "
+    "ON backend_product USING gin (name gin_trgm_ops)",
+)
+
+
+def create_search_indexes(sender, using="default", **kwargs):
+    """
+    создаем GIN-индексы поиска после миграций (только для PostgreSQL)
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for statement in SEARCH_INDEXES:
+            cursor.execute(statement)
+
+
+def update_search_vectors(product_info_ids):
+    """
+    пересчитываем поисковый вектор позиций одним запросом
+
+    Название товара весит больше модели, модель - больше значений параметров.
+    """
+    if connection.vendor != "postgresql" or not product_info_ids:
+        return
+    name = Product.objects.filter(id=OuterRef("product_id")).values("name")[:1]
+    values = (
+        ProductParameter.objects.filter(product_info_id=OuterRef("id"))
+        .order_by()
+        .values("product_info_id")
+        .annotate(text=StringAgg("value", " "))
+        .values("text")
+    )
+    ProductInfo.objects.filter(id__in=product_info_ids).update(
+        search_vector=SearchVector(Subquery(name), weight="A", config=SEARCH_CONFIG)
+        + SearchVector("model", weight="B", config=SEARCH_CONFIG)
+        + SearchVector(Subquery(values), weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def search_product_infos(text):
+    """
+    ищем позиции по тексту: полнотекстово и по похожести названия (опечатки)
+
+    В PostgreSQL найденные позиции собираются объединением двух запросов,
+    каждый из которых читает свой GIN-индекс: по search_vector позиции
+    и по триграммам названия товара. Одно условие OR по двум таблицам
+    индексы не использует и просматривает все позиции. Ранжирование
+    и фасеты считаются только по найденным.
+    """
+    queryset = ProductInfo.objects.filter(shop__status=True)
+    if connection.vendor != "postgresql":
+        return queryset.filter(
+            Q(product__name__icontains=text)
+            | Q(model__icontains=text)
+            | Q(product_parameters__value__icontains=text)
+        ).distinct()
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+    hits = (
+        ProductInfo.objects.filter(search_vector=query)
+        .values("id")
+        .union(
+            ProductInfo.objects.filter(
+                product_id__in=Product.objects.filter(
+                    name__trigram_similar=text
+                ).values("id")
+            ).values("id")
+        )
+    )
+    return (
+        queryset.filter(id__in=hits)
+        .annotate(
+            rank=SearchRank(F("search_vector"), query)
+            + TrigramSimilarity("product__name", text)
+        )
+        .order_by("-rank", "id")
+    )
+
+
+FACETS_SQL = """
+WITH hits (id, shop_id, category_id) AS ({hits})
+SELECT 'total', NULL, NULL, NULL, COUNT(*) FROM hits
+UNION ALL
+SELECT 'category', hits.category_id, category.name, NULL, COUNT(*)
+FROM hits JOIN backend_category category ON category.id = hits.category_id
+GROUP BY hits.category_id, category.name
+UNION ALL
+SELECT 'shop', hits.shop_id, shop.name, NULL, COUNT(*)
+FROM hits JOIN backend_shop shop ON shop.id = hits.shop_id
+GROUP BY hits.shop_id, shop.name
+UNION ALL
+SELECT 'parameter', parameter_id, name_parameter, value, total FROM (
+    SELECT pp.parameter_id, parameter.name_parameter, pp.value, COUNT(*) AS total,
+        ROW_NUMBER() OVER (
+            PARTITION BY pp.parameter_id ORDER BY COUNT(*) DESC, pp.value
+        ) AS position
+    FROM hits
+    JOIN backend_productparameter pp ON pp.product_info_id = hits.id
+    JOIN backend_parameter parameter ON parameter.id = pp.parameter_id
+    GROUP BY pp.parameter_id, parameter.name_parameter, pp.value
+) parameter_values
+WHERE position <= %s
+"""
+
+
+def search_facets(queryset):
+    """
+    считаем число найденных позиций и фасеты одним запросом
+
+    Возвращает (всего, фасеты) с разбивкой по категориям, магазинам
+    и значениям параметров.
+    """
+    hits = queryset.order_by().values_list("id", "shop_id", "product__category_id")
+    if connection.vendor == "postgresql":
+        sql, params = hits.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(FACETS_SQL.format(hits=sql), (*params, MAX_FACET_VALUES))
+            rows = cursor.fetchall()
+    else:
+        rows = facet_rows(queryset)
+
+    total = 0
+    facets = {"categories": [], "shops": [], "parameters": []}
+    parameters = {}
+    for facet, key, name, value, count in rows:
+        if facet == "total":
+            total = count
+        elif facet == "category":
+            facets["categories"].append({"id": key, "name": name, "count": count})
+        elif facet == "shop":
+            facets["shops"].append({"id": key, "name": name, "count": count})
+        else:
+            parameter = parameters.get(key)
+            if parameter is None:
+                parameter = parameters[key] = {"id": key, "name": name, "values": []}
+                facets["parameters"].append(parameter)
+            parameter["values"].append({"value": value, "count": count})
+    for key in ("categories", "shops"):
+        facets[key].sort(key=lambda item: (-item["count"], item["id"]))
+    for parameter in facets["parameters"]:
+        parameter["values"].sort(key=lambda item: (-item["count"], item["value"]))
+    return total, facets
+
+
+def facet_rows(queryset):
+    """
+    фасеты отдельными запросами для баз без поддержки FACETS_SQL
+    """
+    hits = queryset.order_by().values("id")
+    offers = ProductInfo.objects.filter(id__in=hits)
+    rows = [("total", None, None, None, offers.count())]
+    rows.extend(
+        ("category", key, name, None, count)
+        for key, name, count in offers.values_list(
+            "product__category_id", "product__category__name"
+        )
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    rows.extend(
+        ("shop", key, name, None, count)
+        for key, name, count in offers.values_list("shop_id", "shop__name")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    values = {}
+    for key, name, value, count in (
+        ProductParameter.objects.filter(product_info_id__in=hits)
+        .values_list("parameter_id", "parameter__name_parameter", "value")
+        .annotate(count=Count("id"))
+        .order_by("-count", "value")
+    ):
+        values.setdefault(key, []).append(("parameter", key, name, value, count))
+    for parameter_rows in values.values():
+        rows.extend(parameter_rows[:MAX_FACET_VALUES])
+    return rows
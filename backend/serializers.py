@@ -1,8 +1,11 @@
 # Верстальщик
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db import transaction
 from django.db.models import Q
 from rest_framework import serializers
 
+from backend.importer import parse_numeric
 from backend.models import (
     Category,
     Contact,
@@ -16,6 +19,10 @@ from backend.models import (
     User,
 )
 
+# границы числовых параметров запроса: значения за ними база не примет
+MAX_ID = 2**63 - 1
+MAX_PRICE = 2**31 - 1
+
 
 class NewUserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -152,6 +159,60 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
 
 
+class ParameterFilterField(serializers.CharField):
+    """
+    Класс для условия по параметру товара вида "название:оператор:значение"
+    """
+
+    operators = ("eq", "gt", "gte", "lt", "lte")
+
+    def to_internal_value(self, data):
+        data = super().to_internal_value(data)
+        try:
+            name, operator, value = data.rsplit(":", 2)
+        except ValueError:
+            raise serializers.ValidationError(
+                "Ожидается условие вида название:оператор:значение"
+            )
+        if operator not in self.operators:
+            raise serializers.ValidationError(
+                f"Неизвестный оператор {operator}, допустимы {', '.join(self.operators)}"
+            )
+        number = parse_numeric(value)
+        if operator != "eq" and number is None:
+            raise serializers.ValidationError(
+                f"Для оператора {operator} значение должно быть числом"
+            )
+        return name, operator, value, number
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    shop_id = serializers.IntegerField(required=False, min_value=1, max_value=MAX_ID)
+    category_id = serializers.IntegerField(
+        required=False, min_value=1, max_value=MAX_ID
+    )
+    price_min = serializers.IntegerField(
+        required=False, min_value=0, max_value=MAX_PRICE
+    )
+    price_max = serializers.IntegerField(
+        required=False, min_value=0, max_value=MAX_PRICE
+    )
+    in_stock = serializers.BooleanField(required=False, default=False)
+    param = serializers.ListField(
+        child=ParameterFilterField(max_length=500), required=False, max_length=10
+    )
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200, trim_whitespace=True)
+    limit = serializers.IntegerField(
+        required=False, default=20, min_value=1, max_value=100
+    )
+    offset = serializers.IntegerField(
+        required=False, default=0, min_value=0, max_value=MAX_ID
+    )
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
@@ -165,9 +226,21 @@ class OrderItemSerializer(serializers.ModelSerializer):
         extra_kwargs = {"order": {"write_only": True}}
 
 
+class OrderItemWriteSerializer(serializers.Serializer):
+    """
+    Класс для позиции корзины при записи
+
+    Позиция передается идентификатором: товары всей корзины проверяются
+    одним запросом в OrderSerializer.validate.
+    """
+
+    product_info = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    quantity = serializers.IntegerField(required=False, default=1)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemSerializer(read_only=True, many=True)
-    items = OrderItemSerializer(write_only=True, many=True)
+    items = OrderItemWriteSerializer(write_only=True, many=True)
     total_sum = serializers.IntegerField(read_only=True)
     contact = ContactSerializer(read_only=True)
     status = serializers.ChoiceField(choices=STATUS_CHOICES, required=False)
@@ -180,60 +253,127 @@ class OrderSerializer(serializers.ModelSerializer):
             "status",
             "date_time",
             "total_sum",
+            "item_count",
             "contact",
             "items",
         )
-        read_only_fields = ("id",)
+        read_only_fields = ("id", "item_count")
 
     def validate(self, data):
-        items = data["items"]
-        for item in items:
-            product_info = item.get("product_info")
-            quantity = item.get("quantity")
-            product = ProductInfo.objects.filter(id=product_info.id).first()
-            if not product:
+        # повторы одной позиции складываем, чтобы записать ее одной строкой
+        quantities = {}
+        for item in data["items"]:
+            if item["quantity"] <= 0:
                 raise serializers.ValidationError(
-                    {"status": "failure", "message": "Такого продукта нет"}
+                    {"status": "failure", "message": "Продукта нет в наличии"}
                 )
-            if quantity <= 0:
+            product_info = item["product_info"]
+            quantities[product_info] = (
+                quantities.get(product_info, 0) + item["quantity"]
+            )
+
+        products = ProductInfo.objects.only("quantity").in_bulk(list(quantities))
+        for product_info, quantity in quantities.items():
+            product = products.get(product_info)
+            if not product:
                 raise serializers.ValidationError(
-                    {"status": "failure", "message": "Продукта нет в наличии"}
+                    {"status": "failure", "message": "Такого продукта нет"}
                 )
             if quantity > product.quantity:
                 raise serializers.ValidationError(
                     {"status": "failure", "message": "Нет такого количества"}
                 )
+        data["items"] = [
+            {"product_info": product_info, "quantity": quantity}
+            for product_info, quantity in quantities.items()
+        ]
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context["request"].user
-        items = validated_data.get("items")
-        order = Order.objects.create(user=user, status="basket")
-        for item in items:
-            product_id = item.get("product_info").id
-            quantity = item.get("quantity") or 1
-            OrderItem.objects.create(
-                order=order, product_info_id=product_id, quantity=quantity
-            )
+        order = Order.objects.basket(user)
+        order.replace_items(self.get_items(validated_data))
         return order
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        items = validated_data.get("items")
-        instance.ordered_items.all().delete()
-        for item in items:
-            product_id = item.get("product_info").id
-            quantity = item.get("quantity") or 1
-            OrderItem.objects.create(
-                order=instance, product_info_id=product_id, quantity=quantity
-            )
-        instance.status = validated_data.get("status", instance.status)
-        instance.save()
+        instance.replace_items(self.get_items(validated_data))
+        if validated_data.get("status", instance.status) != instance.status:
+            instance.status = validated_data["status"]
+            instance.save(update_fields=["status", "updated_at"])
         return instance
 
+    @staticmethod
+    def get_items(validated_data):
+        return {
+            item["product_info"]: item["quantity"] for item in validated_data["items"]
+        }
+
+
+class PartnerOrderSerializer(serializers.ModelSerializer):
+    """
+    Класс для заказа в ленте поставщика
+
+    Позиции, сумма и количество товаров - только по магазину поставщика:
+    queryset аннотируется через Order.objects.with_shop_totals. Сумма
+    считается по текущим ценам позиций магазина.
+    """
+
+    ordered_items = OrderItemSerializer(read_only=True, many=True)
+    contact = ContactSerializer(read_only=True)
+    total_sum = serializers.IntegerField(source="shop_total_sum", read_only=True)
+    item_count = serializers.IntegerField(source="shop_item_count", read_only=True)
+
+    class Meta:
+        model = Order
+        fields = (
+            "id",
+            "ordered_items",
+            "status",
+            "date_time",
+            "updated_at",
+            "total_sum",
+            "item_count",
+            "contact",
+        )
+        read_only_fields = fields
+
+
+class OrderStatusChangeSerializer(serializers.Serializer):
+    order_id = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    status = serializers.ChoiceField(choices=STATUS_CHOICES)
+
+
+class OrderStatusChangeListSerializer(serializers.Serializer):
+    orders = OrderStatusChangeSerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, orders):
+        if len(orders) > settings.ORDER_STATUS_BATCH_SIZE:
+            raise serializers.ValidationError(
+                f"Не больше {settings.ORDER_STATUS_BATCH_SIZE} заказов за запрос"
+            )
+        return orders
+
+
+class OrderEventsSerializer(serializers.Serializer):
+    since = serializers.RegexField(r"^\d+-\d+$", required=False)
+    timeout = serializers.IntegerField(
+        required=False,
+        min_value=0,
+        max_value=settings.ORDER_EVENTS_TIMEOUT,
+        default=settings.ORDER_EVENTS_TIMEOUT,
+    )
+
 
 class OrderConfirmSerializer(serializers.Serializer):
-    id = serializers.IntegerField(write_only=True)
-    contact_id = serializers.IntegerField(write_only=True)
+    # без id подтверждается текущая корзина пользователя
+    id = serializers.IntegerField(
+        write_only=True, required=False, min_value=1, max_value=MAX_ID
+    )
+    contact_id = serializers.IntegerField(
+        write_only=True, min_value=1, max_value=MAX_ID
+    )
 
     class Meta:
         model = Order
@@ -247,16 +387,23 @@ class OrderConfirmSerializer(serializers.Serializer):
         order_id = data.get("id")
         contact_id = data.get("contact_id")
         contact = Contact.objects.filter(Q(user_id=user.id) & Q(id=contact_id)).first()
-        order = Order.objects.filter(Q(id=order_id) & Q(user_id=user.id)).first()
-        status = order.status
+        if order_id is None:
+            order = Order.objects.filter(user_id=user.id, status="basket").first()
+        else:
+            order = Order.objects.filter(Q(id=order_id) & Q(user_id=user.id)).first()
         if not order:
             raise serializers.ValidationError(
                 {"status": "failure", "message": "Такого заказа не существует"}
             )
+        status = order.status
         if not status == "basket":
             raise serializers.ValidationError(
                 {"status": "failure", "message": "Неверный статус заказа"}
             )
+        if not contact:
+            raise serializers.ValidationError(
+                {"status": "failure", "message": "Контакт не найден"}
+            )
         if not contact.city:
             raise serializers.ValidationError(
                 {"status": "failure", "message": "Не указан город"}
@@ -277,5 +424,12 @@ class OrderConfirmSerializer(serializers.Serializer):
         return order
 
 
+class PartnerExportSerializer(serializers.Serializer):
+    # не format: этот параметр DRF занимает под выбор рендерера
+    output = serializers.ChoiceField(
+        choices=("ndjson", "csv"), required=False, default="ndjson"
+    )
+
+
 class PartnerUpdateSerializer(serializers.Serializer):
     url = serializers.URLField(write_only=True, required=True)
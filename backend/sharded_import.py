@@ -0,0 +1,205 @@
+import os
+import time
+
+import ujson
+
+from backend.importer import (
+    PriceListImporter,
+    batched,
+    iter_price_list,
+    merge_import_stats,
+)
+
+
+def iter_lines(stream, size=1 << 16):
+    """
+    читаем поток байтов построчно, не загружая его целиком
+    """
+    tail = b""
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if tail:
+        yield tail
+
+
+def is_sequence_item(stripped):
+    return stripped.startswith(b"-") and stripped[1:2] in (b" ", b"\n", b"\r", b"")
+
+
+def split_price_list(stream, directory, chunk_size):
+    """
+    режем прайс на части по строкам, не разбирая YAML
+
+    Позиции блочного списка goods раскладываются по файлам вида
+    "goods:\\n..." по chunk_size штук, все остальное (shop, categories)
+    попадает в header.yaml. Если goods записан не блочным списком
+    (например, JSON), весь прайс остается в header.yaml, а список частей пуст.
+    """
+    os.makedirs(directory, exist_ok=True)
+    header_path = os.path.join(directory, "header.yaml")
+    chunks = []
+    chunk = None
+    items = 0
+    item_indent = None
+    state = "header"
+    with open(header_path, "wb") as header:
+        for line in iter_lines(stream):
+            if state == "header":
+                if line.rstrip() == b"goods:":
+                    state = "goods"
+                else:
+                    header.write(line)
+                continue
+            if state == "tail":
+                header.write(line)
+                continue
+
+            stripped = line.lstrip(b" ")
+            if (
+                stripped.strip()
+                and line[:1] != b" "
+                and not stripped.startswith(b"#")
+                and not is_sequence_item(stripped)
+            ):
+                # начался следующий ключ верхнего уровня
+                state = "tail"
+                header.write(line)
+                continue
+            if is_sequence_item(stripped):
+                indent = len(line) - len(stripped)
+                if item_indent is None:
+                    item_indent = indent
+                if indent == item_indent and (chunk is None or items >= chunk_size):
+                    if chunk is not None:
+                        chunk.close()
+                    path = os.path.join(directory, f"chunk-{len(chunks):05d}.yaml")
+                    chunks.append(path)
+                    chunk = open(path, "wb")
+                    chunk.write(b"goods:\n")
+                    items = 0
+                if indent == item_indent:
+                    items += 1
+            if chunk is not None:
+                chunk.write(line)
+    if chunk is not None:
+        chunk.close()
+    return header_path, chunks
+
+
+def parse_price_list_chunk(path):
+    """
+    разбираем часть прайса и складываем ее позиции в JSON рядом с частью
+
+    Разобранные части - промежуточное хранилище загрузки: в каталог они
+    попадают вместе одной транзакцией в commit_price_list_import. Ключи
+    товаров и названия параметров части пишутся в отдельный файл, чтобы
+    найти их для всего прайса, не читая позиции. Результат задачи остается
+    маленьким: позиции и их id в сообщения Celery не попадают.
+    """
+    importer = PriceListImporter(shop=None)
+    goods = []
+    with open(path, "rb") as chunk:
+        for section, value in iter_price_list(chunk):
+            if section == "goods":
+                goods.extend(importer.clean_goods([value]))
+    goods_path = f"{path}.json"
+    with open(goods_path, "w", encoding="utf-8") as goods_file:
+        # id позиций с ошибками: их строки не удаляются из каталога
+        ujson.dump(
+            {"goods": goods, "seen": sorted(importer.seen)},
+            goods_file,
+            ensure_ascii=False,
+        )
+    with open(f"{path}.keys.json", "w", encoding="utf-8") as keys_file:
+        ujson.dump(
+            {
+                "products": list({(item["name"], item["category"]) for item in goods}),
+                "parameters": list(
+                    {name for item in goods for name in item["parameters"]}
+                ),
+            },
+            keys_file,
+            ensure_ascii=False,
+        )
+    return {
+        "path": goods_path,
+        "keys": f"{path}.keys.json",
+        "rows": len(goods),
+        "skipped": importer.skipped,
+        "errors": importer.errors,
+    }
+
+
+def resolve_dimensions(importer, keys_paths):
+    """
+    находим или создаем товары и параметры всего прайса до записи позиций
+
+    Общие для частей товары и параметры ищутся один раз пачками по
+    batch_size, а записи позиций берут их id из importer.known_products
+    и importer.known_parameters без запросов.
+    """
+    products = set()
+    parameters = set()
+    for path in keys_paths:
+        with open(path, "r", encoding="utf-8") as keys_file:
+            keys = ujson.load(keys_file)
+        products.update((name, category) for name, category in keys["products"])
+        parameters.update(keys["parameters"])
+    for batch in batched(products, importer.batch_size):
+        importer.known_products.update(importer.resolve_products(set(batch)))
+    for batch in batched(parameters, importer.batch_size):
+        importer.known_parameters.update(importer.resolve_parameters(set(batch)))
+
+
+def iter_parsed_price_list(importer, header, results):
+    """
+    заголовок прайса и позиции разобранных частей одним потоком разделов
+
+    Товары и параметры находятся после заголовка: к этому моменту
+    категории прайса уже записаны.
+    """
+    with open(header, "rb") as header_file:
+        yield from iter_price_list(header_file)
+    resolve_dimensions(importer, [result["keys"] for result in results])
+    for path in (result["path"] for result in results):
+        with open(path, "r", encoding="utf-8") as goods_file:
+            chunk = ujson.load(goods_file)
+        importer.seen.update(chunk["seen"])
+        for item in chunk["goods"]:
+            yield "goods", item
+
+
+def commit_price_list_import(
+    shop, header, results, started, mode="sync", progress=None, batch_size=1000
+):
+    """
+    записываем заголовок и разобранные части прайса в каталог одной транзакцией
+
+    До фиксации покупатели видят прежний каталог, при ошибке он не меняется:
+    в режиме replace старые позиции удаляются в той же транзакции.
+    Параллельно идут разбор YAML и проверка позиций в частях, запись
+    в каталог последовательная: это цена атомарной смены каталога.
+    started - время начала загрузки по time.time()
+    """
+    importer = PriceListImporter(
+        shop, batch_size=batch_size, mode=mode, progress=progress
+    )
+    importer.run(iter_parsed_price_list(importer, header, results))
+    stats = merge_import_stats(
+        {
+            "skipped": sum(result["skipped"] for result in results),
+            "errors": [error for result in results for error in result["errors"]],
+        },
+        importer.stats(),
+    )
+    stats["elapsed"] = round(time.time() - started, 3)
+    stats["rows_per_second"] = (
+        round(stats["rows"] / stats["elapsed"], 1) if stats["elapsed"] else 0.0
+    )
+    return stats
@@ -1,15 +1,16 @@
+from functools import partial
 
-from django.dispatch import Signal
-
-from backend.tasks import (
-    new_user_registered_signal_mail_task,
-    new_order_signal_user_task,
-    new_order_signal_admin_task,
-)
-from backend.models import User
-from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
 
+from rest_framework.authtoken.models import Token
 
+from backend.authentication import invalidate_tokens
+from backend.outbox import add_outbox_event
+from backend.cache import bump_catalog_versions, category_scope, shop_scope
+from backend.models import Category, Shop, User
+from django.conf import settings
 
 new_user_registered = Signal()
 
@@ -18,20 +19,74 @@ new_order = Signal()
 
 def new_user_registered_signal_mail(user):
     """
-    отправляем письмо с подтрердждением почты
+    отправляем письмо с подтрердждением почты после фиксации транзакции
+    """
+    add_outbox_event("user_registered_mail", email=user.email)
+
+
+def new_order_signal_user(user, order_id=None):
     """
-    new_user_registered_signal_mail_task.delay(user.email)
+    отправяем письмо с подтверждением заказа после фиксации транзакции
+    """
+    add_outbox_event("order_user_mail", email=user.email, order_id=order_id)
 
 
-def new_order_signal_user(user):
+def new_order_signal_admin(order_id):
     """
-    отправяем письмо с подтверждением заказа
+    добавляем заказ в сводное письмо админу после фиксации транзакции
     """
-    new_order_signal_user_task.delay(user.email)
+    add_outbox_event("order_admin_notification", order_id=order_id)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def shop_changed_signal(sender, instance, raw=False, **kwargs):
+    """
+    сбрасываем кэш каталога при изменении магазина (например, статуса)
+    """
+    if raw:
+        return
+    scopes = {"shops", "products", shop_scope(instance.id)}
+    if instance.pk is not None:
+        scopes.update(
+            category_scope(category_id)
+            for category_id in Category.shops.through.objects.filter(
+                shop_id=instance.pk
+            ).values_list("category_id", flat=True)
+        )
+    # до фиксации транзакции кэш заполнялся бы прежними данными
+    # под новыми версиями
+    transaction.on_commit(partial(bump_catalog_versions, scopes))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed_signal(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(
+        partial(
+            bump_catalog_versions,
+            {"categories", "products", category_scope(instance.id)},
+        )
+    )
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted_signal(sender, instance, **kwargs):
+    # сброс до фиксации дал бы параллельному запросу снова закэшировать
+    # еще не удаленный токен
+    transaction.on_commit(partial(invalidate_tokens, [instance.key]))
 
 
-def new_order_signal_admin():
+@receiver(post_save, sender=User)
+def user_changed_signal(sender, instance, created=False, raw=False, **kwargs):
     """
-    отправяем письмо админу о заказе
+    сбрасываем снимок пользователя в кэше аутентификации: после
+    деактивации, смены типа и других правок токен читается из базы заново
     """
-    new_order_signal_admin_task.delay()
+    if raw or created:
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list("key", flat=True))
+    if keys:
+        transaction.on_commit(partial(invalidate_tokens, keys))
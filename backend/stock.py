@@ -0,0 +1,204 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    OuterRef,
+    PositiveIntegerField,
+    Sum,
+    Value,
+    When,
+)
+from django.utils import timezone
+
+from backend.cache import bump_catalog_versions, category_scope, shop_scope
+from backend.events import notify_orders_changed
+from backend.models import ORDER_TRANSITIONS, Order, OrderItem, ProductInfo
+
+# статусы, в которых за заказом числится зарезервированный товар
+RESERVED_STATUSES = ("new", "confirmed", "assembled")
+
+
+class InsufficientStock(Exception):
+    """
+    Класс ошибки: на складе меньше товара, чем в заказе
+    """
+
+    def __init__(self, product_info_ids):
+        self.product_info_ids = product_info_ids
+        super().__init__(f"Недостаточно товара: {product_info_ids}")
+
+
+class OrderStatusConflict(Exception):
+    """
+    Класс ошибки: статус заказа уже изменил другой запрос
+    """
+
+
+def order_items(order_id):
+    return list(
+        OrderItem.objects.filter(order_id=order_id).values_list(
+            "product_info_id", "quantity"
+        )
+    )
+
+
+def invalidate_stock(product_info_ids):
+    """
+    после фиксации сбрасываем кэш каталога по позициям с новым остатком
+
+    Остатки меняются через queryset.update(), сигналы при этом не
+    срабатывают, а без сброса каталог и фильтр in_stock показывали бы
+    прежнее количество до истечения CATALOG_CACHE_TIMEOUT.
+    """
+    scopes = {"products"}
+    for shop_id, category_id in (
+        ProductInfo.objects.filter(id__in=product_info_ids)
+        .values_list("shop_id", "product__category_id")
+        .distinct()
+    ):
+        scopes.update((shop_scope(shop_id), category_scope(category_id)))
+    transaction.on_commit(partial(bump_catalog_versions, scopes))
+
+
+def reserve_items(items):
+    """
+    списываем товар со склада условными UPDATE ... WHERE quantity >= n
+
+    Строки блокируются по возрастанию id, поэтому встречные резервы
+    не взаимоблокируются, а ждут друг друга только на общих позициях.
+    Вызывается внутри транзакции: при нехватке товара все списания
+    откатываются вместе с ней.
+    """
+    failed = []
+    for product_info_id, quantity in sorted(items):
+        if not ProductInfo.objects.filter(
+            id=product_info_id, quantity__gte=quantity
+        ).update(quantity=F("quantity") - quantity):
+            failed.append(product_info_id)
+    if failed:
+        raise InsufficientStock(failed)
+    invalidate_stock([product_info_id for product_info_id, _ in items])
+
+
+def release_items(items):
+    """
+    возвращаем товар на склад одним UPDATE с CASE по позициям
+    """
+    items = dict(items)
+    if not items:
+        return
+    ProductInfo.objects.filter(id__in=items).update(
+        quantity=F("quantity")
+        + Case(
+            *(
+                When(id=product_info_id, then=Value(quantity))
+                for product_info_id, quantity in items.items()
+            ),
+            output_field=PositiveIntegerField(),
+        )
+    )
+    invalidate_stock(list(items))
+
+
+def place_order(order, contact):
+    """
+    переводим корзину в новый заказ, резервируя товар
+
+    Статус меняется условным UPDATE, поэтому повторное подтверждение той же
+    корзины не спишет товар второй раз. Итоги заказа фиксируются по ценам
+    на момент подтверждения.
+    """
+    with transaction.atomic():
+        if not Order.objects.filter(id=order.id, status="basket").update(
+            status="new", contact=contact, updated_at=timezone.now()
+        ):
+            raise OrderStatusConflict(order.id)
+        reserve_items(order_items(order.id))
+        Order.objects.filter(id=order.id).refresh_totals()
+    order.status = "new"
+    order.contact = contact
+
+
+def change_order_statuses(changes, shop_user_id=None):
+    """
+    применяем пачку смен статусов [(order_id, status)] в одной транзакции
+
+    Переходы проверяются по ORDER_TRANSITIONS, допустимые записываются
+    одним UPDATE на каждый новый статус, товар отмененных заказов
+    возвращается на склад. shop_user_id ограничивает смену заказами
+    с позициями этого магазина: статус у заказа один на все магазины,
+    поэтому заказ с позициями других магазинов магазин не меняет -
+    его статус меняет администратор (действия OrderAdmin вызывают
+    функцию без shop_user_id). Возвращает результат по каждой паре
+    в порядке запроса.
+    """
+    orders = Order.objects.filter(id__in={order_id for order_id, _ in changes}).exclude(
+        status="basket"
+    )
+    foreign_items = Value(False)
+    if shop_user_id is not None:
+        orders = orders.filter(
+            id__in=OrderItem.objects.filter(
+                product_info__shop__user_id=shop_user_id
+            ).values("order_id")
+        )
+        foreign_items = Exists(
+            OrderItem.objects.filter(order_id=OuterRef("id")).exclude(
+                product_info__shop__user_id=shop_user_id
+            )
+        )
+    with transaction.atomic():
+        rows = list(
+            orders.annotate(shared=foreign_items)
+            .select_for_update()
+            .order_by("id")
+            .values_list("id", "status", "shared")
+        )
+        current = {order_id: status for order_id, status, _ in rows}
+        shared = {order_id for order_id, _, is_shared in rows if is_shared}
+        results = []
+        targets = {}
+        seen = set()
+        for order_id, status in changes:
+            previous = current.get(order_id)
+            result = {"order_id": order_id, "status": previous}
+            if previous is None:
+                result["message"] = "Заказ не найден"
+            elif order_id in shared:
+                result["message"] = (
+                    "В заказе есть позиции других магазинов, "
+                    "статус меняет администратор"
+                )
+            elif order_id in seen:
+                result["message"] = "Заказ указан несколько раз"
+            elif status not in ORDER_TRANSITIONS[previous]:
+                result["message"] = f"Переход {previous} -> {status} запрещен"
+            else:
+                targets.setdefault(status, []).append(order_id)
+                result["status"] = status
+            result["result"] = "failure" if "message" in result else "success"
+            results.append(result)
+            seen.add(order_id)
+
+        now = timezone.now()
+        for status, order_ids in targets.items():
+            Order.objects.filter(id__in=order_ids).update(status=status, updated_at=now)
+        released = [
+            order_id
+            for order_id in targets.get("canceled", ())
+            if current[order_id] in RESERVED_STATUSES
+        ]
+        if released:
+            release_items(
+                OrderItem.objects.filter(order_id__in=released)
+                .values("product_info_id")
+                .annotate(total=Sum("quantity"))
+                .values_list("product_info_id", "total")
+            )
+        notify_orders_changed(
+            [order_id for order_ids in targets.values() for order_id in order_ids]
+        )
+    return results
@@ -1,49 +1,235 @@
-from celery import shared_task
+import os
+import shutil
+import time
+from functools import partial
+from uuid import uuid4
+from smtplib import SMTPException
+
+from celery import chord, shared_task
+from celery.exceptions import Ignore
 from django.conf import settings
-from django.core.mail import send_mail
+
+from backend.basket import DIRTY_BASKETS_KEY, RedisBasket, get_redis
+from backend.importer import (
+    PriceListImporter,
+    acquire_import_lock,
+    iter_price_list,
+    merge_import_stats,
+    open_price_list,
+    release_import_lock,
+)
+from backend.mail import flush_mail_queue, queue_admin_digest
+from backend.models import PriceImportJob, Shop, User
+from backend.outbox import relay_outbox
+from backend.sharded_import import (
+    commit_price_list_import,
+    parse_price_list_chunk,
+    split_price_list,
+)
+
+
+@shared_task(bind=True, max_retries=None)
+def send_queued_mail_task(self):
+    """
+    отправляем очередь писем, при ошибке SMTP повторяем с растущей паузой
+    """
+    try:
+        return flush_mail_queue()
+    except (SMTPException, OSError) as error:
+        countdown = min(
+            settings.MAIL_RETRY_DELAY * 2**self.request.retries,
+            settings.MAIL_RETRY_MAX_DELAY,
+        )
+        raise self.retry(exc=error, countdown=countdown)
 
 
 @shared_task()
-def new_user_registered_signal_mail_task(email):
-    # token, _ = ConfirmEmailToken.objects.get_or_create(user=user)
-
-    send_mail(
-        # f"Password Reset Token for {user.email}",
-        f"Регистрация в Нашем магазине",
-        # message:
-        # token.key,
-        f"Вы были зарегестрированы",
-        # from:
-        settings.EMAIL_HOST_USER,
-        # to:
-        [email],
-        fail_silently=False,
-    )
+def send_admin_digest_task():
+    """
+    отправляем админу сводку о новых заказах за период
+    """
+    return queue_admin_digest()
 
 
 @shared_task()
-def new_order_signal_user_task(email):
-    send_mail(
-        f"Благодарим за заказ",
-        # message:
-        f"Ваш заказ сформирован",
-        # from:
-        settings.EMAIL_HOST_USER,
-        # to:
-        [email],
-        fail_silently=False,
+def relay_outbox_task():
+    """
+    разбираем очередь событий, записанных вместе с заказами и пользователями
+    """
+    return relay_outbox()
+
+
+def store_job_state(task, job_id, state, meta):
+    """
+    сохраняем состояние загрузки прайса под идентификатором задачи-координатора
+    """
+    if not task.request.is_eager and not task.request.called_directly:
+        task.backend.store_result(job_id, meta, state)
+
+
+def report_import_progress(task, stream, done, importer):
+    """
+    сохраняем ход загрузки прайса в бэкенд результатов Celery
+
+    done - итоги уже загруженных прайсов этой же задачи
+    """
+    meta = importer.stats()
+    if done:
+        meta = merge_import_stats(done, meta)
+    meta["eta"] = None
+    if stream is not None and stream.total and stream.position:
+        remaining = stream.total - stream.position
+        meta["eta"] = round(importer.elapsed * remaining / stream.position, 1)
+    store_job_state(task, task.request.id, "PROGRESS", meta)
+    return meta
+
+
+def queue_price_list_import(shop, sources, mode="sync"):
+    """
+    ставим загрузку прайса в очередь, запоминая магазин-владельца задачи
+    """
+    job_id = str(uuid4())
+    PriceImportJob.objects.create(job_id=job_id, shop=shop)
+    import_price_list_task.apply_async((shop.id, sources, mode), task_id=job_id)
+    return job_id
+
+
+@shared_task(bind=True)
+def import_price_list_task(self, shop_id, sources, mode="sync"):
+    """
+    загружаем прайсы магазина из файлов или по ссылкам в фоне
+
+    Один большой прайс режется на части, которые разбираются параллельно
+    несколькими воркерами и пишутся в каталог одной транзакцией, остальные
+    загружаются в этой задаче по очереди. Части лежат в общем для воркеров
+    PRICE_IMPORT_WORK_DIR: без него прайс не режется.
+    """
+    job_id = self.request.id
+    if not acquire_import_lock(shop_id, job_id):
+        raise self.retry(countdown=settings.PRICE_IMPORT_RETRY_DELAY, max_retries=None)
+    directory = None
+    if settings.PRICE_IMPORT_WORK_DIR:
+        directory = os.path.join(settings.PRICE_IMPORT_WORK_DIR, str(job_id))
+    sharded = False
+    try:
+        shop = Shop.objects.get(id=shop_id)
+        if len(sources) == 1 and directory is not None:
+            with open_price_list(sources[0]) as stream:
+                if (
+                    stream.total is None
+                    or stream.total >= settings.PRICE_IMPORT_SHARD_SIZE
+                ):
+                    header, chunks = split_price_list(
+                        stream, directory, settings.PRICE_IMPORT_CHUNK_SIZE
+                    )
+                    if chunks:
+                        start_sharded_import(
+                            self, shop, mode, header, chunks, directory
+                        )
+                        sharded = True
+                    else:
+                        sources = [header]
+        if not sharded:
+            result = report_import_progress(self, None, None, PriceListImporter(shop))
+            for source in sources:
+                with open_price_list(source) as stream:
+                    importer = PriceListImporter(
+                        shop,
+                        mode=mode,
+                        progress=partial(report_import_progress, self, stream, result),
+                    )
+                    importer.run(iter_price_list(stream))
+                result = report_import_progress(self, None, result, importer)
+    finally:
+        if not sharded:
+            release_import_lock(shop_id, job_id)
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+    if sharded:
+        # итог загрузки сохранит commit_price_list_import_task
+        raise Ignore()
+    return result
+
+
+def start_sharded_import(task, shop, mode, header, chunks, directory):
+    """
+    разбираем части прайса параллельно, а в каталог пишем их вместе
+    одной транзакцией в commit_price_list_import_task
+    """
+    job_id = task.request.id
+    store_job_state(
+        task,
+        job_id,
+        "PROGRESS",
+        {"shop_id": shop.id, "stage": "parsing", "chunks": len(chunks), "rows": 0},
+    )
+    chord(parse_price_list_chunk_task.s(path) for path in chunks)(
+        commit_price_list_import_task.s(
+            shop.id, job_id, directory, header, mode, time.time()
+        ).on_error(fail_price_list_import_task.si(shop.id, job_id, directory))
     )
 
 
 @shared_task()
-def new_order_signal_admin_task():
-    send_mail(
-        f"У Вас новый заказ",
-        # message:
-        f"Все подробности в админ-панели",
-        # from:
-        settings.EMAIL_HOST_USER,
-        # to:
-        [settings.EMAIL_HOST_USER],
-        fail_silently=False,
+def parse_price_list_chunk_task(path):
+    return parse_price_list_chunk(path)
+
+
+@shared_task(bind=True)
+def commit_price_list_import_task(
+    self, results, shop_id, job_id, directory, header, mode, started
+):
+    def progress(importer):
+        store_job_state(
+            self,
+            job_id,
+            "PROGRESS",
+            {
+                **importer.stats(),
+                "stage": "writing",
+                "chunks": len(results),
+                "total": sum(result["rows"] for result in results),
+            },
+        )
+
+    try:
+        result = commit_price_list_import(
+            Shop.objects.get(id=shop_id),
+            header,
+            results,
+            started,
+            mode=mode,
+            progress=progress,
+        )
+        store_job_state(self, job_id, "SUCCESS", result)
+    finally:
+        release_import_lock(shop_id, job_id)
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+@shared_task(bind=True)
+def fail_price_list_import_task(self, shop_id, job_id, directory):
+    release_import_lock(shop_id, job_id)
+    shutil.rmtree(directory, ignore_errors=True)
+    store_job_state(
+        self, job_id, "FAILURE", RuntimeError("Ошибка загрузки части прайса")
     )
+
+
+@shared_task()
+def flush_baskets_task(batch_size=500):
+    """
+    записываем в базу корзины, измененные в Redis с прошлого сброса
+    """
+    if settings.BASKET_BACKEND != "redis":
+        return 0
+    client = get_redis()
+    flushed = 0
+    while True:
+        user_ids = client.spop(DIRTY_BASKETS_KEY, batch_size)
+        if not user_ids:
+            return flushed
+        for user in User.objects.filter(id__in=[int(user_id) for user_id in user_ids]):
+            RedisBasket(user).materialize()
+            flushed += 1
@@ -0,0 +1,87 @@
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.authentication import local_cache
+from backend.models import User
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        local_cache.clear()
+        self.addCleanup(local_cache.clear)
+        self.user = User.objects.create_user(
+            email="buyer@mail.ru", password="pass", type="buyer"
+        )
+        self.client = APIClient()
+        response = self.client.post(
+            "/api/v1/user/login", {"email": "buyer@mail.ru", "password": "pass"}
+        )
+        self.token = response.data["Token"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token}")
+
+    def test_token_is_read_from_cache(self):
+        self.assertEqual(self.client.get("/api/v1/user/details").status_code, 200)
+
+        # токен и пользователь не запрашиваются из базы, только контакты
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/user/details")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["email"], "buyer@mail.ru")
+
+    def test_cached_user_keeps_password(self):
+        self.client.get("/api/v1/user/details")
+
+        response = self.client.patch(
+            "/api/v1/user/details", {"first_name": "Иван"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.first_name, "Иван")
+        self.assertTrue(user.check_password("pass"))
+
+    def test_deactivation_resets_cache(self):
+        self.client.get("/api/v1/user/details")
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        self.assertEqual(self.client.get("/api/v1/user/details").status_code, 401)
+
+    def test_type_change_resets_cache(self):
+        self.assertEqual(self.client.get("/api/v1/partner/orders").status_code, 403)
+
+        self.user.type = "shop"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        self.assertEqual(self.client.get("/api/v1/partner/orders").status_code, 200)
+
+    def test_token_delete_resets_cache(self):
+        self.client.get("/api/v1/user/details")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(key=self.token).delete()
+
+        self.assertEqual(self.client.get("/api/v1/user/details").status_code, 401)
+        # вход выдает новый токен
+        response = APIClient().post(
+            "/api/v1/user/login", {"email": "buyer@mail.ru", "password": "pass"}
+        )
+        self.assertNotEqual(response.data["Token"], self.token)
+
+    def test_cache_is_reset_after_commit(self):
+        self.client.get("/api/v1/user/details")
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.is_active = False
+            self.user.save()
+            # до фиксации снимок остается: его сброс ждет коммита
+            self.assertIsNotNone(local_cache.get(self.token))
+
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertIsNone(local_cache.get(self.token))
+        self.assertEqual(self.client.get("/api/v1/user/details").status_code, 401)
@@ -0,0 +1,136 @@
+from unittest import mock, skipUnless
+
+import yaml
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from backend.basket import DIRTY_BASKETS_KEY, RedisBasket
+from backend.importer import PriceListImporter
+from backend.models import Contact, Order, ProductInfo, Shop, User
+from backend.tasks import flush_baskets_task
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@skipUnless(fakeredis, "нужен fakeredis")
+@override_settings(BASKET_BACKEND="redis")
+class RedisBasketTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("backend.basket.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("backend.tasks.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        shop_user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        shop = Shop.objects.create(name="", user=shop_user)
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            PriceListImporter(shop).run(yaml.safe_load(updatefile))
+        self.offers = list(ProductInfo.objects.order_by("id")[:2])
+
+        self.user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_basket(self):
+        return self.client.post(
+            "/api/v1/basket",
+            {
+                "items": [
+                    {"product_info": self.offers[0].id, "quantity": 2},
+                    {"product_info": self.offers[1].id, "quantity": 1},
+                ]
+            },
+            format="json",
+        )
+
+    def test_basket_edits_do_not_write_orders(self):
+        with self.assertNumQueries(1):
+            response = self.post_basket()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.exists())
+        response = self.client.get("/api/v1/basket")
+        self.assertEqual(response.data[0]["item_count"], 3)
+        self.assertEqual(
+            response.data[0]["total_sum"],
+            self.offers[0].price * 2 + self.offers[1].price,
+        )
+
+        response = self.client.delete("/api/v1/basket")
+        self.assertEqual(self.client.get("/api/v1/basket").data, [])
+
+    def test_flush_writes_dirty_baskets(self):
+        self.post_basket()
+
+        self.assertEqual(flush_baskets_task(), 1)
+
+        basket = Order.objects.get(user=self.user, status="basket")
+        self.assertEqual(
+            dict(basket.ordered_items.values_list("product_info_id", "quantity")),
+            {self.offers[0].id: 2, self.offers[1].id: 1},
+        )
+        self.assertEqual(basket.item_count, 3)
+        self.assertFalse(self.redis.smembers(DIRTY_BASKETS_KEY))
+
+    def test_basket_is_restored_from_database(self):
+        self.post_basket()
+        flush_baskets_task()
+        self.redis.flushall()
+
+        self.assertEqual(
+            RedisBasket(self.user).items(),
+            {self.offers[0].id: 2, self.offers[1].id: 1},
+        )
+
+    @mock.patch("backend.views.new_order_signal_admin")
+    @mock.patch("backend.views.new_order_signal_user")
+    def test_confirm_materializes_basket(self, *mocks):
+        self.post_basket()
+        contact = Contact.objects.create(
+            user=self.user, city="Москва", street="Тверская", house="1", phone="1"
+        )
+
+        response = self.client.post(
+            "/api/v1/order/confirm", {"contact_id": contact.id}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.status, "new")
+        self.assertEqual(order.item_count, 3)
+        self.assertFalse(self.redis.exists(RedisBasket(self.user).key))
+
+
+class BasketUpsertTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+
+    def test_basket_is_created_once(self):
+        with self.assertNumQueries(1):
+            basket = Order.objects.basket(self.user)
+
+        self.assertEqual(basket.status, "basket")
+        self.assertEqual(basket.user_id, self.user.id)
+        self.assertIsNotNone(basket.date_time.tzinfo)
+        with self.assertNumQueries(1):
+            self.assertEqual(Order.objects.basket(self.user).id, basket.id)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_placed_orders_do_not_block_new_basket(self):
+        placed = Order.objects.basket(self.user)
+        Order.objects.filter(id=placed.id).update(status="new")
+
+        self.assertNotEqual(Order.objects.basket(self.user).id, placed.id)
+
+    def test_second_basket_is_rejected(self):
+        Order.objects.basket(self.user)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user, status="basket")
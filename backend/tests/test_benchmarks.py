@@ -0,0 +1,120 @@
+import io
+import os
+import tempfile
+
+import yaml
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from backend.benchmarks import BenchmarkRunner, generate_goods, write_price_list
+from backend.importer import PriceListImporter, iter_price_list
+from backend.models import (
+    Category,
+    OutboxEvent,
+    Parameter,
+    Product,
+    ProductInfo,
+    Shop,
+    User,
+)
+from backend.outbox import add_outbox_event
+
+
+def use_benchmark_database(test):
+    # тестовая база - отдельная, замеры на ней разрешены
+    override = override_settings(
+        BENCHMARK_DATABASE=str(connection.settings_dict["NAME"])
+    )
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+class PriceListGeneratorTest(TestCase):
+    def test_generated_price_list_matches_format(self):
+        stream = io.StringIO()
+        write_price_list(stream, 25, seed=1, batch_size=10)
+
+        data = yaml.safe_load(stream.getvalue())
+        self.assertEqual(data["shop"], "Benchmark")
+        self.assertEqual(len(data["goods"]), 25)
+        categories = {category["id"] for category in data["categories"]}
+        for item in data["goods"]:
+            self.assertEqual(
+                set(item),
+                {
+                    "id",
+                    "category",
+                    "model",
+                    "name",
+                    "price",
+                    "price_rrc",
+                    "quantity",
+                    "parameters",
+                },
+            )
+            self.assertIn(item["category"], categories)
+        sections = list(iter_price_list(io.BytesIO(stream.getvalue().encode())))
+        self.assertEqual([item for _, item in sections[2:]], data["goods"])
+
+    def test_generator_is_reproducible(self):
+        self.assertEqual(
+            list(generate_goods(10, seed=3)), list(generate_goods(10, seed=3))
+        )
+        self.assertNotEqual(
+            list(generate_goods(10, seed=3)), list(generate_goods(10, seed=4))
+        )
+
+
+class BenchmarkRunnerTest(TestCase):
+    def setUp(self):
+        use_benchmark_database(self)
+        descriptor, self.path = tempfile.mkstemp(suffix=".yaml")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as stream:
+            write_price_list(stream, 50)
+
+    def test_scenarios(self):
+        results = BenchmarkRunner(self.path, users=2, requests=3).run(
+            ["import", "basket", "confirm"]
+        )
+
+        self.assertEqual(results["database"], connection.vendor)
+        self.assertEqual(results["scenarios"]["import"]["rows"], 50)
+        self.assertEqual(results["scenarios"]["basket"]["requests"], 3)
+        self.assertEqual(results["scenarios"]["basket"]["statuses"], {"200": 3})
+        self.assertEqual(results["scenarios"]["confirm"]["statuses"], {"201": 2})
+        # данные прогона удалены
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Parameter.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+    def test_cleanup_keeps_other_data(self):
+        user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        shop = Shop.objects.create(name="", user=user)
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            PriceListImporter(shop).run(yaml.safe_load(updatefile))
+        counts = [model.objects.count() for model in (Category, Parameter, Product)]
+        runner = BenchmarkRunner(self.path, users=2, requests=3)
+        # событие другого процесса, записанное во время прогона
+        add_outbox_event("user_registered_mail", email="buyer@mail.ru")
+
+        runner.run(["import", "confirm"])
+
+        self.assertEqual(
+            [model.objects.count() for model in (Category, Parameter, Product)],
+            counts,
+        )
+        self.assertTrue(ProductInfo.objects.filter(shop=shop).exists())
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list("payload", flat=True)),
+            [{"email": "buyer@mail.ru"}],
+        )
+
+    @override_settings(BENCHMARK_DATABASE="")
+    def test_refuses_to_run_without_benchmark_database(self):
+        with self.assertRaises(ImproperlyConfigured):
+            BenchmarkRunner(self.path)
@@ -0,0 +1,127 @@
+import copy
+
+import yaml
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from backend.cache import get_versions, shop_scope
+from backend.importer import PriceListImporter
+from backend.models import Contact, Order, ProductInfo, Shop, User
+from backend.stock import change_order_statuses, place_order
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+def load_price_list(path):
+    with open(path, "r", encoding="utf-8") as updatefile:
+        return yaml.safe_load(updatefile)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.data = load_price_list("./data/shop1.yaml")
+        self.shop_1 = self.create_shop("shop1@mail.ru")
+        self.shop_2 = self.create_shop("shop2@mail.ru")
+        self.run_import(self.shop_1, self.data)
+
+    def create_shop(self, email):
+        user = User.objects.create_user(email=email, password="pass")
+        return Shop.objects.create(name=email, user=user)
+
+    def run_import(self, shop, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return PriceListImporter(shop).run(data)
+
+    def test_repeated_reads_skip_database(self):
+        first = self.client.get("/api/v1/products", {"shop_id": self.shop_1.id})
+
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/v1/products", {"shop_id": self.shop_1.id})
+
+        self.assertEqual(second.data, first.data)
+
+    def test_import_invalidates_changed_prices(self):
+        self.client.get("/api/v1/products", {"shop_id": self.shop_1.id})
+        data = copy.deepcopy(self.data)
+        data["goods"][0]["price"] += 1
+
+        self.run_import(self.shop_1, data)
+        response = self.client.get("/api/v1/products", {"shop_id": self.shop_1.id})
+
+        prices = {item["id"]: item["price"] for item in response.data["results"]}
+        self.assertIn(data["goods"][0]["price"], prices.values())
+
+    def test_unchanged_import_keeps_cache(self):
+        versions = get_versions(["products", shop_scope(self.shop_1.id)])
+
+        self.run_import(self.shop_1, self.data)
+
+        self.assertEqual(
+            get_versions(["products", shop_scope(self.shop_1.id)]), versions
+        )
+
+    def test_other_shop_import_keeps_shop_cache(self):
+        version = get_versions([shop_scope(self.shop_1.id)])
+
+        self.run_import(self.shop_2, load_price_list("./data/shop2.yaml"))
+
+        self.assertEqual(get_versions([shop_scope(self.shop_1.id)]), version)
+        self.assertNotEqual(get_versions([shop_scope(self.shop_2.id)]), version)
+
+    def test_shop_status_change_invalidates_shops(self):
+        response = self.client.get("/api/v1/shops")
+        self.assertEqual(response.data["count"], 2)
+
+        self.shop_1.status = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop_1.save()
+        response = self.client.get("/api/v1/shops")
+
+        self.assertEqual(response.data["count"], 1)
+
+    def test_shop_change_bumps_versions_after_commit(self):
+        version = get_versions([shop_scope(self.shop_1.id)])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.shop_1.status = False
+            self.shop_1.save()
+            # до фиксации параллельный запрос не должен видеть новую версию
+            self.assertEqual(get_versions([shop_scope(self.shop_1.id)]), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_versions([shop_scope(self.shop_1.id)]), version)
+
+    def test_stock_change_invalidates_products(self):
+        offer = ProductInfo.objects.filter(shop=self.shop_1).order_by("id").first()
+        ProductInfo.objects.filter(id=offer.id).update(quantity=1)
+        params = {"shop_id": self.shop_1.id, "in_stock": True}
+        in_stock = self.client.get("/api/v1/products", params).data["results"]
+        self.assertIn(offer.id, [item["id"] for item in in_stock])
+
+        buyer = User.objects.create_user(
+            email="buyer@mail.ru", password="pass", type="buyer"
+        )
+        contact = Contact.objects.create(
+            user=buyer, city="Москва", street="Тверская", house="1", phone="1"
+        )
+        order = Order.objects.create(user=buyer, status="basket")
+        order.ordered_items.create(product_info=offer, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(order, contact)
+
+        # распроданная позиция сразу пропадает из выдачи в наличии
+        in_stock = self.client.get("/api/v1/products", params).data["results"]
+        self.assertNotIn(offer.id, [item["id"] for item in in_stock])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change_order_statuses([(order.id, "canceled")])
+
+        in_stock = self.client.get("/api/v1/products", params).data["results"]
+        self.assertIn(offer.id, [item["id"] for item in in_stock])
@@ -0,0 +1,88 @@
+from unittest import mock, skipUnless
+
+import yaml
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend.events import notify_orders_changed
+from backend.importer import PriceListImporter
+from backend.models import Order, ProductInfo, Shop, User
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@skipUnless(fakeredis, "нужен fakeredis")
+class OrderEventsTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("backend.events.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.shop_user = User.objects.create_user(
+            email="shop@mail.ru", password="pass", type="shop"
+        )
+        shop = Shop.objects.create(name="", user=self.shop_user)
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            PriceListImporter(shop).run(yaml.safe_load(updatefile))
+
+        self.buyer = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.order = Order.objects.create(user=self.buyer, status="new")
+        self.order.ordered_items.create(
+            product_info=ProductInfo.objects.first(), quantity=1
+        )
+        self.client = APIClient()
+
+    def poll(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/v1/order/events", {"timeout": 0, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_status_change_reaches_buyer_and_shop(self):
+        buyer_since = self.poll(self.buyer)["since"]
+        shop_since = self.poll(self.shop_user)["since"]
+
+        self.client.force_authenticate(self.shop_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/partner/orders",
+                {"order_id": self.order.id, "status": "confirmed"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+
+        for user, since in ((self.buyer, buyer_since), (self.shop_user, shop_since)):
+            data = self.poll(user, since=since)
+            self.assertEqual(
+                [(event["order_id"], event["status"]) for event in data["events"]],
+                [(self.order.id, "confirmed")],
+            )
+            self.assertEqual(data["since"], data["events"][-1]["id"])
+            self.assertEqual(self.poll(user, since=data["since"])["events"], [])
+
+    def test_events_are_published_after_commit(self):
+        since = self.poll(self.buyer)["since"]
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify_orders_changed([self.order.id])
+            self.assertEqual(self.poll(self.buyer, since=since)["events"], [])
+
+        callbacks[0]()
+        self.assertEqual(len(self.poll(self.buyer, since=since)["events"]), 1)
+
+    def test_poll_does_not_query_database(self):
+        self.client.force_authenticate(self.buyer)
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/v1/order/events", {"timeout": 0})
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(self.buyer)
+
+        response = self.client.get("/api/v1/order/events", {"since": "latest"})
+
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+from django.test import TestCase
+
+from backend.benchmarks import write_price_list
+from backend.explain import explain_views
+from backend.models import ProductInfo, User
+from backend.tests.test_benchmarks import use_benchmark_database
+
+
+class ExplainQueriesTest(TestCase):
+    def setUp(self):
+        use_benchmark_database(self)
+
+    def test_view_queries_use_indexes(self):
+        descriptor, path = tempfile.mkstemp(suffix=".yaml")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as stream:
+            write_price_list(stream, 100)
+
+        report = explain_views(path)
+
+        self.assertIn("POST order/confirm", report)
+        self.assertTrue(all(report.values()))
+        scans = {
+            endpoint: query["sql"]
+            for endpoint, queries in report.items()
+            for query in queries
+            if query["scans"]
+        }
+        self.assertEqual(scans, {})
+        # данные для разбора удалены
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(ProductInfo.objects.exists())
@@ -0,0 +1,112 @@
+import csv
+import gzip
+import io
+
+import ujson
+import yaml
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from backend.export import iter_offers
+from backend.importer import PriceListImporter
+from backend.models import ProductInfo, Shop, User
+
+
+class PartnerExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="shop@mail.ru", password="pass", type="shop"
+        )
+        self.shop = Shop.objects.create(name="", user=self.user)
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            self.data = yaml.safe_load(updatefile)
+        PriceListImporter(self.shop).run(self.data)
+        # позиция другого магазина в выгрузку не попадает
+        other = Shop.objects.create(
+            name="", user=User.objects.create_user(email="other@mail.ru", password="p")
+        )
+        with open("./data/shop2.yaml", "r", encoding="utf-8") as updatefile:
+            PriceListImporter(other).run(yaml.safe_load(updatefile))
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected(self):
+        return {
+            item["id"]: {
+                "name": item["name"],
+                "price": item["price"],
+                "parameters": {
+                    name: str(value) for name, value in item["parameters"].items()
+                },
+            }
+            for item in self.data["goods"]
+        }
+
+    def test_ndjson(self):
+        response = self.client.get("/api/v1/partner/export")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response["Content-Type"], "application/x-ndjson; charset=utf-8"
+        )
+        rows = [
+            ujson.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(
+            {
+                row["external_id"]: {
+                    key: row[key] for key in ("name", "price", "parameters")
+                }
+                for row in rows
+            },
+            self.expected(),
+        )
+
+    def test_gzip_csv(self):
+        response = self.client.get(
+            "/api/v1/partner/export?output=csv", HTTP_ACCEPT_ENCODING="gzip"
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = gzip.decompress(b"".join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), len(self.data["goods"]))
+        self.assertEqual(
+            {int(row["external_id"]): ujson.loads(row["parameters"]) for row in rows},
+            {
+                external_id: item["parameters"]
+                for external_id, item in self.expected().items()
+            },
+        )
+
+    def test_offers_without_parameters(self):
+        offer = ProductInfo.objects.filter(shop=self.shop).order_by("id")[1]
+        offer.product_parameters.all().delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(iter_offers(self.shop.id, chunk_size=2))
+
+        # выгрузка идет в транзакции: в тесте это точка сохранения
+        self.assertEqual(
+            [query["sql"].split()[0] for query in queries],
+            ["SAVEPOINT", "SELECT", "SELECT", "RELEASE"],
+        )
+        self.assertEqual(len(rows), len(self.data["goods"]))
+        self.assertEqual(rows[1]["parameters"], {})
+        self.assertTrue(rows[2]["parameters"])
+
+    def test_buyer_is_forbidden(self):
+        self.client.force_authenticate(
+            User.objects.create_user(
+                email="buyer@mail.ru", password="pass", type="buyer"
+            )
+        )
+
+        response = self.client.get("/api/v1/partner/export")
+
+        self.assertEqual(response.status_code, 403)
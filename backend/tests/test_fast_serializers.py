@@ -0,0 +1,98 @@
+from django.db.models import Prefetch
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from backend.fast_serializers import (
+    PRODUCT_INFO_VALUES,
+    serialize_orders,
+    serialize_product_infos,
+)
+from backend.models import (
+    Contact,
+    Order,
+    OrderItem,
+    ProductInfo,
+    ProductParameter,
+    User,
+)
+from backend.renderers import UJSONRenderer
+from backend.serializers import OrderSerializer, ProductInfoSerializer
+from backend.tests.test_products import import_price_list
+
+
+class FastSerializersTest(TestCase):
+    def setUp(self):
+        import_price_list("shop1@mail.ru", "./data/shop1.yaml")
+        self.user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        contact = Contact.objects.create(
+            user=self.user, city="Москва", street="Тверская", house="1", phone="1"
+        )
+        offers = list(ProductInfo.objects.order_by("id"))
+        for contact_id, status in ((contact.id, "new"), (None, "canceled")):
+            order = Order.objects.create(
+                user=self.user, status=status, contact_id=contact_id
+            )
+            order.replace_items({offers[0].id: 2, offers[3].id: 1})
+
+    def assertSameJSON(self, fast, data):
+        self.assertEqual(UJSONRenderer().render(fast), JSONRenderer().render(data))
+
+    def test_product_infos_match_serializer(self):
+        queryset = ProductInfo.objects.order_by("id")
+        data = ProductInfoSerializer(
+            queryset.select_related("product__category").prefetch_related(
+                Prefetch(
+                    "product_parameters",
+                    queryset=ProductParameter.objects.select_related(
+                        "parameter"
+                    ).order_by("id"),
+                )
+            ),
+            many=True,
+        ).data
+
+        with self.assertNumQueries(2):
+            fast = serialize_product_infos(list(queryset.values(*PRODUCT_INFO_VALUES)))
+
+        self.assertSameJSON(fast, data)
+
+    def test_orders_match_serializer(self):
+        queryset = Order.objects.filter(user=self.user).exclude(status="basket")
+        data = OrderSerializer(
+            queryset.select_related("contact").prefetch_related(
+                Prefetch("ordered_items", queryset=OrderItem.objects.order_by("id"))
+            ),
+            many=True,
+        ).data
+
+        with self.assertNumQueries(2):
+            fast = serialize_orders(queryset)
+
+        self.assertEqual(len(fast), 2)
+        self.assertSameJSON(fast, data)
+
+    def test_renderer_matches_json_renderer(self):
+        for data in (
+            {"text": "Смартфон 8/128 ", "price": 1.5, "items": [None, True]},
+            {"detail": "Учетные данные не были предоставлены."},
+            {"floats": [1e-7, -4.722452435761166e-07, 1e-5, 1e-10, 1e16, 1e22]},
+            {"floats": [0.1, 0.30000000000000004, 5e-324, 1.7976931348623157e308]},
+            {"text": "1e-7", "value": -0.0},
+        ):
+            self.assertSameJSON(data, data)
+        # даты ujson не кодирует - срабатывает JSONRenderer
+        data = {"date_time": Order.objects.first().date_time}
+        self.assertSameJSON(data, data)
+
+    def test_order_view(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with self.assertNumQueries(2):
+            response = client.get("/api/v1/order")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [order["status"] for order in response.json()], ["canceled", "new"]
+        )
@@ -0,0 +1,345 @@
+import copy
+from unittest import mock
+
+import yaml
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from backend.importer import (
+    PriceListImporter,
+    acquire_import_lock,
+    iter_price_list,
+    release_import_lock,
+)
+from backend.models import (
+    Category,
+    Order,
+    OrderItem,
+    Parameter,
+    PriceImportJob,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    User,
+)
+from backend.tasks import import_price_list_task
+
+
+def load_price_list(path):
+    with open(path, "r", encoding="utf-8") as updatefile:
+        return yaml.safe_load(updatefile)
+
+
+class PriceListImporterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        self.shop = Shop.objects.create(name="", user=self.user)
+        self.data = load_price_list("./data/shop1.yaml")
+
+    def test_import(self):
+        importer = PriceListImporter(self.shop).run(self.data)
+
+        self.assertEqual(importer.rows, len(self.data["goods"]))
+        self.assertEqual(self.shop.name, self.data["shop"])
+        self.assertEqual(
+            ProductInfo.objects.filter(shop=self.shop).count(), len(self.data["goods"])
+        )
+        self.assertEqual(
+            Category.objects.filter(shops=self.shop).count(),
+            len(self.data["categories"]),
+        )
+        parameters = sum(len(item["parameters"]) for item in self.data["goods"])
+        self.assertEqual(ProductParameter.objects.count(), parameters)
+
+        item = self.data["goods"][0]
+        product_info = ProductInfo.objects.get(external_id=item["id"])
+        self.assertEqual(product_info.product.name, item["name"])
+        self.assertEqual(product_info.product.category_id, item["category"])
+        self.assertEqual(product_info.price, item["price"])
+        values = dict(
+            product_info.product_parameters.values_list(
+                "parameter__name_parameter", "value"
+            )
+        )
+        self.assertEqual(
+            values, {name: str(value) for name, value in item["parameters"].items()}
+        )
+        self.assertEqual(
+            product_info.product_parameters.get(
+                parameter__name_parameter="Встроенная память (Гб)"
+            ).numeric_value,
+            float(item["parameters"]["Встроенная память (Гб)"]),
+        )
+        self.assertIsNone(
+            product_info.product_parameters.get(
+                parameter__name_parameter="Цвет"
+            ).numeric_value
+        )
+
+    def test_reimport_reuses_dimensions(self):
+        PriceListImporter(self.shop).run(self.data)
+        products = Product.objects.count()
+        parameters = Parameter.objects.count()
+
+        PriceListImporter(self.shop).run(self.data)
+
+        self.assertEqual(Product.objects.count(), products)
+        self.assertEqual(Parameter.objects.count(), parameters)
+        self.assertEqual(
+            ProductInfo.objects.filter(shop=self.shop).count(), len(self.data["goods"])
+        )
+
+    def test_query_count_does_not_depend_on_feed_size(self):
+        goods = self.data["goods"]
+        with self.assertNumQueries(17):
+            PriceListImporter(self.shop, batch_size=len(goods)).run(self.data)
+
+    def test_sync_writes_only_changes(self):
+        PriceListImporter(self.shop).run(self.data)
+        ids = dict(ProductInfo.objects.values_list("external_id", "id"))
+        kept, changed, removed = self.data["goods"][:3]
+        order = Order.objects.create(user=self.user, status="basket")
+        OrderItem.objects.create(
+            order=order, product_info_id=ids[kept["id"]], quantity=1
+        )
+
+        data = copy.deepcopy(self.data)
+        data["goods"] = [item for item in data["goods"] if item["id"] != removed["id"]]
+        item = next(item for item in data["goods"] if item["id"] == changed["id"])
+        item["price"] += 100
+        item["parameters"]["Цвет"] = "белый"
+        importer = PriceListImporter(self.shop).run(data)
+
+        self.assertEqual(importer.created, 0)
+        self.assertEqual(importer.updated, 1)
+        self.assertEqual(importer.deleted, 1)
+        self.assertEqual(
+            dict(ProductInfo.objects.values_list("external_id", "id")),
+            {
+                external_id: product_info_id
+                for external_id, product_info_id in ids.items()
+                if external_id != removed["id"]
+            },
+        )
+        product_info = ProductInfo.objects.get(external_id=changed["id"])
+        self.assertEqual(product_info.price, changed["price"] + 100)
+        self.assertEqual(
+            product_info.product_parameters.get(parameter__name_parameter="Цвет").value,
+            "белый",
+        )
+        self.assertTrue(OrderItem.objects.filter(order=order).exists())
+
+    def test_renumbered_external_id(self):
+        PriceListImporter(self.shop).run(self.data)
+        renumbered = self.data["goods"][0]
+        product_info_id = ProductInfo.objects.get(external_id=renumbered["id"]).id
+        order = Order.objects.create(user=self.user, status="basket")
+        OrderItem.objects.create(
+            order=order, product_info_id=product_info_id, quantity=1
+        )
+
+        data = copy.deepcopy(self.data)
+        data["goods"][0]["id"] = 999999
+        # позиция с новым id приходит в последней пачке
+        data["goods"].append(data["goods"].pop(0))
+        importer = PriceListImporter(self.shop, batch_size=2).run(data)
+
+        self.assertEqual(importer.created, 0)
+        self.assertEqual(
+            set(ProductInfo.objects.values_list("external_id", flat=True)),
+            {item["id"] for item in data["goods"]},
+        )
+        # строка перенумерована, корзина ее не потеряла
+        self.assertEqual(
+            ProductInfo.objects.get(external_id=999999).id, product_info_id
+        )
+        self.assertTrue(OrderItem.objects.filter(order=order).exists())
+
+    def test_swapped_products(self):
+        PriceListImporter(self.shop).run(self.data)
+
+        data = copy.deepcopy(self.data)
+        first, second = data["goods"][:2]
+        first["id"], second["id"] = second["id"], first["id"]
+        importer = PriceListImporter(self.shop).run(data)
+
+        self.assertEqual(importer.skipped, 0)
+        for item in data["goods"][:2]:
+            self.assertEqual(
+                ProductInfo.objects.get(external_id=item["id"]).product.name,
+                item["name"],
+            )
+
+    def test_duplicate_product_is_skipped(self):
+        data = copy.deepcopy(self.data)
+        duplicate = copy.deepcopy(data["goods"][0])
+        duplicate["id"] = 999999
+        data["goods"].append(duplicate)
+
+        importer = PriceListImporter(self.shop, batch_size=2).run(data)
+
+        self.assertEqual(importer.skipped, 1)
+        self.assertEqual(importer.errors[0]["id"], 999999)
+        self.assertFalse(ProductInfo.objects.filter(external_id=999999).exists())
+
+    def test_duplicate_id_is_skipped(self):
+        for batch_size in (1000, 1):
+            with self.subTest(batch_size=batch_size):
+                ProductInfo.objects.all().delete()
+                data = copy.deepcopy(self.data)
+                first, second = data["goods"][:2]
+                second["id"] = first["id"]
+
+                importer = PriceListImporter(self.shop, batch_size=batch_size).run(data)
+
+                self.assertEqual(importer.skipped, 1)
+                self.assertEqual(importer.errors[0]["id"], first["id"])
+                # первая позиция с этим id не перезаписана второй
+                self.assertEqual(
+                    ProductInfo.objects.get(external_id=first["id"]).product.name,
+                    first["name"],
+                )
+                self.assertEqual(ProductInfo.objects.count(), len(data["goods"]) - 1)
+
+    def test_unchanged_feed_is_not_rewritten(self):
+        PriceListImporter(self.shop).run(self.data)
+
+        importer = PriceListImporter(self.shop).run(self.data)
+
+        self.assertEqual(importer.created, 0)
+        self.assertEqual(importer.updated, 0)
+        self.assertEqual(importer.deleted, 0)
+
+    def test_replace_mode(self):
+        PriceListImporter(self.shop).run(self.data)
+        ids = set(ProductInfo.objects.values_list("id", flat=True))
+
+        PriceListImporter(self.shop, mode="replace").run(self.data)
+
+        self.assertFalse(ids & set(ProductInfo.objects.values_list("id", flat=True)))
+
+    def test_streaming_import_in_batches(self):
+        with open("./data/shop1.yaml", "rb") as updatefile:
+            importer = PriceListImporter(self.shop, batch_size=2).run(
+                iter_price_list(updatefile)
+            )
+
+        self.assertEqual(importer.rows, len(self.data["goods"]))
+        self.assertEqual(self.shop.name, self.data["shop"])
+        self.assertEqual(
+            set(ProductInfo.objects.values_list("external_id", flat=True)),
+            {item["id"] for item in self.data["goods"]},
+        )
+
+    def test_iter_price_list_matches_yaml_load(self):
+        with open("./data/shop2.yaml", "rb") as updatefile:
+            sections = list(iter_price_list(updatefile))
+        data = load_price_list("./data/shop2.yaml")
+
+        self.assertEqual(sections[0], ("shop", data["shop"]))
+        self.assertEqual(sections[1], ("categories", data["categories"]))
+        self.assertEqual([item for _, item in sections[2:]], data["goods"])
+
+
+class PriceListImportTaskTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        self.shop = Shop.objects.create(name="", user=self.user)
+
+    def test_task_imports_sources(self):
+        result = import_price_list_task.apply(
+            args=(self.shop.id, ["./data/shop1.yaml"])
+        ).get()
+
+        goods = load_price_list("./data/shop1.yaml")["goods"]
+        self.assertEqual(result["shop_id"], self.shop.id)
+        self.assertEqual(result["rows"], len(goods))
+        self.assertEqual(result["created"], len(goods))
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), len(goods))
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.import_job_id, "")
+
+    @override_settings(PRICE_IMPORT_SHARD_SIZE=0, PRICE_IMPORT_WORK_DIR="")
+    def test_task_without_work_dir_is_not_sharded(self):
+        with mock.patch("backend.tasks.start_sharded_import") as start:
+            result = import_price_list_task.apply(
+                args=(self.shop.id, ["./data/shop1.yaml"])
+            ).get()
+
+        start.assert_not_called()
+        goods = load_price_list("./data/shop1.yaml")["goods"]
+        self.assertEqual(result["rows"], len(goods))
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), len(goods))
+
+    def test_import_lock(self):
+        self.assertTrue(acquire_import_lock(self.shop.id, "first"))
+        self.assertFalse(acquire_import_lock(self.shop.id, "second"))
+
+        release_import_lock(self.shop.id, "first")
+
+        self.assertTrue(acquire_import_lock(self.shop.id, "second"))
+
+    def test_invalid_goods_are_reported(self):
+        data = load_price_list("./data/shop1.yaml")
+        del data["goods"][0]["price"]
+
+        importer = PriceListImporter(self.shop).run(data)
+
+        self.assertEqual(importer.rows, len(data["goods"]) - 1)
+        self.assertEqual(importer.skipped, 1)
+        self.assertEqual(
+            importer.errors,
+            [{"id": data["goods"][0]["id"], "message": "нет полей price"}],
+        )
+
+
+class PartnerUpdateStatusTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="shop@mail.ru", password="pass", type="shop"
+        )
+        self.shop = Shop.objects.create(name="shop", user=self.user)
+        other = User.objects.create_user(
+            email="other@mail.ru", password="pass", type="shop"
+        )
+        self.other = Shop.objects.create(name="other", user=other)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch("backend.tasks.import_price_list_task.apply_async")
+    def test_queued_job_is_owned_by_shop(self, apply_async):
+        response = self.client.post(
+            "/api/v1/partner/update/url",
+            {"url": "https://example.com/shop.yaml"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["JobId"]
+        self.assertEqual(apply_async.call_args.kwargs["task_id"], job_id)
+        self.assertEqual(PriceImportJob.objects.get(job_id=job_id).shop, self.shop)
+
+    @mock.patch("backend.views.get_result")
+    def test_status_of_own_job(self, get_result):
+        PriceImportJob.objects.create(job_id="own", shop=self.shop)
+        get_result.return_value = mock.Mock(
+            state="FAILURE", info=RuntimeError("нет файла")
+        )
+        get_result.return_value.failed.return_value = True
+
+        response = self.client.get("/api/v1/partner/update/status/own")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["State"], "FAILURE")
+        self.assertEqual(response.data["Message"], "нет файла")
+
+    @mock.patch("backend.views.get_result")
+    def test_foreign_and_unknown_jobs_are_hidden(self, get_result):
+        PriceImportJob.objects.create(job_id="foreign", shop=self.other)
+
+        for job_id in ("foreign", "unknown"):
+            response = self.client.get(f"/api/v1/partner/update/status/{job_id}")
+            self.assertEqual(response.status_code, 404)
+        get_result.assert_not_called()
@@ -0,0 +1,186 @@
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest import mock, skipUnless
+
+import ujson
+from django.core import mail
+from django.test import TestCase, override_settings
+
+from backend.mail import (
+    MAIL_FLUSH_LOCK_KEY,
+    MAIL_PROCESSING_KEY,
+    MAIL_QUEUE_KEY,
+    MAIL_STATS_KEY,
+    flush_mail_queue,
+    queue_admin_digest,
+    queue_admin_notification,
+    queue_mail,
+)
+from backend.tasks import send_queued_mail_task
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@skipUnless(fakeredis, "нужен fakeredis")
+@override_settings(EMAIL_HOST_USER="admin@mail.ru")
+class MailQueueTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("backend.mail.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("backend.mail.current_app.send_task")
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mails_are_sent_in_batches_over_one_connection(self):
+        for number in range(5):
+            queue_mail("registration", [f"user{number}@mail.ru"])
+
+        # отправка планируется одна на всю пачку
+        self.send_task.assert_called_once()
+        self.assertEqual(len(mail.outbox), 0)
+
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.open", return_value=True
+        ) as opened:
+            stats = flush_mail_queue(batch_size=2)
+
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(stats["sent"], 5)
+        self.assertEqual(self.redis.llen(MAIL_QUEUE_KEY), 0)
+        self.assertEqual(int(self.redis.hget(MAIL_STATS_KEY, "sent")), 5)
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [[f"user{number}@mail.ru"] for number in range(5)],
+        )
+        self.assertEqual(mail.outbox[0].subject, "Регистрация в Нашем магазине")
+        self.assertEqual(mail.outbox[0].from_email, "admin@mail.ru")
+
+    def test_template_context(self):
+        queue_mail("new_order", ["buyer@mail.ru"], {"order_id": 42})
+        flush_mail_queue()
+
+        self.assertEqual(mail.outbox[0].subject, "Благодарим за заказ")
+        self.assertEqual(mail.outbox[0].body, "Ваш заказ №42 сформирован")
+
+    def test_admin_notifications_are_coalesced(self):
+        for order_id in (3, 5, 8):
+            queue_admin_notification(order_id)
+
+        self.assertEqual(queue_admin_digest(), 3)
+        self.assertEqual(queue_admin_digest(), 0)
+        flush_mail_queue()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["admin@mail.ru"])
+        self.assertEqual(mail.outbox[0].subject, "У Вас новые заказы: 3")
+        self.assertIn("3, 5, 8", mail.outbox[0].body)
+
+    def send_failing(self, refused=(), disconnect_after=None):
+        """
+        подмена отправки locmem: адреса refused отклоняются, после
+        disconnect_after писем соединение обрывается
+        """
+
+        def send_messages(messages):
+            for message in messages:
+                if len(mail.outbox) == disconnect_after:
+                    raise SMTPServerDisconnected("down")
+                if message.to[0] in refused:
+                    raise SMTPRecipientsRefused({message.to[0]: (550, b"no user")})
+                mail.outbox.append(message)
+            return len(messages)
+
+        return mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=send_messages,
+        )
+
+    def queued(self):
+        return [
+            ujson.loads(message) for message in self.redis.lrange(MAIL_QUEUE_KEY, 0, -1)
+        ]
+
+    def test_connection_error_requeues_only_unsent_mails(self):
+        for number in range(3):
+            queue_mail("registration", [f"user{number}@mail.ru"])
+
+        with self.send_failing(disconnect_after=1):
+            with self.assertRaises(SMTPServerDisconnected):
+                flush_mail_queue()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            [(message["to"], message["attempts"]) for message in self.queued()],
+            [(["user1@mail.ru"], 1), (["user2@mail.ru"], 0)],
+        )
+        self.assertEqual(self.redis.llen(MAIL_PROCESSING_KEY), 0)
+
+        self.assertEqual(flush_mail_queue()["sent"], 2)
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [[f"user{number}@mail.ru"] for number in range(3)],
+        )
+
+    @override_settings(MAIL_MAX_ATTEMPTS=2)
+    def test_refused_mail_does_not_block_queue(self):
+        for email in ("first@mail.ru", "wrong@mail.ru", "second@mail.ru"):
+            queue_mail("registration", [email])
+
+        with self.send_failing(refused={"wrong@mail.ru"}):
+            self.assertEqual(flush_mail_queue(batch_size=2)["sent"], 2)
+            self.assertEqual(
+                [(message["to"], message["attempts"]) for message in self.queued()],
+                [(["wrong@mail.ru"], 1)],
+            )
+
+            self.assertEqual(flush_mail_queue()["sent"], 0)
+            self.assertEqual(self.redis.llen(MAIL_QUEUE_KEY), 0)
+
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [["first@mail.ru"], ["second@mail.ru"]],
+        )
+
+    def test_interrupted_flush_is_recovered(self):
+        queue_mail("registration", ["first@mail.ru"])
+        queue_mail("registration", ["second@mail.ru"])
+        # отправка упала, забрав оба письма из очереди
+        self.redis.lmove(MAIL_QUEUE_KEY, MAIL_PROCESSING_KEY, "LEFT", "RIGHT")
+        self.redis.lmove(MAIL_QUEUE_KEY, MAIL_PROCESSING_KEY, "LEFT", "RIGHT")
+
+        self.assertEqual(flush_mail_queue()["sent"], 2)
+
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [["first@mail.ru"], ["second@mail.ru"]],
+        )
+        self.assertEqual(self.redis.llen(MAIL_PROCESSING_KEY), 0)
+
+    def test_busy_queue_is_not_flushed_twice(self):
+        queue_mail("registration", ["user@mail.ru"])
+        self.redis.set(MAIL_FLUSH_LOCK_KEY, "other")
+
+        self.assertEqual(flush_mail_queue()["sent"], 0)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.redis.llen(MAIL_QUEUE_KEY), 1)
+
+    def test_task_retries_with_backoff(self):
+        queue_mail("registration", ["user@mail.ru"])
+
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=SMTPException("down"),
+        ), mock.patch.object(
+            send_queued_mail_task, "retry", side_effect=RuntimeError
+        ) as retry:
+            with self.assertRaises(RuntimeError):
+                send_queued_mail_task.apply(throw=True).get()
+
+        retry.assert_called_once()
+        self.assertEqual(retry.call_args.kwargs["countdown"], 10)
+        self.assertEqual(self.redis.llen(MAIL_QUEUE_KEY), 1)
@@ -0,0 +1,179 @@
+import yaml
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.importer import PriceListImporter
+from backend.metrics import QueryBudgetMixin, registry, request_measured
+from backend.models import Contact, Order, ProductInfo, Shop, User
+from backend.stock import place_order
+
+
+class MetricsTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        registry.clear()
+        self.shop = Shop.objects.create(
+            name="", user=User.objects.create_user(email="shop@mail.ru", password="p")
+        )
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            PriceListImporter(self.shop).run(yaml.safe_load(updatefile))
+        self.user = User.objects.create_user(
+            email="buyer@mail.ru", password="pass", type="buyer"
+        )
+        self.client = APIClient()
+        # через токен, как настоящие клиенты: запрос токена входит в бюджет
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.user).key}"
+        )
+
+    # токен читается из базы в каждом запросе, как при холодном кэше
+    @override_settings(AUTH_CACHE_LOCAL_TTL=0)
+    def test_endpoints_fit_query_budgets(self):
+        offers = list(ProductInfo.objects.values_list("id", flat=True))
+        self.client.get("/api/v1/products")
+        self.client.get("/api/v1/products", {"param": "Цвет:eq:черный"})
+        self.client.post(
+            "/api/v1/basket",
+            {"items": [{"product_info": offer, "quantity": 1} for offer in offers]},
+            format="json",
+        )
+        self.client.get("/api/v1/basket")
+        self.client.get("/api/v1/order")
+        self.client.get("/api/v1/products/search", {"q": "iPhone"})
+        self.client.get("/api/v1/shops")
+        self.client.get("/api/v1/categories")
+        self.client.get("/api/v1/user/details")
+        self.client.patch("/api/v1/user/details", {"first_name": "Иван"}, format="json")
+        contact = self.client.post(
+            "/api/v1/user/contact",
+            {"city": "Москва", "street": "Тверская", "house": "1", "phone": "1"},
+            format="json",
+        ).data
+        self.client.get("/api/v1/user/contact")
+        response = self.client.post(
+            "/api/v1/order/confirm", {"contact_id": contact["id"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+    # токен читается из базы в каждом запросе, как при холодном кэше
+    @override_settings(AUTH_CACHE_LOCAL_TTL=0)
+    def test_partner_endpoints_fit_query_budgets(self):
+        offers = list(ProductInfo.objects.values_list("id", flat=True))
+        contact = Contact.objects.create(
+            user=self.user, city="Москва", street="Тверская", house="1", phone="1"
+        )
+        orders = []
+        for _ in range(3):
+            basket = Order.objects.create(user=self.user, status="basket")
+            for offer in offers:
+                basket.ordered_items.create(product_info_id=offer, quantity=1)
+            place_order(basket, contact)
+            orders.append(basket.id)
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.shop.user).key}"
+        )
+
+        client.get("/api/v1/partner/orders")
+        response = client.post(
+            "/api/v1/partner/orders",
+            {"order_id": orders[0], "status": "canceled"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        response = client.post(
+            "/api/v1/partner/orders/status",
+            {
+                "orders": [
+                    {"order_id": orders[1], "status": "confirmed"},
+                    {"order_id": orders[2], "status": "canceled"},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_account_endpoints_fit_query_budgets(self):
+        client = APIClient()
+        response = client.post(
+            "/api/v1/user/register",
+            {
+                "first_name": "Иван",
+                "last_name": "Иванов",
+                "email": "new@mail.ru",
+                "company": "",
+                "position": "",
+                "password": "Strong-pass-123",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        response = client.post(
+            "/api/v1/user/login", {"email": "buyer@mail.ru", "password": "pass"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(DEBUG=True)
+    def test_prometheus_export(self):
+        self.client.get("/api/v1/products")
+        self.client.get("/api/v1/products")
+        self.client.get("/api/v1/unknown")
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn(
+            'api_requests_total{endpoint="backend:products",method="GET",status="200"} 2',
+            text,
+        )
+        # второй запрос берет токен из кэша аутентификации
+        self.assertIn(
+            'api_db_queries_total{endpoint="backend:products",method="GET"} 5', text
+        )
+        self.assertIn(
+            'api_db_queries_max{endpoint="backend:products",method="GET"} 3', text
+        )
+        self.assertIn('endpoint="unknown",method="GET",status="404"', text)
+        self.assertIn('api_serialize_seconds_total{endpoint="backend:products"', text)
+        self.assertIn('api_render_seconds_total{endpoint="backend:products"', text)
+        self.assertIn('api_response_bytes_total{endpoint="backend:products"', text)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_export_token(self):
+        client = APIClient()
+        self.assertEqual(client.get("/metrics").status_code, 403)
+        response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_export_without_token_needs_debug(self):
+        client = APIClient()
+        self.assertEqual(client.get("/metrics").status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(client.get("/metrics").status_code, 200)
+
+    def test_budget_violation_is_reported(self):
+        self.query_budgets = {"backend:products": 1}
+
+        self.client.get("/api/v1/products")
+
+        self.assertEqual(len(self.budget_violations), 1)
+        self.assertIn("3 запросов к базе при бюджете 1", self.budget_violations[0])
+        self.budget_violations.clear()
+
+    def test_serialization_is_measured(self):
+        measured = []
+
+        def collect(sender, metrics, **kwargs):
+            measured.append(metrics)
+
+        request_measured.connect(collect)
+        self.addCleanup(request_measured.disconnect, collect)
+        self.client.get("/api/v1/shops")
+        self.client.get("/api/v1/user/details")
+
+        self.assertEqual(len(measured), 2)
+        for metrics in measured:
+            self.assertGreater(metrics["serialize_seconds"], 0)
+            self.assertLess(metrics["serialize_seconds"], metrics["seconds"])
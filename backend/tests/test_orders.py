@@ -0,0 +1,577 @@
+import copy
+import threading
+from base64 import urlsafe_b64encode
+from unittest import mock, skipUnless
+
+import ujson
+import yaml
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from backend.importer import PriceListImporter
+from backend.models import Contact, Order, ProductInfo, Shop, User
+from backend.stock import InsufficientStock, OrderStatusConflict, place_order
+
+
+def load_price_list(path):
+    with open(path, "r", encoding="utf-8") as updatefile:
+        return yaml.safe_load(updatefile)
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        self.data = load_price_list("./data/shop1.yaml")
+        shop_user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        self.shop = Shop.objects.create(name="", user=shop_user)
+        PriceListImporter(self.shop).run(self.data)
+        self.offers = list(ProductInfo.objects.order_by("id")[:2])
+
+        self.user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_basket(self):
+        basket = Order.objects.create(user=self.user, status="basket")
+        response = self.client.post(
+            "/api/v1/basket",
+            {
+                "items": [
+                    {
+                        "product_info": self.offers[0].id,
+                        "quantity": 2,
+                        "order": basket.id,
+                    },
+                    {
+                        "product_info": self.offers[1].id,
+                        "quantity": 1,
+                        "order": basket.id,
+                    },
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        basket.refresh_from_db()
+        return basket
+
+    def test_basket_totals(self):
+        basket = self.fill_basket()
+
+        self.assertEqual(
+            basket.total_sum, self.offers[0].price * 2 + self.offers[1].price
+        )
+        self.assertEqual(basket.item_count, 3)
+        response = self.client.get("/api/v1/basket")
+        self.assertEqual(response.data[0]["total_sum"], basket.total_sum)
+        self.assertEqual(response.data[0]["item_count"], 3)
+
+    def test_totals_after_price_import(self):
+        basket = self.fill_basket()
+        order = Order.objects.create(user=self.user, status="new")
+        order.ordered_items.create(product_info=self.offers[0], quantity=1)
+        Order.objects.filter(id=order.id).refresh_totals()
+        order.refresh_from_db()
+
+        data = copy.deepcopy(self.data)
+        for item in data["goods"]:
+            if item["id"] == self.offers[0].external_id:
+                item["price"] += 100
+        PriceListImporter(self.shop).run(data)
+
+        basket.refresh_from_db()
+        self.assertEqual(
+            basket.total_sum, (self.offers[0].price + 100) * 2 + self.offers[1].price
+        )
+        total_sum = order.total_sum
+        order.refresh_from_db()
+        self.assertEqual(order.total_sum, total_sum)
+
+        data["goods"] = [
+            item for item in data["goods"] if item["id"] != self.offers[1].external_id
+        ]
+        PriceListImporter(self.shop).run(data)
+
+        basket.refresh_from_db()
+        self.assertEqual(basket.total_sum, (self.offers[0].price + 100) * 2)
+        self.assertEqual(basket.item_count, 2)
+
+    @mock.patch("backend.views.new_order_signal_admin")
+    @mock.patch("backend.views.new_order_signal_user")
+    def test_confirm_freezes_totals(self, *mocks):
+        basket = self.fill_basket()
+        contact = Contact.objects.create(
+            user=self.user, city="Москва", street="Тверская", house="1", phone="1"
+        )
+
+        response = self.client.post(
+            "/api/v1/order/confirm",
+            {"id": basket.id, "contact_id": contact.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(id=basket.id)
+        self.assertEqual(order.status, "new")
+        self.assertEqual(order.contact_id, contact.id)
+        self.assertEqual(order.total_sum, basket.total_sum)
+        response = self.client.get("/api/v1/order")
+        self.assertEqual(response.data[0]["total_sum"], basket.total_sum)
+
+
+class BasketWriteTest(TestCase):
+    def setUp(self):
+        shop_user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        shop = Shop.objects.create(name="", user=shop_user)
+        PriceListImporter(shop).run(load_price_list("./data/shop1.yaml"))
+        self.offers = list(ProductInfo.objects.order_by("id"))
+
+        self.user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_basket(self, offers, quantity=1):
+        return self.client.post(
+            "/api/v1/basket",
+            {
+                "items": [
+                    {"product_info": offer.id, "quantity": quantity} for offer in offers
+                ]
+            },
+            format="json",
+        )
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        self.post_basket(self.offers[:1])
+
+        with self.assertNumQueries(7):
+            self.post_basket(self.offers[:1])
+        with self.assertNumQueries(7):
+            response = self.post_basket(self.offers)
+
+        self.assertEqual(response.status_code, 200)
+        basket = Order.objects.get(user=self.user, status="basket")
+        self.assertEqual(
+            dict(basket.ordered_items.values_list("product_info_id", "quantity")),
+            {offer.id: 1 for offer in self.offers},
+        )
+
+    def test_update_replaces_items(self):
+        self.post_basket(self.offers[:3])
+        item = Order.objects.get(user=self.user).ordered_items.get(
+            product_info=self.offers[1]
+        )
+
+        self.post_basket(self.offers[1:2], quantity=2)
+
+        basket = Order.objects.get(user=self.user, status="basket")
+        self.assertEqual(
+            list(basket.ordered_items.values_list("id", "quantity")), [(item.id, 2)]
+        )
+        self.assertEqual(basket.item_count, 2)
+
+    def test_duplicates_are_merged(self):
+        response = self.client.post(
+            "/api/v1/basket",
+            {
+                "items": [
+                    {"product_info": self.offers[0].id, "quantity": 1},
+                    {"product_info": self.offers[0].id, "quantity": 2},
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        basket = Order.objects.get(user=self.user, status="basket")
+        self.assertEqual(basket.ordered_items.get().quantity, 3)
+
+    def test_validation(self):
+        missing = ProductInfo.objects.order_by("-id").first().id + 1
+
+        self.assertEqual(self.post_basket([ProductInfo(id=missing)]).status_code, 400)
+        self.assertEqual(self.post_basket(self.offers[:1], quantity=0).status_code, 400)
+        self.assertEqual(
+            self.post_basket(
+                self.offers[:1], quantity=self.offers[0].quantity + 1
+            ).status_code,
+            400,
+        )
+
+
+@mock.patch("backend.views.new_order_signal_admin")
+@mock.patch("backend.views.new_order_signal_user")
+class StockReservationTest(TestCase):
+    def setUp(self):
+        shop_user = User.objects.create_user(
+            email="shop@mail.ru", password="pass", type="shop"
+        )
+        shop = Shop.objects.create(name="", user=shop_user)
+        PriceListImporter(shop).run(load_price_list("./data/shop1.yaml"))
+        self.offer = ProductInfo.objects.order_by("id").first()
+
+        self.user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.contact = Contact.objects.create(
+            user=self.user, city="Москва", street="Тверская", house="1", phone="1"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shop_client = APIClient()
+        self.shop_client.force_authenticate(shop_user)
+
+    def create_basket(self, quantity, user=None):
+        basket = Order.objects.create(user=user or self.user, status="basket")
+        basket.ordered_items.create(product_info=self.offer, quantity=quantity)
+        return basket
+
+    def confirm(self, basket):
+        return self.client.post(
+            "/api/v1/order/confirm",
+            {"id": basket.id, "contact_id": self.contact.id},
+            format="json",
+        )
+
+    def test_confirmation_reserves_stock(self, *mocks):
+        response = self.confirm(self.create_basket(3))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            ProductInfo.objects.get(id=self.offer.id).quantity,
+            self.offer.quantity - 3,
+        )
+
+    def test_insufficient_stock(self, *mocks):
+        first = self.create_basket(self.offer.quantity)
+        # у пользователя одна корзина
+        second = self.create_basket(
+            1, User.objects.create_user(email="other@mail.ru", password="pass")
+        )
+
+        self.assertEqual(self.confirm(first).status_code, 201)
+        with self.assertRaises(InsufficientStock) as error:
+            place_order(second, self.contact)
+
+        self.assertEqual(error.exception.product_info_ids, [self.offer.id])
+        self.assertEqual(Order.objects.get(id=second.id).status, "basket")
+        self.assertEqual(ProductInfo.objects.get(id=self.offer.id).quantity, 0)
+
+    def test_repeated_confirmation(self, *mocks):
+        basket = self.create_basket(1)
+        place_order(basket, self.contact)
+
+        with self.assertRaises(OrderStatusConflict):
+            place_order(basket, self.contact)
+        self.assertEqual(
+            ProductInfo.objects.get(id=self.offer.id).quantity,
+            self.offer.quantity - 1,
+        )
+
+    def test_cancel_releases_stock(self, *mocks):
+        basket = self.create_basket(2)
+        place_order(basket, self.contact)
+
+        response = self.shop_client.post(
+            "/api/v1/partner/orders",
+            {"order_id": basket.id, "status": "canceled"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get(id=basket.id).status, "canceled")
+        self.assertEqual(
+            ProductInfo.objects.get(id=self.offer.id).quantity, self.offer.quantity
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "нужны строковые блокировки")
+class ConcurrentReservationTest(TransactionTestCase):
+    def test_hot_offer_is_not_oversold(self):
+        shop_user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        shop = Shop.objects.create(name="", user=shop_user)
+        PriceListImporter(shop).run(load_price_list("./data/shop1.yaml"))
+        offer = ProductInfo.objects.order_by("id").first()
+        baskets = []
+        for number in range(offer.quantity * 2):
+            user = User.objects.create_user(email=f"buyer{number}@mail.ru")
+            contact = Contact.objects.create(
+                user=user, city="Москва", street="Тверская", house="1", phone="1"
+            )
+            basket = Order.objects.create(user=user, status="basket")
+            basket.ordered_items.create(product_info=offer, quantity=1)
+            baskets.append((basket, contact))
+
+        placed = []
+
+        def confirm(basket, contact):
+            try:
+                place_order(basket, contact)
+                placed.append(basket.id)
+            except InsufficientStock:
+                pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=confirm, args=args) for args in baskets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(placed), offer.quantity)
+        self.assertEqual(ProductInfo.objects.get(id=offer.id).quantity, 0)
+
+
+@override_settings(PARTNER_ORDERS_FEED_LAG=0)
+class PartnerOrderFeedTest(TestCase):
+    def setUp(self):
+        self.shops = []
+        for number in (1, 2):
+            user = User.objects.create_user(
+                email=f"shop{number}@mail.ru", password="pass", type="shop"
+            )
+            shop = Shop.objects.create(name=f"shop{number}", user=user)
+            PriceListImporter(shop).run(load_price_list(f"./data/shop{number}.yaml"))
+            self.shops.append(shop)
+        offers = [ProductInfo.objects.filter(shop=shop).first() for shop in self.shops]
+
+        buyer = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.mixed = Order.objects.create(user=buyer, status="new")
+        self.mixed.ordered_items.create(product_info=offers[0], quantity=1)
+        self.mixed.ordered_items.create(product_info=offers[1], quantity=1)
+        self.other = Order.objects.create(user=buyer, status="new")
+        self.other.ordered_items.create(product_info=offers[1], quantity=1)
+        basket = Order.objects.create(user=buyer, status="basket")
+        basket.ordered_items.create(product_info=offers[0], quantity=1)
+        self.offer = offers[0]
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.shops[0].user)
+
+    def test_feed_is_scoped_to_shop(self):
+        response = self.client.get("/api/v1/partner/orders")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [order["id"] for order in response.data["results"]], [self.mixed.id]
+        )
+        self.assertEqual(
+            [
+                item["product_info"]
+                for item in response.data["results"][0]["ordered_items"]
+            ],
+            [self.offer.id],
+        )
+
+    def test_feed_totals_are_scoped_to_shop(self):
+        self.mixed.ordered_items.filter(product_info=self.offer).update(quantity=2)
+        Order.objects.filter(id=self.mixed.id).refresh_totals()
+
+        (order,) = self.client.get("/api/v1/partner/orders").data["results"]
+
+        self.assertEqual(order["item_count"], 2)
+        self.assertEqual(order["total_sum"], self.offer.price * 2)
+        self.assertEqual(Order.objects.get(id=self.mixed.id).item_count, 3)
+
+    def test_since_returns_only_changes(self):
+        own = Order.objects.create(user=self.mixed.user, status="new")
+        own.ordered_items.create(product_info=self.offer, quantity=1)
+        since = self.client.get("/api/v1/partner/orders").data["since"]
+
+        response = self.client.get("/api/v1/partner/orders", {"since": since})
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(response.data["since"], since)
+
+        response = self.client.post(
+            "/api/v1/partner/orders",
+            {"order_id": own.id, "status": "confirmed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/api/v1/partner/orders", {"since": since})
+        self.assertEqual([order["id"] for order in response.data["results"]], [own.id])
+        self.assertEqual(response.data["results"][0]["status"], "confirmed")
+        self.assertNotEqual(response.data["since"], since)
+
+    def test_shared_order_status_is_not_changed(self):
+        response = self.client.post(
+            "/api/v1/partner/orders",
+            {"order_id": self.mixed.id, "status": "canceled"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(id=self.mixed.id).status, "new")
+
+    def test_admin_changes_shared_order(self):
+        client = Client()
+        client.force_login(
+            User.objects.create_superuser(email="admin@mail.ru", password="pass")
+        )
+        offers = list(
+            ProductInfo.objects.filter(ordered_items__order=self.mixed).order_by("id")
+        )
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(
+            connection
+        ) as queries:
+            response = client.post(
+                "/admin/backend/order/",
+                {"action": "set_status_canceled", "_selected_action": [self.mixed.id]},
+            )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get(id=self.mixed.id).status, "canceled")
+        # товар обоих магазинов возвращен на склад одним UPDATE
+        self.assertEqual(
+            sum(
+                query["sql"].startswith('UPDATE "backend_productinfo"')
+                for query in queries
+            ),
+            1,
+        )
+        for offer in offers:
+            self.assertEqual(
+                ProductInfo.objects.get(id=offer.id).quantity, offer.quantity + 1
+            )
+
+    def test_invalid_since(self):
+        for position in (
+            ["zzz", 1],
+            ["2024-13-01T00:00:00+00:00", 1],
+            ["2024-01-01T00:00:00", 1],
+            [1, 1],
+        ):
+            since = urlsafe_b64encode(ujson.dumps(position).encode()).decode()
+            response = self.client.get("/api/v1/partner/orders", {"since": since})
+
+            self.assertEqual(response.status_code, 404, position)
+
+    def test_empty_poll_is_one_query(self):
+        since = self.client.get("/api/v1/partner/orders").data["since"]
+
+        with self.assertNumQueries(1):
+            self.client.get("/api/v1/partner/orders", {"since": since})
+
+
+class PartnerOrdersStatusTest(TestCase):
+    def setUp(self):
+        shop_user = User.objects.create_user(
+            email="shop@mail.ru", password="pass", type="shop"
+        )
+        shop = Shop.objects.create(name="", user=shop_user)
+        PriceListImporter(shop).run(load_price_list("./data/shop1.yaml"))
+        self.offer = ProductInfo.objects.order_by("id").first()
+
+        buyer = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        self.orders = {}
+        for order_status in ("new", "new", "confirmed", "sent"):
+            order = Order.objects.create(user=buyer, status=order_status)
+            order.ordered_items.create(product_info=self.offer, quantity=2)
+            self.orders.setdefault(order_status, []).append(order)
+        other_user = User.objects.create_user(
+            email="other@mail.ru", password="pass", type="shop"
+        )
+        other_shop = Shop.objects.create(name="other", user=other_user)
+        PriceListImporter(other_shop).run(load_price_list("./data/shop2.yaml"))
+        self.foreign = Order.objects.create(user=buyer, status="new")
+        self.foreign.ordered_items.create(
+            product_info=ProductInfo.objects.filter(shop=other_shop).first(),
+            quantity=1,
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(shop_user)
+
+    def change(self, changes):
+        return self.client.post(
+            "/api/v1/partner/orders/status",
+            {
+                "orders": [
+                    {"order_id": order.id, "status": order_status}
+                    for order, order_status in changes
+                ]
+            },
+            format="json",
+        )
+
+    def test_bulk_transitions(self):
+        first, second = self.orders["new"]
+        confirmed = self.orders["confirmed"][0]
+        sent = self.orders["sent"][0]
+
+        response = self.change(
+            [
+                (first, "confirmed"),
+                (second, "canceled"),
+                (confirmed, "assembled"),
+                (sent, "new"),
+                (self.foreign, "confirmed"),
+                (first, "canceled"),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item["result"], item["status"]) for item in response.data["Results"]],
+            [
+                ("success", "confirmed"),
+                ("success", "canceled"),
+                ("success", "assembled"),
+                ("failure", "sent"),
+                ("failure", None),
+                ("failure", "new"),
+            ],
+        )
+        self.assertEqual(
+            dict(
+                Order.objects.filter(
+                    id__in=[first.id, second.id, confirmed.id, sent.id, self.foreign.id]
+                ).values_list("id", "status")
+            ),
+            {
+                first.id: "confirmed",
+                second.id: "canceled",
+                confirmed.id: "assembled",
+                sent.id: "sent",
+                self.foreign.id: "new",
+            },
+        )
+        # товар отмененного заказа вернулся на склад
+        self.assertEqual(
+            ProductInfo.objects.get(id=self.offer.id).quantity,
+            self.offer.quantity + 2,
+        )
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        orders = [
+            Order.objects.create(user=self.foreign.user, status="new")
+            for _ in range(20)
+        ]
+        for order in orders:
+            order.ordered_items.create(product_info=self.offer, quantity=1)
+
+        with self.assertNumQueries(4):
+            self.change([(order, "confirmed") for order in orders[:2]])
+        with self.assertNumQueries(4):
+            response = self.change([(order, "confirmed") for order in orders[2:]])
+
+        self.assertTrue(
+            all(item["result"] == "success" for item in response.data["Results"])
+        )
+
+    def test_single_transition_is_validated(self):
+        response = self.client.post(
+            "/api/v1/partner/orders",
+            {"order_id": self.orders["sent"][0].id, "status": "new"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            "/api/v1/partner/orders",
+            {"order_id": self.foreign.id, "status": "confirmed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,114 @@
+from unittest import mock
+
+import yaml
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from backend.importer import PriceListImporter
+from backend.models import Contact, Order, OutboxEvent, ProductInfo, Shop, User
+from backend.outbox import add_outbox_event, relay_outbox
+
+
+@mock.patch("backend.outbox.queue_admin_notification")
+@mock.patch("backend.outbox.queue_mail")
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_registration_mail_is_sent_by_relay(self, queue_mail, *mocks):
+        response = self.client.post(
+            "/api/v1/user/register",
+            {
+                "first_name": "Иван",
+                "last_name": "Иванов",
+                "email": "buyer@mail.ru",
+                "company": "",
+                "position": "",
+                "password": "Strong-pass-123",
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list("kind", "payload")),
+            [("user_registered_mail", {"email": "buyer@mail.ru"})],
+        )
+        queue_mail.assert_not_called()
+
+        self.assertEqual(relay_outbox(), 1)
+
+        queue_mail.assert_called_once_with("registration", ["buyer@mail.ru"])
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertEqual(relay_outbox(), 0)
+
+    def test_rolled_back_event_is_not_sent(self, queue_mail, *mocks):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            add_outbox_event("user_registered_mail", email="buyer@mail.ru")
+            raise RuntimeError
+
+        self.assertEqual(relay_outbox(), 0)
+        queue_mail.assert_not_called()
+
+    def test_order_confirm_writes_events(self, queue_mail, queue_admin_notification):
+        shop = Shop.objects.create(
+            name="", user=User.objects.create_user(email="shop@mail.ru", password="p")
+        )
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            PriceListImporter(shop).run(yaml.safe_load(updatefile))
+        user = User.objects.create_user(email="buyer@mail.ru", password="pass")
+        contact = Contact.objects.create(
+            user=user, city="Москва", street="Тверская", house="1", phone="1"
+        )
+        basket = Order.objects.create(user=user, status="basket")
+        basket.replace_items({ProductInfo.objects.first().id: 1})
+        self.client.force_authenticate(user)
+
+        response = self.client.post(
+            "/api/v1/order/confirm",
+            {"id": basket.id, "contact_id": contact.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(relay_outbox(batch_size=1), 2)
+        queue_mail.assert_called_once_with(
+            "new_order", ["buyer@mail.ru"], {"order_id": basket.id}
+        )
+        queue_admin_notification.assert_called_once_with(basket.id)
+
+    def test_failed_event_does_not_repeat_others(self, queue_mail, *mocks):
+        add_outbox_event("user_registered_mail", email="first@mail.ru")
+        add_outbox_event("user_registered_mail", email="second@mail.ru")
+        add_outbox_event("user_registered_mail", email="third@mail.ru")
+        queue_mail.side_effect = [None, RuntimeError("smtp"), None]
+
+        self.assertEqual(relay_outbox(batch_size=2), 2)
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.payload, {"email": "second@mail.ru"})
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("smtp", event.last_error)
+        self.assertIsNone(event.failed_at)
+
+        queue_mail.side_effect = None
+        self.assertEqual(relay_outbox(), 1)
+        self.assertEqual(queue_mail.call_count, 4)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_poison_event_is_put_aside(self, queue_mail, *mocks):
+        add_outbox_event("user_registered_mail", email="first@mail.ru")
+        queue_mail.side_effect = RuntimeError
+
+        for _ in range(3):
+            self.assertEqual(relay_outbox(), 0)
+
+        self.assertEqual(queue_mail.call_count, 2)
+        self.assertIsNotNone(OutboxEvent.objects.get().failed_at)
+
+        queue_mail.side_effect = None
+        add_outbox_event("user_registered_mail", email="second@mail.ru")
+        self.assertEqual(relay_outbox(), 1)
+        queue_mail.assert_called_with("registration", ["second@mail.ru"])
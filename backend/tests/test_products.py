@@ -0,0 +1,170 @@
+from base64 import urlsafe_b64encode
+
+import ujson
+import yaml
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend.importer import PriceListImporter
+from backend.models import ProductInfo, Shop, User
+
+
+def import_price_list(email, path):
+    user = User.objects.create_user(email=email, password="pass")
+    shop = Shop.objects.create(name=email, user=user)
+    with open(path, "r", encoding="utf-8") as updatefile:
+        PriceListImporter(shop).run(yaml.safe_load(updatefile))
+    return shop
+
+
+class ProductInfoViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop_1 = import_price_list("shop1@mail.ru", "./data/shop1.yaml")
+        self.shop_2 = import_price_list("shop2@mail.ru", "./data/shop2.yaml")
+
+    def fetch_all(self, **params):
+        response = self.client.get("/api/v1/products", {"page_size": 2, **params})
+        results = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.data["results"])
+            if response.data["next"] is None:
+                return results
+            response = self.client.get(response.data["next"])
+
+    def test_pages_cover_catalog_in_order(self):
+        results = self.fetch_all(ordering="price")
+
+        expected = list(
+            ProductInfo.objects.order_by("price", "id").values_list("id", flat=True)
+        )
+        self.assertEqual([item["id"] for item in results], expected)
+
+    def test_descending_price(self):
+        results = self.fetch_all(ordering="-price")
+
+        expected = list(
+            ProductInfo.objects.order_by("-price", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual([item["id"] for item in results], expected)
+
+    def test_filters(self):
+        ProductInfo.objects.filter(shop=self.shop_2).update(quantity=0)
+        self.shop_1.status = False
+        self.shop_1.save()
+
+        self.assertEqual(self.fetch_all(in_stock=True), [])
+
+        results = self.fetch_all(
+            shop_id=self.shop_2.id, price_min=10000, price_max=60000
+        )
+        expected = ProductInfo.objects.filter(
+            shop=self.shop_2, price__gte=10000, price__lte=60000
+        )
+        self.assertEqual(
+            {item["id"] for item in results}, set(expected.values_list("id", flat=True))
+        )
+
+    def test_parameter_filters(self):
+        results = self.fetch_all(
+            param=["Встроенная память (Гб):eq:256", "Диагональ (дюйм):gte:6"]
+        )
+
+        expected = ProductInfo.objects.filter(
+            product_parameters__parameter__name_parameter="Встроенная память (Гб)",
+            product_parameters__value="256",
+        ).filter(
+            product_parameters__parameter__name_parameter="Диагональ (дюйм)",
+            product_parameters__numeric_value__gte=6,
+        )
+        self.assertTrue(expected.exists())
+        self.assertEqual(
+            {item["id"] for item in results}, set(expected.values_list("id", flat=True))
+        )
+
+        results = self.fetch_all(param="Цвет:eq:красный")
+        self.assertEqual(
+            {item["id"] for item in results},
+            set(
+                ProductInfo.objects.filter(
+                    product_parameters__value="красный"
+                ).values_list("id", flat=True)
+            ),
+        )
+        self.assertEqual(self.fetch_all(param="Нет такого:eq:1"), [])
+
+    def test_invalid_parameter_filter(self):
+        for param in ("Цвет", "Цвет:like:красный", "Цвет:gt:красный"):
+            response = self.client.get("/api/v1/products", {"param": param})
+
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/v1/products", {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_filter(self):
+        response = self.client.get("/api/v1/products", {"price_min": "cheap"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_with_wrong_value_type(self):
+        for position in (["abc"], [{"a": 1}], [None], [True], [2**64]):
+            cursor = urlsafe_b64encode(ujson.dumps(position).encode()).decode()
+            response = self.client.get("/api/v1/products", {"cursor": cursor})
+
+            self.assertEqual(response.status_code, 404, position)
+
+    def test_out_of_range_id_filter(self):
+        for params in (
+            {"shop_id": "99999999999999999999"},
+            {"category_id": "0"},
+            {"price_max": "99999999999999999999"},
+        ):
+            response = self.client.get("/api/v1/products", params)
+
+            self.assertEqual(response.status_code, 400, params)
+
+
+class ProductSearchViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop_1 = import_price_list("shop1@mail.ru", "./data/shop1.yaml")
+        self.shop_2 = import_price_list("shop2@mail.ru", "./data/shop2.yaml")
+
+    def test_search_with_facets(self):
+        response = self.client.get("/api/v1/products/search", {"q": "iPhone"})
+
+        self.assertEqual(response.status_code, 200)
+        expected = ProductInfo.objects.filter(product__name__contains="iPhone")
+        self.assertEqual(response.data["count"], expected.count())
+        self.assertEqual(
+            {item["id"] for item in response.data["results"]},
+            set(expected.values_list("id", flat=True)),
+        )
+        categories = response.data["facets"]["categories"]
+        self.assertEqual(sum(item["count"] for item in categories), expected.count())
+        self.assertEqual(
+            {item["id"] for item in response.data["facets"]["shops"]},
+            set(expected.values_list("shop_id", flat=True)),
+        )
+        for parameter in response.data["facets"]["parameters"]:
+            self.assertLessEqual(
+                sum(value["count"] for value in parameter["values"]), expected.count()
+            )
+
+    def test_limit_and_offset(self):
+        response = self.client.get(
+            "/api/v1/products/search", {"q": "iPhone", "limit": 1, "offset": 1}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertGreater(response.data["count"], 1)
+
+    def test_query_is_required(self):
+        response = self.client.get("/api/v1/products/search")
+
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.importer import PriceListImporter
+from backend.models import ProductInfo, ProductParameter, Shop, User
+from backend.sharded_import import (
+    commit_price_list_import,
+    parse_price_list_chunk,
+    split_price_list,
+)
+
+
+class ShardedImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="shop@mail.ru", password="pass")
+        self.shop = Shop.objects.create(name="", user=self.user)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        with open("./data/shop1.yaml", "r", encoding="utf-8") as updatefile:
+            self.data = yaml.safe_load(updatefile)
+
+    def split(self, chunk_size):
+        with open("./data/shop1.yaml", "rb") as updatefile:
+            return split_price_list(updatefile, self.directory, chunk_size)
+
+    def test_split_price_list(self):
+        header, chunks = self.split(chunk_size=2)
+
+        goods = self.data["goods"]
+        self.assertEqual(len(chunks), (len(goods) + 1) // 2)
+        with open(header, "rb") as header_file:
+            self.assertEqual(
+                yaml.safe_load(header_file),
+                {"shop": self.data["shop"], "categories": self.data["categories"]},
+            )
+        parsed = []
+        for path in chunks:
+            with open(path, "rb") as chunk:
+                parsed.extend(yaml.safe_load(chunk)["goods"])
+        self.assertEqual(parsed, goods)
+
+    def test_flow_style_goods_are_not_split(self):
+        path = os.path.join(self.directory, "flow.yaml")
+        with open(path, "w", encoding="utf-8") as updatefile:
+            yaml.safe_dump(self.data, updatefile, default_flow_style=True)
+        with open(path, "rb") as updatefile:
+            header, chunks = split_price_list(
+                updatefile, os.path.join(self.directory, "parts"), 2
+            )
+
+        self.assertEqual(chunks, [])
+        with open(header, "rb") as header_file:
+            self.assertEqual(yaml.safe_load(header_file), self.data)
+
+    def test_sharded_import_matches_single_import(self):
+        started = time.time()
+        header, chunks = self.split(chunk_size=2)
+        parsed = [parse_price_list_chunk(path) for path in chunks]
+        result = commit_price_list_import(self.shop, header, parsed, started)
+
+        self.assertEqual(result["rows"], len(self.data["goods"]))
+        self.assertEqual(result["created"], len(self.data["goods"]))
+        self.assertEqual(self.shop.name, self.data["shop"])
+        sharded = set(
+            ProductParameter.objects.values_list(
+                "product_info__external_id", "parameter__name_parameter", "value"
+            )
+        )
+
+        PriceListImporter(self.shop).run(self.data)
+
+        self.assertEqual(
+            ProductInfo.objects.filter(shop=self.shop).count(), len(self.data["goods"])
+        )
+        self.assertEqual(
+            set(
+                ProductParameter.objects.values_list(
+                    "product_info__external_id", "parameter__name_parameter", "value"
+                )
+            ),
+            sharded,
+        )
+
+    def test_dimensions_are_resolved_once(self):
+        header, chunks = self.split(chunk_size=2)
+        parsed = [parse_price_list_chunk(path) for path in chunks]
+
+        with CaptureQueriesContext(connection) as queries:
+            commit_price_list_import(
+                self.shop, header, parsed, time.time(), batch_size=2
+            )
+
+        sql = [query["sql"] for query in queries]
+        first_write = next(
+            number
+            for number, statement in enumerate(sql)
+            if statement.startswith('INSERT INTO "backend_productinfo"')
+        )
+        prefixes = (
+            'SELECT "backend_product"."name"',
+            'INSERT INTO "backend_product"',
+            'SELECT "backend_parameter"."name_parameter"',
+            'INSERT INTO "backend_parameter"',
+        )
+        self.assertTrue(
+            any(statement.startswith(prefixes) for statement in sql[:first_write])
+        )
+        # пачки позиций берут id товаров и параметров без запросов
+        self.assertFalse(
+            any(statement.startswith(prefixes) for statement in sql[first_write:])
+        )
+
+    def test_commit_deletes_offers_missing_from_all_chunks(self):
+        PriceListImporter(self.shop).run(self.data)
+        removed = self.data["goods"].pop()["id"]
+        path = os.path.join(self.directory, "feed.yaml")
+        with open(path, "w", encoding="utf-8") as updatefile:
+            yaml.safe_dump(self.data, updatefile, allow_unicode=True)
+        with open(path, "rb") as updatefile:
+            header, chunks = split_price_list(
+                updatefile, os.path.join(self.directory, "parts"), 2
+            )
+        parsed = [parse_price_list_chunk(chunk) for chunk in chunks]
+
+        result = commit_price_list_import(self.shop, header, parsed, time.time())
+
+        self.assertEqual(result["deleted"], 1)
+        self.assertFalse(ProductInfo.objects.filter(external_id=removed).exists())
+
+    def test_failed_commit_keeps_catalog(self):
+        PriceListImporter(self.shop).run(self.data)
+        ids = set(ProductInfo.objects.values_list("id", flat=True))
+        header, chunks = self.split(chunk_size=2)
+        parsed = [parse_price_list_chunk(path) for path in chunks]
+        # последняя часть потерялась после разбора
+        os.remove(parsed[-1]["path"])
+
+        with self.assertRaises(FileNotFoundError):
+            commit_price_list_import(
+                self.shop, header, parsed, time.time(), mode="replace"
+            )
+
+        self.assertEqual(set(ProductInfo.objects.values_list("id", flat=True)), ids)
@@ -1,15 +1,11 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
-from backend.models import User
-import django
-from django.conf import settings
 
-django.setup()
-settings.configure()
+from backend.models import OutboxEvent, User
 
 
 class NewUserRegistrationTest(TestCase):
-    def setup(self):
+    def setUp(self):
         self.client = APIClient()
 
     def test_user_registration(self):
@@ -21,7 +17,7 @@ class NewUserRegistrationTest(TestCase):
             "position": "K",
             "password": "admin123admin",
         }
-        response = self.client.post("/user/register", data)
+        response = self.client.post("/api/v1/user/register", data)
 
         self.assertEqual(response.status_code, 201)
 
@@ -32,26 +28,32 @@ class NewUserRegistrationTest(TestCase):
         self.assertEqual(user.email, "petr@mail.ru")
         self.assertEqual(user.company, "D")
         self.assertEqual(user.position, "K")
-        self.assertEqual(user.password, "admin123admin")
-
-    def login_success_test(self):
+        self.assertTrue(user.check_password("admin123admin"))
+        self.assertTrue(
+            OutboxEvent.objects.filter(
+                kind="user_registered_mail", payload={"email": "petr@mail.ru"}
+            ).exists()
+        )
+
+    def test_login_success(self):
         data = {"email": "petr@mail.ru", "password": "admin123admin"}
-        user = User.objects.create_user(**data)
-        response = self.client.post("user/login", data)
+        User.objects.create_user(**data)
+        response = self.client.post("/api/v1/user/login", data)
         self.assertEqual(response.status_code, 200)
         self.assertIn("Token", response.data)
         self.assertEqual(response.data["Status"], "Success")
 
-    def login_failed_test(self):
-        data = {"email": "pppppetr@mail.ru", "password": "aaaadmin123admin"}
-        user = User.objects.create_user(**data)
-        response = self.client.post("user/login", data)
+    def test_login_failed(self):
+        User.objects.create_user(email="petr@mail.ru", password="admin123admin")
+        data = {"email": "petr@mail.ru", "password": "aaaadmin123admin"}
+        response = self.client.post("/api/v1/user/login", data)
         self.assertEqual(response.status_code, 401)
 
-    def login_failed_clear_field_test(self):
+    def test_login_failed_clear_field(self):
         data = {
             "email": "pppppetr@mail.ru",
         }
-        user = User.objects.create_user(**data)
-        response = self.client.post("user/login", data)
-        self.assertEqual(response.status_code, 400)
+        User.objects.create_user(**data)
+        response = self.client.post("/api/v1/user/login", data)
+        # LoginAccountView отвечает 401 на любые неверные данные входа
+        self.assertEqual(response.status_code, 401)
@@ -9,10 +9,15 @@ from backend.views import (
     NewUserRegistrationView,
     OrderView,
     OrderConfirmView,
+    OrderEventsView,
+    PartnerExportView,
+    PartnerOrdersStatusView,
     PartnerOrdersView,
     PartnerUpdateFileView,
+    PartnerUpdateStatusView,
     PartnerUpdateUrlView,
     ProductInfoView,
+    ProductSearchView,
     ShopView,
 )
 
@@ -26,15 +31,28 @@ urlpatterns = [
     path(
         "partner/update/url", PartnerUpdateUrlView.as_view(), name="partner-update-url"
     ),
+    path(
+        "partner/update/status/<str:job_id>",
+        PartnerUpdateStatusView.as_view(),
+        name="partner-update-status",
+    ),
+    path("partner/export", PartnerExportView.as_view(), name="partner-export"),
     path("partner/orders", PartnerOrdersView.as_view(), name="partner-orders"),
+    path(
+        "partner/orders/status",
+        PartnerOrdersStatusView.as_view(),
+        name="partner-orders-status",
+    ),
     path("user/register", NewUserRegistrationView.as_view(), name="user-register"),
     path("user/details", AccountDetailsView.as_view(), name="user-details"),
     path("user/contact", ContactView.as_view(), name="user-contact"),
     path("user/login", LoginAccountView.as_view(), name="user-login"),
     path("categories", CategoryView.as_view(), name="categories"),
     path("shops", ShopView.as_view(), name="shops"),
-    path("products", ProductInfoView.as_view(), name="shops"),
+    path("products", ProductInfoView.as_view(), name="products"),
+    path("products/search", ProductSearchView.as_view(), name="product-search"),
     path("basket", BasketView.as_view(), name="basket"),
     path("order", OrderView.as_view(), name="order"),
     path("order/confirm", OrderConfirmView.as_view(), name="order_confirm"),
+    path("order/events", OrderEventsView.as_view(), name="order-events"),
 ]
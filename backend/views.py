@@ -1,15 +1,15 @@
 from distutils.util import strtobool
 import os
-import yaml
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from django.db.models import F, Q, Sum
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from requests import get
+from redis.exceptions import RedisError
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView, RetrieveUpdateAPIView, GenericAPIView
@@ -18,9 +18,32 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from ujson import loads as load_json
-from yaml import Loader
-from yaml import load as load_yaml
 
+from netology_pd_diplom.celery import get_result
+
+from backend.basket import get_basket
+from backend.cache import (
+    category_scope,
+    get_cached_response,
+    set_cached_response,
+    shop_scope,
+)
+from backend.events import notify_orders_changed, read_order_events
+from backend.export import EXPORT_CONTENT_TYPES, iter_export
+from backend.fast_serializers import (
+    PRODUCT_INFO_VALUES,
+    serialize_orders,
+    serialize_product_infos,
+)
+from backend.metrics import SerializationMetricsMixin, measure_serialization
+from backend.pagination import KeysetPagination, OrderFeedPagination
+from backend.search import search_facets, search_product_infos
+from backend.stock import (
+    InsufficientStock,
+    OrderStatusConflict,
+    change_order_statuses,
+    place_order,
+)
 from backend.permissions import Owner, IsShop
 from backend.models import (
     Category,
@@ -28,7 +51,7 @@ from backend.models import (
     Order,
     OrderItem,
     Parameter,
-    Product,
+    PriceImportJob,
     ProductInfo,
     ProductParameter,
     Shop,
@@ -42,11 +65,18 @@ from backend.serializers import (
     NewUserRegistrationSerializer,
     OrderConfirmSerializer,
     OrderItemSerializer,
+    OrderEventsSerializer,
     OrderSerializer,
+    OrderStatusChangeListSerializer,
+    OrderStatusChangeSerializer,
+    PartnerExportSerializer,
+    PartnerOrderSerializer,
     PartnerUpdateSerializer,
-    ProductInfoSerializer,
+    ProductFilterSerializer,
+    ProductSearchSerializer,
     ShopSerializer,
 )
+from backend.tasks import queue_price_list_import
 from backend.signals import (
     new_order,
     new_order_signal_user,
@@ -67,8 +97,10 @@ class NewUserRegistrationView(APIView):
     def post(self, request, *args, **Kwargs):
         serializer = NewUserRegistrationSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            new_user_registered_signal_mail(user)
+            # письмо уйдет только если пользователь записан
+            with transaction.atomic():
+                user = serializer.save()
+                new_user_registered_signal_mail(user)
             response = {
                 "status": "Success",
                 "message": "Учетная запись создана, на почту отправлено оповещение о регистрации",
@@ -89,7 +121,9 @@ class AccountDetailsView(APIView):
     def get(self, request):
         user = request.user
         serializer = AccountDetailsSerializer(instance=user)
-        return Response(serializer.data)
+        with measure_serialization(request):
+            data = serializer.data
+        return Response(data)
 
     def patch(self, request):
         user = request.user
@@ -97,7 +131,9 @@ class AccountDetailsView(APIView):
         serializer = AccountDetailsSerializer(instance=user, data=data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            with measure_serialization(request):
+                data = serializer.data
+            return Response(data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -119,7 +155,7 @@ class LoginAccountView(APIView):
         return Response(serializer.errors, status=status.HTTP_401_UNAUTHORIZED)
 
 
-class CategoryView(ListAPIView):
+class CategoryView(SerializationMetricsMixin, ListAPIView):
     """
     Класс для просмотра категорий
     """
@@ -127,8 +163,15 @@ class CategoryView(ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        key, data = get_cached_response("categories", request, ["categories"])
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            set_cached_response(key, data)
+        return Response(data)
 
-class ShopView(ListAPIView):
+
+class ShopView(SerializationMetricsMixin, ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
@@ -136,30 +179,119 @@ class ShopView(ListAPIView):
     queryset = Shop.objects.filter(status=True)
     serializer_class = ShopSerializer
 
+    def list(self, request, *args, **kwargs):
+        key, data = get_cached_response("shops", request, ["shops"])
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            set_cached_response(key, data)
+        return Response(data)
+
 
 class ProductInfoView(APIView):
     """
     Класс для поиска товаров
     """
 
+    pagination_class = KeysetPagination
+
     def get(self, request, *args, **kwargs):
+        filters = ProductFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+
+        if params.get("shop_id"):
+            scopes = [shop_scope(params["shop_id"])]
+        elif params.get("category_id"):
+            scopes = [category_scope(params["category_id"])]
+        else:
+            scopes = ["products"]
+        key, data = get_cached_response("products", request, scopes)
+        if data is not None:
+            return Response(data)
+
         query = Q(shop__status=True)
-        shop_id = request.query_params.get("shop_id")
-        category_id = request.query_params.get("category_id")
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
-        if category_id:
-            query = query & Q(product__category__id=category_id)
-        queryset = (
-            ProductInfo.objects.filter(query)
-            .select_related("shop", "product__category")
-            .prefetch_related("product_parameters__parameter")
-            .distinct()
+        if params.get("shop_id"):
+            query = query & Q(shop_id=params["shop_id"])
+        if params.get("category_id"):
+            query = query & Q(product__category_id=params["category_id"])
+        if params.get("price_min") is not None:
+            query = query & Q(price__gte=params["price_min"])
+        if params.get("price_max") is not None:
+            query = query & Q(price__lte=params["price_max"])
+        if params.get("in_stock"):
+            query = query & Q(quantity__gt=0)
+        if params.get("param"):
+            query = query & self.parameter_query(params["param"])
+        queryset = ProductInfo.objects.filter(query).values(*PRODUCT_INFO_VALUES)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+
+        with measure_serialization(request):
+            results = serialize_product_infos(page)
+        response = paginator.get_paginated_response(results)
+        set_cached_response(key, response.data)
+        return response
+
+    @staticmethod
+    def parameter_query(conditions):
+        """
+        условие на позиции по значениям параметров
+
+        Каждое условие - отдельный подзапрос по индексу (параметр, значение,
+        позиция), несколько условий база пересекает по этим индексам.
+        """
+        parameters = dict(
+            Parameter.objects.filter(
+                name_parameter__in={name for name, *_ in conditions}
+            ).values_list("name_parameter", "id")
+        )
+        query = Q()
+        for name, operator, value, number in conditions:
+            if name not in parameters:
+                return Q(pk__in=[])
+            if number is None:
+                lookup = {"value": value}
+            elif operator == "eq":
+                lookup = {"numeric_value": number}
+            else:
+                lookup = {f"numeric_value__{operator}": number}
+            query &= Q(
+                id__in=ProductParameter.objects.filter(
+                    parameter_id=parameters[name], **lookup
+                ).values("product_info_id")
+            )
+        return query
+
+
+class ProductSearchView(APIView):
+    """
+    Класс для полнотекстового поиска товаров с фасетами
+    """
+
+    def get(self, request, *args, **kwargs):
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        text, limit, offset = (
+            params.validated_data[key] for key in ("q", "limit", "offset")
         )
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        key, data = get_cached_response("search", request, ["products"])
+        if data is not None:
+            return Response(data)
 
-        return Response(serializer.data)
+        queryset = search_product_infos(text)
+        count, facets = search_facets(queryset)
+        page = (
+            list(queryset.values(*PRODUCT_INFO_VALUES)[offset : offset + limit])
+            if offset < count
+            else []
+        )
+        with measure_serialization(request):
+            results = serialize_product_infos(page)
+        data = {"count": count, "results": results, "facets": facets}
+        set_cached_response(key, data)
+        return Response(data)
 
 
 class BasketView(APIView):
@@ -172,32 +304,17 @@ class BasketView(APIView):
 
     # получить корзину
     def get(self, requset, *args, **kwargs):
-        basket = (
-            Order.objects.filter(user=self.request.user, status="basket")
-            .prefetch_related(
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
-            .annotate(
-                total_sum=Sum(
-                    F("ordered_items__quantity")
-                    * F("ordered_items__product_info__price")
-                )
-            )
-            .distinct()
-        )
-
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        with measure_serialization(self.request):
+            data = get_basket(self.request.user).data()
+        return Response(data, status=status.HTTP_200_OK)
 
     # добавить позиции в корзину
     def post(self, request, *args, **kwargs):
-        order, _ = Order.objects.get_or_create(user=self.request.user, status="basket")
-        serializer = OrderSerializer(
-            order, data=request.data, context={"request": request}
-        )
+        serializer = OrderSerializer(data=request.data, context={"request": request})
         if serializer.is_valid(raise_exception=True):
-            serializer.save()
+            get_basket(request.user).replace(
+                OrderSerializer.get_items(serializer.validated_data)
+            )
             return Response(
                 {"status": "success", "messasge": "Товар добавлен в корзину"},
                 status=status.HTTP_200_OK,
@@ -206,13 +323,11 @@ class BasketView(APIView):
 
     # удалить товары из корзины
     def delete(self, request):
-        order = Order.objects.filter(user=self.request.user, status="basket").first()
-        if order is None:
+        if not get_basket(request.user).clear():
             return Response(
                 {"status": "failure", "message": "Корзина уже пуста"},
                 status=status.HTTP_404_NOT_FOUND,
             )
-        order.delete()
         return Response(
             {"status": "success", "message": "Корзина очищена"},
             status=status.HTTP_404_NOT_FOUND,
@@ -223,7 +338,9 @@ class BasketView(APIView):
     def put(self, request, *args, **kwargs):
         serializer = OrderSerializer(data=request.data, context={"request": request})
         if serializer.is_valid(raise_exception=True):
-            serializer.save()
+            get_basket(request.user).replace(
+                OrderSerializer.get_items(serializer.validated_data)
+            )
             return Response(
                 {"status": "success", "message": "Корзина отредактирована"},
                 status=status.HTTP_200_OK,
@@ -239,60 +356,18 @@ class PartnerUpdateFileView(APIView):
     permission_classes = [IsAuthenticated, IsShop]
 
     def post(self, request, *args, **kwargs):
-        data_1 = "./data/shop1.yaml"
-        data_2 = "./data/shop2.yaml"
+        data_1 = os.path.join(settings.BASE_DIR, "data", "shop1.yaml")
+        data_2 = os.path.join(settings.BASE_DIR, "data", "shop2.yaml")
         data = [data_1, data_2]
-        for i in data:
-            with open(i, "r", encoding="utf-8") as updatefile:
-                try:
-                    data = yaml.safe_load(updatefile)
-                except yaml.YAMLError as yamlerror:
-                    print(yamlerror)
-                    return Response(
-                        {"Status": "Failure", "Message": "Ошибка загрузки файла"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-            shop, created = Shop.objects.get_or_create(user_id=request.user.id)
-            if created or shop.name != data["shop"]:
-                shop.name = data["shop"]
-                shop.save()
-
-            for category in data["categories"]:
-                category_object, _ = Category.objects.get_or_create(
-                    id=category["id"], name=category["name"]
-                )
-                category_object.shops.add(shop.id)
-                category_object.save()
-
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-            for item in data["goods"]:
-                product, _ = Product.objects.get_or_create(
-                    name=item["name"], category_id=item["category"]
-                )
-
-                product_info = ProductInfo.objects.create(
-                    product_id=product.id,
-                    external_id=item["id"],
-                    model=item["model"],
-                    price=item["price"],
-                    price_rrc=item["price_rrc"],
-                    quantity=item["quantity"],
-                    shop_id=shop.id,
-                )
-                for name, value in item["parameters"].items():
-                    parameter_object, _ = Parameter.objects.get_or_create(
-                        name_parameter=name
-                    )
-                    ProductParameter.objects.create(
-                        product_info_id=product_info.id,
-                        parameter_id=parameter_object.id,
-                        value=value,
-                    )
-
+        shop, _ = Shop.objects.get_or_create(user_id=request.user.id)
+        job_id = queue_price_list_import(shop, data)
         return Response(
-            {"Status": "Success", "Message": "Прайс обновлен"},
-            status=status.HTTP_200_OK,
+            {
+                "Status": "Success",
+                "Message": "Загрузка прайса запущена",
+                "JobId": job_id,
+            },
+            status=status.HTTP_202_ACCEPTED,
         )
 
 
@@ -309,57 +384,72 @@ class PartnerUpdateUrlView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         url = serializer.validated_data.get("url")
-        try:
-            stream = get("url").content
-            data = load_yaml(stream, Loader=Loader)
-        except yaml.YAMLError as yamlerror:
-            print(yamlerror)
+        shop, _ = Shop.objects.get_or_create(user_id=request.user.id)
+        job_id = queue_price_list_import(shop, [url])
+        return Response(
+            {
+                "Status": "Success",
+                "Message": "Загрузка прайса запущена",
+                "JobId": job_id,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class PartnerUpdateStatusView(APIView):
+    """
+    Класс для просмотра хода загрузки прайса
+    """
+
+    permission_classes = [IsAuthenticated, IsShop]
+
+    def get(self, request, job_id, *args, **kwargs):
+        # чужие и неизвестные задачи неотличимы для магазина
+        if not PriceImportJob.objects.filter(
+            job_id=job_id, shop__user_id=request.user.id
+        ).exists():
             return Response(
-                {"Status": "Failure", "Message": "Ошибка загрузки"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        shop, created = Shop.objects.get_or_create(user_id=request.user.id)
-        if created or shop.name != data["shop"]:
-            shop.name = data["shop"]
-            shop.save()
-
-        for category in data["categories"]:
-            category_object, _ = Category.objects.get_or_create(
-                id=category["id"], name=category["name"]
+                {"Status": "Failure", "Message": "Загрузка не найдена"},
+                status=status.HTTP_404_NOT_FOUND,
             )
-            category_object.shops.add(shop.id)
-            category_object.save()
+        result = get_result(job_id)
+        progress = result.info if isinstance(result.info, dict) else None
+        response = {"JobId": job_id, "State": result.state, "Progress": progress}
+        if result.failed():
+            response["Message"] = str(result.info)
+        return Response(response, status=status.HTTP_200_OK)
 
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
 
-        for item in data["goods"]:
-            product, _ = Product.objects.get_or_create(
-                name=item["name"], category_id=item["category"]
-            )
+class PartnerExportView(APIView):
+    """
+    Класс для потоковой выгрузки позиций магазина в NDJSON или CSV
+    """
 
-            product_info = ProductInfo.objects.create(
-                product_id=product.id,
-                external_id=item["id"],
-                model=item["model"],
-                price=item["price"],
-                price_rrc=item["price_rrc"],
-                quantity=item["quantity"],
-                shop_id=shop.id,
-            )
-            for name, value in item["parameters"].items():
-                parameter_object, _ = Parameter.objects.get_or_create(
-                    name_parameter=name
-                )
-                ProductParameter.objects.create(
-                    product_info_id=product_info.id,
-                    parameter_id=parameter_object.id,
-                    value=value,
-                )
+    permission_classes = [IsAuthenticated, IsShop]
 
-        return Response(
-            {"Status": "Success", "Message": "Прайс обновлен"},
-            status=status.HTTP_200_OK,
+    def get(self, request, *args, **kwargs):
+        serializer = PartnerExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        output = serializer.validated_data["output"]
+        shop = Shop.objects.filter(user_id=request.user.id).only("id").first()
+        if shop is None:
+            return Response(
+                {"Status": "Failure", "Message": "Магазин не найден"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        # сжимаем на лету, если клиент принимает gzip
+        compress = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        response = StreamingHttpResponse(
+            iter_export(shop.id, output, compress=compress),
+            content_type=EXPORT_CONTENT_TYPES[output],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="shop-{shop.id}.{output}"'
         )
+        response["Vary"] = "Accept-Encoding"
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        return response
 
 
 class PartnerOrdersView(APIView):
@@ -369,45 +459,75 @@ class PartnerOrdersView(APIView):
 
     permission_classes = [IsAuthenticated, IsShop]
     serializer_class = OrderSerializer
+    pagination_class = OrderFeedPagination
 
     def get(self, request, *args, **kwargs):
-        order = (
-            Order.objects.filter(
-                # ordered_items__product_info__shop__user_id=request.user.id
-            )
+        """
+        лента заказов с позициями магазина, ?since= - только изменения
+        """
+        shop_items = OrderItem.objects.filter(
+            product_info__shop__user_id=request.user.id
+        )
+        orders = (
+            Order.objects.filter(id__in=shop_items.values("order_id"))
             .exclude(status="basket")
-            .prefetch_related(
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
+            .with_shop_totals(shop_items)
             .select_related("contact")
-            .annotate(
-                total_sum=Sum(
-                    F("ordered_items__quantity")
-                    * F("ordered_items__product_info__price")
-                )
-            )
-            .distinct()
+            .prefetch_related(Prefetch("ordered_items", queryset=shop_items))
         )
 
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = PartnerOrderSerializer(page, many=True)
+        with measure_serialization(request):
+            data = serializer.data
+        return paginator.get_paginated_response(data)
 
     def post(self, request, *args, **kwargs):
-        order_id = request.data.get("order_id")
-        new_status = request.data.get("status")
-        try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
+        serializer = OrderStatusChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        (result,) = change_order_statuses(
+            [
+                (
+                    serializer.validated_data["order_id"],
+                    serializer.validated_data["status"],
+                )
+            ],
+            shop_user_id=request.user.id,
+        )
+        if result["result"] == "failure":
             return Response(
-                {"status": "failure", "message": "Заказ не наиден"},
-                status=status.HTTP_404_NOT_FOUND,
+                {"status": "failure", "message": result["message"]},
+                status=(
+                    status.HTTP_404_NOT_FOUND
+                    if result["status"] is None
+                    else status.HTTP_400_BAD_REQUEST
+                ),
             )
+        serializer = OrderSerializer(Order.objects.get(id=result["order_id"]))
+        with measure_serialization(request):
+            data = serializer.data
+        return Response(data)
+
 
-        order.status = new_status
-        order.save()
-        serializer = OrderSerializer(order)
-        return Response(serializer.data)
+class PartnerOrdersStatusView(APIView):
+    """
+    Класс для смены статусов пачки заказов поставщиком
+    """
+
+    permission_classes = [IsAuthenticated, IsShop]
+
+    def post(self, request, *args, **kwargs):
+        serializer = OrderStatusChangeListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = change_order_statuses(
+            [
+                (change["order_id"], change["status"])
+                for change in serializer.validated_data["orders"]
+            ],
+            shop_user_id=request.user.id,
+        )
+        return Response({"Status": "Success", "Results": results})
 
 
 class ContactView(APIView):
@@ -421,14 +541,18 @@ class ContactView(APIView):
     def get(self, request, *args, **kwargs):
         contact = Contact.objects.filter(user=request.user)
         serializer = ContactSerializer(contact, many=True)
-        return Response(serializer.data)
+        with measure_serialization(request):
+            data = serializer.data
+        return Response(data)
 
     def post(self, request, *args, **kwargs):
         request.data["user"] = request.user.id
         serializer = ContactSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with measure_serialization(request):
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
 
     def put(self, request, *args, **kwargs):
         request.data["user"] = request.user.id
@@ -436,7 +560,9 @@ class ContactView(APIView):
         serializer = ContactSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data)
+        with measure_serialization(request):
+            data = serializer.data
+        return Response(data)
 
     def delete(self, request, *args, **kwargs):
         contact = Contact.objects.all()
@@ -457,25 +583,10 @@ class OrderView(APIView):
 
     # получить мои заказы
     def get(self, request, *args, **kwargs):
-        order = (
-            Order.objects.filter(user_id=request.user.id)
-            .exclude(status="basket")
-            .prefetch_related(
-                "ordered_items__product_info__product__category",
-                "ordered_items__product_info__product_parameters__parameter",
-            )
-            .select_related("contact")
-            .annotate(
-                total_sum=Sum(
-                    F("ordered_items__quantity")
-                    * F("ordered_items__product_info__price")
-                )
-            )
-            .distinct()
-        )
-
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        orders = Order.objects.filter(user_id=request.user.id).exclude(status="basket")
+        with measure_serialization(request):
+            data = serialize_orders(orders)
+        return Response(data)
 
 
 class OrderConfirmView(APIView):
@@ -488,28 +599,36 @@ class OrderConfirmView(APIView):
 
     # разместить заказ из корзины
     def post(self, request, *args, **kwargs):
+        basket = get_basket(request.user)
+        # корзина из Redis записывается в базу только перед подтверждением
+        basket.materialize()
         serializer = OrderConfirmSerializer(
             data=request.data, context={"request": request}
         )
         if serializer.is_valid(raise_exception=True):
-            basket = (
-                Order.objects.filter(user=self.request.user, status="basket")
-                .prefetch_related("ordered_items")
-                .annotate(
-                    total_sum=Sum(
-                        F("ordered_items__quantity")
-                        * F("ordered_items__product_info__price")
-                    )
-                )
-                .first()
-            )
-            response = OrderSerializer(basket)
             user = request.user
             order = serializer.validated_data
-            order.status = "new"
-            order.save()
-            new_order_signal_user(user)
-            new_order_signal_admin()
+            try:
+                with transaction.atomic():
+                    place_order(order, order.contact)
+                    new_order_signal_user(user, order.id)
+                    new_order_signal_admin(order.id)
+            except InsufficientStock as error:
+                return Response(
+                    {
+                        "Status": "Failure",
+                        "Message": "Недостаточно товара на складе",
+                        "Items": error.product_info_ids,
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+            except OrderStatusConflict:
+                return Response(
+                    {"Status": "Failure", "Message": "Неверный статус заказа"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            basket.forget()
+            notify_orders_changed([order.id])
 
             return Response(
                 {"Status": "Success", "Message": "Заказ создан"},
@@ -517,3 +636,32 @@ class OrderConfirmView(APIView):
             )
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class OrderEventsView(APIView):
+    """
+    Класс для ожидания изменений заказов (long polling)
+
+    Запрос висит до ORDER_EVENTS_TIMEOUT секунд, пока в потоке пользователя
+    не появятся события после курсора since, и не обращается к базе.
+    Все это время он занимает воркер: при синхронных воркерах ожидание
+    должно быть коротким.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        params = OrderEventsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        try:
+            events, since = read_order_events(
+                request.user.id,
+                params.validated_data.get("since"),
+                params.validated_data["timeout"],
+            )
+        except (RedisError, OSError):
+            return Response(
+                {"Status": "Failure", "Message": "События временно недоступны"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        return Response({"since": since, "events": events})
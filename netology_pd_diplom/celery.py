@@ -1,8 +1,7 @@
 import os
 
 from celery import Celery
-
-# from celery.result import AsyncResult
+from celery.result import AsyncResult
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "netology_pd_diplom.settings")
 
@@ -12,5 +11,6 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 app.autodiscover_tasks()
 
-# def get_result(task_id: str) -> AsyncResult:
-#     return AsyncResult(task_id, app=app)
+
+def get_result(task_id: str) -> AsyncResult:
+    return AsyncResult(task_id, app=app)
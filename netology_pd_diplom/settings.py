@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework.authtoken",
     "django_rest_passwordreset",
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "backend.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -145,20 +147,156 @@ EMAIL_PORT = os.getenv("EMAIL_PORT")
 EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL")
 SERVER_EMAIL = EMAIL_HOST_USER
 
+# очередь писем в Redis: письма копятся MAIL_FLUSH_DELAY секунд и уходят
+# пачками по MAIL_BATCH_SIZE через одно SMTP-соединение; при ошибке SMTP
+# отправка повторяется через MAIL_RETRY_DELAY * 2^попытка секунд (не больше
+# MAIL_RETRY_MAX_DELAY), письмо выбрасывается после MAIL_MAX_ATTEMPTS неудач.
+# О новых заказах админ получает одно письмо раз в ADMIN_DIGEST_INTERVAL секунд
+MAIL_REDIS_URL = os.getenv("MAIL_REDIS_URL", "redis://127.0.0.1:6379/4")
+MAIL_FLUSH_DELAY = 5
+MAIL_BATCH_SIZE = 100
+MAIL_RETRY_DELAY = 10
+MAIL_RETRY_MAX_DELAY = 10 * 60
+MAIL_MAX_ATTEMPTS = 5
+# очередь разбирает один процесс: блокировка снимается через столько секунд,
+# если он упал, не освободив ее
+MAIL_FLUSH_LOCK_TIMEOUT = 10 * 60
+ADMIN_DIGEST_INTERVAL = 10 * 60
+
+# события (письма о регистрации и заказах) пишутся в таблицу OutboxEvent
+# в одной транзакции с изменением и разбираются пачками по OUTBOX_BATCH_SIZE
+# задачей relay_outbox_task раз в OUTBOX_RELAY_INTERVAL секунд
+# или отдельным процессом python manage.py relay_outbox. Событие с ошибкой
+# обработчика повторяется при следующих разборах, после OUTBOX_MAX_ATTEMPTS
+# неудач откладывается (OutboxEvent.failed_at) и не блокирует остальные
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RELAY_INTERVAL = 5
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 40,
     "DEFAULT_RENDERER_CLASSES": (
-        "rest_framework.renderers.JSONRenderer",
+        "backend.renderers.UJSONRenderer",
         "rest_framework.renderers.BrowsableAPIRenderer",
     ),
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        "backend.authentication.CachedTokenAuthentication",
     ),
 }
 
+# снимки токена и пользователя для аутентификации: в Redis (CACHES)
+# на AUTH_CACHE_TTL секунд и в памяти процесса на AUTH_CACHE_LOCAL_TTL;
+# сигналы сбрасывают их при удалении токена и сохранении пользователя
+AUTH_CACHE_TTL = 60
+AUTH_CACHE_LOCAL_TTL = 5
+AUTH_CACHE_LOCAL_SIZE = 10000
+
+# показатели запросов по эндпоинтам: отдаются в формате Prometheus
+# по адресу /metrics (с METRICS_TOKEN - только с заголовком
+# Authorization: Bearer <токен>, без него - только при DEBUG)
+# и пишутся в лог backend.metrics
+METRICS_LOG = True
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# нагрузочные замеры (run_benchmarks, explain_queries) пишут в базу и удаляют
+# свои данные, поэтому идут только на базе с этим именем (DB_NAME)
+BENCHMARK_DATABASE = os.getenv("BENCHMARK_DATABASE", "")
+# наибольшее число запросов к базе на запрос к эндпоинту: превышение
+# пишется в лог, а тесты с QueryBudgetMixin падают. Значения сняты
+# тестами backend/tests/test_metrics.py с чтением токена из базы;
+# order_confirm резервирует товар UPDATE на позицию и посчитан
+# для корзины из пяти позиций
+QUERY_BUDGETS = {
+    "backend:products": 4,
+    "backend:product-search": 7,
+    "backend:shops": 3,
+    "backend:categories": 3,
+    "backend:basket": 8,
+    "backend:order": 2,
+    "backend:order_confirm": 19,
+    "backend:partner-orders": 11,
+    "backend:partner-orders-status": 9,
+    "backend:user-contact": 3,
+    "backend:user-details": 4,
+    "backend:user-register": 5,
+    "backend:user-login": 5,
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", "redis://127.0.0.1:6379/1"),
+    }
+}
+
+# сколько секунд хранится закэшированный ответ каталога; после загрузки
+# прайса или изменения магазина он сбрасывается раньше сменой версии
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# хранилище корзин: "database" - заказ со статусом basket,
+# "redis" - хэш в Redis, который записывается в базу при подтверждении
+# заказа и раз в BASKET_FLUSH_INTERVAL секунд
+BASKET_BACKEND = os.getenv("BASKET_BACKEND", "database")
+BASKET_REDIS_URL = os.getenv("BASKET_REDIS_URL", "redis://127.0.0.1:6379/2")
+BASKET_TTL = 30 * 24 * 60 * 60
+BASKET_FLUSH_INTERVAL = 5 * 60
+
+# выгрузка позиций магазина (partner/export) читает базу и отдает
+# ответ кусками по столько строк
+EXPORT_CHUNK_SIZE = 2000
+
+# сколько заказов можно перевести в другой статус одним запросом
+ORDER_STATUS_BATCH_SIZE = 5000
+
+# события об изменении заказов: потоки Redis по пользователям,
+# ORDER_EVENTS_TIMEOUT - сколько секунд максимум ждет запрос order/events.
+# Ждущий запрос занимает синхронный воркер целиком, поэтому ожидание
+# короткое; долгое (20-30 с) - только с воркерами gevent или ASGI
+ORDER_EVENTS_REDIS_URL = os.getenv("ORDER_EVENTS_REDIS_URL", "redis://127.0.0.1:6379/3")
+ORDER_EVENTS_TIMEOUT = int(os.getenv("ORDER_EVENTS_TIMEOUT", "5"))
+ORDER_EVENTS_BATCH = 100
+ORDER_EVENTS_MAXLEN = 1000
+ORDER_EVENTS_TTL = 7 * 24 * 60 * 60
+
+# лента заказов магазина отдает заказы, измененные не позже чем столько
+# секунд назад: более свежие могут быть в незавершенных транзакциях
+PARTNER_ORDERS_FEED_LAG = 2
+
 CELERY_BROKER_URL = "redis://127.0.0.1:6379"
 CELERY_RESULT_BACKEND = "redis://127.0.0.1:6379"
+CELERY_TASK_TRACK_STARTED = True
+CELERY_BEAT_SCHEDULE = {
+    "relay-outbox": {
+        "task": "backend.tasks.relay_outbox_task",
+        "schedule": OUTBOX_RELAY_INTERVAL,
+    },
+    "flush-baskets": {
+        "task": "backend.tasks.flush_baskets_task",
+        "schedule": BASKET_FLUSH_INTERVAL,
+    },
+    "send-admin-digest": {
+        "task": "backend.tasks.send_admin_digest_task",
+        "schedule": ADMIN_DIGEST_INTERVAL,
+    },
+    # подбираем письма, если задачу отправки не удалось запланировать
+    "send-queued-mail": {
+        "task": "backend.tasks.send_queued_mail_task",
+        "schedule": 60,
+    },
+}
 
+# загрузка прайсов: сколько секунд держится блокировка магазина
+# и через сколько секунд повторить загрузку, если магазин занят
+PRICE_IMPORT_LOCK_TIMEOUT = 60 * 60
+PRICE_IMPORT_RETRY_DELAY = 10
+
+# прайсы от этого размера (в байтах) режутся на части по PRICE_IMPORT_CHUNK_SIZE
+# позиций и разбираются параллельно, а в каталог пишутся одной транзакцией;
+# части лежат в PRICE_IMPORT_WORK_DIR - каталоге, общем для всех воркеров
+# (сетевой диск, если воркеры на разных машинах). Без него прайсы
+# не режутся и загружаются одной задачей
+PRICE_IMPORT_SHARD_SIZE = 50 * 1024 * 1024
+PRICE_IMPORT_CHUNK_SIZE = 20000
+PRICE_IMPORT_WORK_DIR = os.getenv("PRICE_IMPORT_WORK_DIR", "")